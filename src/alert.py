@@ -1,4 +1,12 @@
 class Alert:
-    def __init__(self, title, msg):
+    def __init__(self, title, msg, key=None):
         self.title = title
-        self.msg = msg
+        self._msg = msg
+        self.key = title if key is None else key
+
+    @property
+    def msg(self):
+        # rules hand over a callable so the text is only built for alerts that are actually sent
+        if callable(self._msg):
+            self._msg = self._msg()
+        return self._msg
@@ -0,0 +1,176 @@
+import argparse
+import contextlib
+import json
+import os
+import tempfile
+from time import time, perf_counter
+
+from fleet import Fleet
+from logger import get_logger
+from monitor import TempMonitor
+from monitor_setup import Setup
+from simulator import SimulatedPhone, Sl4aServer, Sl4aClient
+from smtp_server import LocalSmtpServer
+
+NORMAL_C = 25.0
+HOT_C = 40.0
+
+
+def bench_setup(smtp_port, workdir):
+    # back to back cycles against local servers; predictions off so only the scripted crossing alerts
+    return {"sleep_between_get_temp": 0, "sleep_after_send_sms": 0, "adaptive_sampling": False,
+            "process_input": False, "predict_horizon": 0, "calc_external_temp": True,
+            "temp_min": 50.0, "temp_max": 90.0, "low_battery": 70,
+            "phones_numbers": ["5550100"], "emails": ["bench@localhost"], "user": "bench", "password": "bench",
+            "smtp_host": "127.0.0.1", "smtp_port": smtp_port, "smtp_ssl": False, "smtp_starttls": False,
+            "readings_dir": os.path.join(workdir, "readings"), "outbox_dir": os.path.join(workdir, "outbox"),
+            "checkpoint_dir": os.path.join(workdir, "checkpoint"),
+            "fleet_error_retry": 0}
+
+
+def percentile(values, fraction):
+    if not values:
+        return float("nan")
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+class SimulatedDevice:
+    # one simulated phone behind its own SL4A server and the monitor sampling it
+
+    def __init__(self, index, cycles, alert_at, latency=0.0, jitter=0.0, error_rate=0.0):
+        self.phone = SimulatedPhone([NORMAL_C] * alert_at + [HOT_C], error_rate=error_rate, seed=index)
+        self.server = Sl4aServer(self.phone, latency, jitter).start()
+        self.monitor = TempMonitor(self.server.address, "sim%d" % index)
+        self.monitor.connection.factory = Sl4aClient
+        self.cycles = cycles
+        self.cycle_times = []
+        self.alerted_at = None
+        self.wrap(self.monitor.run_cycle, self.monitor.send_notification)
+
+    def wrap(self, run_cycle, send_notification):
+        def timed_cycle():
+            started = perf_counter()
+            try:
+                return run_cycle()
+            finally:
+                self.cycle_times.append(perf_counter() - started)
+                if len(self.cycle_times) >= self.cycles:
+                    self.monitor.stop = True
+
+        def timed_notification(alerts):
+            if self.alerted_at is None:
+                self.alerted_at = time()
+            return send_notification(alerts)
+
+        self.monitor.run_cycle = timed_cycle
+        self.monitor.send_notification = timed_notification
+
+    def sms_delivered_at(self):
+        return self.phone.sent_sms[0][0] if self.phone.sent_sms else None
+
+    def email_delivered_at(self, smtp):
+        tag = "[%s]" % self.monitor.name
+        for (sender, recipients, message), received in zip(smtp.messages, smtp.received):
+            if tag in message.get_payload(decode=True).decode():
+                return received
+        return None
+
+    def close(self):
+        self.monitor.close()
+        self.server.stop()
+
+
+def delivery_latencies(devices, delivered_at):
+    latencies = []
+    for device in devices:
+        at = delivered_at(device)
+        if device.alerted_at is not None and at is not None:
+            latencies.append(at - device.alerted_at)
+    return latencies
+
+
+def run_benchmark(devices=1, cycles=20, latency=0.005, jitter=0.2, error_rate=0.0, workers=None, verbose=False):
+    smtp = LocalSmtpServer().start()
+    saved = {}
+    with tempfile.TemporaryDirectory() as workdir, contextlib.ExitStack() as stack:
+        if not verbose:
+            stack.enter_context(contextlib.redirect_stdout(stack.enter_context(open(os.devnull, "w"))))
+        for name, value in bench_setup(smtp.port, workdir).items():
+            saved[name] = getattr(Setup, name)
+            setattr(Setup, name, value)
+        sims = []
+        try:
+            sims = [SimulatedDevice(i, cycles, cycles // 2, latency, jitter, error_rate) for i in range(devices)]
+            fleet = Fleet([sim.monitor for sim in sims], workers)
+            started = perf_counter()
+            fleet.run()
+            elapsed = perf_counter() - started
+        finally:
+            # closing drains the dispatchers, so every queued alert has been delivered or failed
+            for sim in sims:
+                sim.close()
+            smtp.stop()
+            get_logger().flush()
+            for name, value in saved.items():
+                setattr(Setup, name, value)
+
+    cycle_times = [t for sim in sims for t in sim.cycle_times]
+    total_cycles = len(cycle_times)
+    sms = delivery_latencies(sims, SimulatedDevice.sms_delivered_at)
+    email = delivery_latencies(sims, lambda sim: sim.email_delivered_at(smtp))
+    return {"devices": devices,
+            "cycles": total_cycles,
+            "errors": fleet.errors,
+            "seconds": elapsed,
+            "cycles_per_second": total_cycles / elapsed if elapsed else float("nan"),
+            "cycle_ms_p50": percentile(cycle_times, 0.5) * 1000,
+            "cycle_ms_p95": percentile(cycle_times, 0.95) * 1000,
+            "cycle_ms_max": max(cycle_times) * 1000 if cycle_times else float("nan"),
+            "rpcs_per_cycle": sum(sim.phone.rpc_count() for sim in sims) / max(total_cycles, 1),
+            "wakelock_ms_per_cycle": sum(sim.phone.wake_lock_seconds for sim in sims) * 1000 / max(total_cycles, 1),
+            "alerts": sum(1 for sim in sims if sim.alerted_at is not None),
+            "sms_delivery_ms": percentile(sms, 0.5) * 1000,
+            "email_delivery_ms": percentile(email, 0.5) * 1000,
+            "emails_delivered": len(email)}
+
+
+COLUMNS = [("devices", "%7d"), ("cycles", "%7d"), ("errors", "%6d"), ("cycles_per_second", "%9.1f"),
+           ("cycle_ms_p50", "%8.1f"), ("cycle_ms_p95", "%8.1f"), ("cycle_ms_max", "%8.1f"),
+           ("rpcs_per_cycle", "%6.1f"), ("wakelock_ms_per_cycle", "%9.1f"),
+           ("sms_delivery_ms", "%8.1f"), ("email_delivery_ms", "%8.1f")]
+HEADERS = ["devices", "cycles", "errors", "cycles/s", "p50 ms", "p95 ms", "max ms", "rpcs", "wl ms", "sms ms",
+           "email ms"]
+
+
+def format_report(reports):
+    widths = [len(fmt % 0) for name, fmt in COLUMNS]
+    lines = [" ".join(header.rjust(width) for header, width in zip(HEADERS, widths))]
+    for report in reports:
+        lines.append(" ".join(fmt % report[name] for name, fmt in COLUMNS))
+    return "\n".join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark monitor cycles against simulated SL4A devices")
+    parser.add_argument("--devices", type=int, nargs="+", default=[1, 10], help="device counts to run")
+    parser.add_argument("--cycles", type=int, default=20, help="cycles per device")
+    parser.add_argument("--latency", type=float, default=0.005, help="seconds per RPC round trip")
+    parser.add_argument("--jitter", type=float, default=0.2, help="latency jitter as a fraction")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of RPCs that fail")
+    parser.add_argument("--workers", type=int, help="fleet worker threads")
+    parser.add_argument("--json", action="store_true", help="print JSON instead of a table")
+    parser.add_argument("--verbose", action="store_true", help="show the monitors' log")
+    args = parser.parse_args(argv)
+
+    reports = [run_benchmark(n, args.cycles, args.latency, args.jitter, args.error_rate, args.workers,
+                             args.verbose)
+               for n in args.devices]
+    if args.json:
+        print(json.dumps(reports, indent=2))
+    else:
+        print(format_report(reports))
+
+
+if __name__ == "__main__":
+    main()
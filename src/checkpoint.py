@@ -0,0 +1,37 @@
+import json
+import os
+
+VERSION = 1
+
+
+class Checkpoint:
+    # one small JSON snapshot per monitor, replaced atomically so a crash leaves the old one or the new one
+
+    def __init__(self, path):
+        self.path = path
+        self.saved_at = 0
+        self.saves = 0
+
+    def load(self):
+        try:
+            with open(self.path) as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if not isinstance(state, dict) or state.get("version") != VERSION:
+            return None
+        return state
+
+    def save(self, state, now):
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        state = dict(state, version=VERSION, saved_at=now)
+        tmp = self.path + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump(state, f, separators=(",", ":"))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.path)
+        self.saved_at = now
+        self.saves += 1
@@ -0,0 +1,55 @@
+import threading
+import time
+from datetime import datetime
+
+
+class Clock:
+    # wall time; everything that reads the time or sleeps goes through a clock so replay can swap it
+
+    def time(self):
+        return time.time()
+
+    def sleep(self, seconds):
+        time.sleep(seconds)
+
+    def wait(self, event, seconds):
+        # a sleep that ends early once the event is set
+        return event.wait(seconds)
+
+    def now(self):
+        return datetime.fromtimestamp(self.time())
+
+    def today(self):
+        return self.now().date()
+
+
+class VirtualClock(Clock):
+    # time only moves when someone sleeps, so a day of sleeps passes at CPU speed
+
+    def __init__(self, start=None):
+        self.current = time.time() if start is None else start
+        self.lock = threading.Lock()
+        self.slept = 0.0
+
+    def time(self):
+        return self.current
+
+    def sleep(self, seconds):
+        self.advance(seconds)
+
+    def wait(self, event, seconds):
+        if not event.is_set():
+            self.advance(seconds)
+        return event.is_set()
+
+    def advance(self, seconds):
+        if seconds > 0:
+            with self.lock:
+                self.current += seconds
+                self.slept += seconds
+
+    def advance_to(self, timestamp):
+        self.advance(timestamp - self.current)
+
+
+SYSTEM = Clock()
@@ -0,0 +1,292 @@
+import argparse
+import http.server
+import json
+import math
+import os
+import re
+import threading
+from urllib.parse import urlsplit, parse_qs
+
+from alert import Alert
+from clock import SYSTEM
+from config import get_config
+from dispatcher import Dispatcher
+from logger import compact_exception
+from mailer import SmtpSession
+from metrics import get_registry, Periodic
+from monitor import TempMonitor, c_to_f, compile_rules, rules_signature, log
+from monitor_setup import Setup
+from notify import Notifier
+from readings import RECORD, ReadingStore
+from rules import RuleState
+
+PUSH_PATH = "/push"
+STATUS_PATH = "/status"
+# (boot, seq) last acknowledged per device, so a restarted collector still skips resends
+ACKED_FILE = "acked.json"
+# device names become file names under the readings root
+DEVICE_NAME = re.compile(r"[\w.:-]+")
+
+
+def record_sample(record):
+    timestamp, battery_status, battery_level, temp_c, external_temp_c = record
+    # the phone alerts on the external estimate when it made one, and so do we
+    temp_f = c_to_f(temp_c if math.isnan(external_temp_c) else external_temp_c)
+    return {"battery_status": battery_status, "battery_level": battery_level, "temp_f": temp_f}
+
+
+class Collector:
+    # readings pushed by many monitors land in one ReadingStore per device; the rules run here
+    # and the notifier is shared, so the phones only sample and push
+
+    def __init__(self, root=None, channels=None, clock=SYSTEM):
+        self.root = Setup.readings_dir if root is None else root
+        self.channels = [("email", self.send_email_notification)] if channels is None else channels
+        self.clock = clock
+        self.metrics = get_registry()
+        self.config = get_config()
+        self.lock = threading.Lock()
+        self.stores = {}
+        self.states = {}
+        self.acked = self.load_acked()
+        self.latest = {}
+        self.seen = {}
+        self.plans = {}
+        self.notifier = Notifier()
+        self.dispatcher = Dispatcher(on_outcome=self.log_delivery) if Setup.async_notifications else None
+        self.mailer = None
+        self.batches = 0
+        self.records = 0
+        self.duplicates = 0
+
+    def load_acked(self):
+        if not self.root:
+            return {}
+        try:
+            with open(os.path.join(self.root, ACKED_FILE)) as f:
+                return {device: tuple(acked) for device, acked in json.load(f).items()}
+        except (OSError, ValueError):
+            return {}
+
+    def save_acked(self):
+        path = os.path.join(self.root, ACKED_FILE)
+        with open(path + ".tmp", "w") as f:
+            json.dump(self.acked, f)
+        os.replace(path + ".tmp", path)
+
+    def setup_for(self, device):
+        if self.config is None:
+            return Setup
+        self.config.check()
+        return self.config.snapshot(device)
+
+    def rule_plan(self, setup):
+        # devices with the same thresholds share one compiled plan
+        signature = rules_signature(setup)
+        plan = self.plans.get(signature)
+        if plan is None:
+            plan = self.plans[signature] = compile_rules(setup)
+        return plan
+
+    def open_store(self, device):
+        store = self.stores.get(device)
+        if store is None and self.root:
+            store = self.stores[device] = ReadingStore(self.root, device.replace(":", "-"),
+                                                       Setup.readings_segment_records, Setup.readings_ring_size)
+        return store
+
+    def ingest(self, device, data, boot, seq):
+        # data is whole RECORDs numbered from seq by the client's boot; anything up to the last
+        # acknowledged number is a resend after a lost reply and is skipped. Returns the number to
+        # acknowledge, -1 before anything arrived from that boot.
+        if len(data) % RECORD.size:
+            raise ValueError("Batch of %d bytes is not whole records" % len(data))
+        with self.lock:
+            acked_boot, acked = self.acked.get(device, (None, -1))
+            if acked_boot != boot:
+                acked = -1
+            store = self.open_store(device)
+            setup = self.setup_for(device)
+            plan = self.rule_plan(setup)
+            state = self.states.setdefault(device, RuleState())
+            record = fired = None
+            for n, record in enumerate(RECORD.iter_unpack(data), seq):
+                if n <= acked:
+                    self.duplicates += 1
+                    continue
+                if store is not None:
+                    store.append(*record)
+                fired = plan.evaluate(record_sample(record), state, record[0])
+                acked = n
+                self.latest[device] = record[0]
+                self.records += 1
+                self.metrics.inc("collector_records", device=device)
+            self.acked[device] = (boot, acked)
+            self.seen[device] = self.clock.time()
+            self.batches += 1
+        if fired is not None:
+            # only the newest reading of the batch alerts, a backlog is history by the time it arrives
+            self.notify(device, record, fired, setup)
+        return acked
+
+    def notify(self, device, record, fired, setup=Setup):
+        sample = record_sample(record)
+        info = TempMonitor.make_info_string(TempMonitor.battery_to_string(record[1], record[2]), sample["temp_f"])
+        alerts = [Alert(rule.title, lambda rule=rule: rule.format(sample, info), rule.key) for rule in fired]
+        now = self.clock.time()
+        if alerts:
+            self.notifier.submit(device, alerts, now, [name for name, send in self.channels],
+                                 setup.notify_repeat_interval)
+        else:
+            self.notifier.resolve(device)
+            if self.notifier.pending_count() == 0:
+                return
+            # a digest the rate limit held back goes out once tokens are back, new alerts or not
+        if self.dispatcher is None:
+            self.notifier.flush(self.channels, now)
+        elif not self.dispatcher.submit("notify", lambda: self.notifier.flush(self.channels, self.clock.time())):
+            log("Notification queue full, %d alerts pending" % self.notifier.pending_count())
+
+    def active(self, device):
+        state = self.states.get(device)
+        return [] if state is None else sorted(state.active)
+
+    def status(self):
+        with self.lock:
+            return {device: {"acked": self.acked[device][1], "latest": self.latest.get(device),
+                             "seen": self.seen[device], "active": self.active(device)}
+                    for device in self.seen}
+
+    def send_email_notification(self, alert):
+        if self.mailer is None:
+            self.mailer = SmtpSession(clock=self.clock, metrics=self.metrics, name="collector")
+        log("Emailing to %s:" % Setup.emails, alert.title)
+        try:
+            return self.mailer.send(Setup.emails, alert.title, alert.msg) == {}
+        except Exception:
+            log("Sending email failed:", compact_exception(), level="error")
+            return False
+
+    def keepalive(self):
+        if self.mailer is not None:
+            self.mailer.keepalive()
+
+    def log_delivery(self, outcome):
+        if outcome.error is not None:
+            self.metrics.inc("failures", device="collector", op="delivery")
+            log("Notification delivery failed after %.1fs:" % outcome.latency, outcome.error, level="error")
+
+    def flush(self):
+        # appends only touch the mapped segments; this is when they reach the disk
+        with self.lock:
+            for store in self.stores.values():
+                store.flush()
+            if self.root and self.acked:
+                self.save_acked()
+
+    def close(self):
+        if self.dispatcher is not None:
+            self.dispatcher.stop()
+        with self.lock:
+            for store in self.stores.values():
+                store.close()
+            self.stores.clear()
+            if self.root and self.acked:
+                self.save_acked()
+        if self.mailer is not None:
+            self.mailer.close()
+
+
+class CollectorHandler(http.server.BaseHTTPRequestHandler):
+
+    def do_POST(self):
+        url = urlsplit(self.path)
+        query = parse_qs(url.query)
+        device = query.get("device", [None])[0]
+        if url.path != PUSH_PATH or not device:
+            self.send_error(404)
+            return
+        if not DEVICE_NAME.fullmatch(device) or device.strip(".") == "":
+            self.send_error(400, "bad device name")
+            return
+        data = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        boot, seq = query.get("boot", [None])[0], query.get("seq", [""])[0]
+        if not boot or not seq.isdigit():
+            self.send_error(400, "boot and seq are required")
+            return
+        try:
+            acked = self.server.collector.ingest(device, data, boot, int(seq))
+        except ValueError as err:
+            self.send_error(400, str(err))
+            return
+        self.reply({"ack": acked, "active": self.server.collector.active(device)})
+
+    def do_GET(self):
+        if urlsplit(self.path).path != STATUS_PATH:
+            self.send_error(404)
+            return
+        self.reply(self.server.collector.status())
+
+    def reply(self, value):
+        body = json.dumps(value).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class CollectorServer(http.server.ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, collector, port=None, host="127.0.0.1"):
+        super().__init__((host, Setup.collector_port if port is None else port), CollectorHandler)
+        self.collector = collector
+        self.thread = None
+        self.flusher = None
+        self.keepalive = None
+
+    @property
+    def url(self):
+        return "http://%s:%d%s" % (self.server_address[0], self.server_address[1], PUSH_PATH)
+
+    def start(self):
+        self.flusher = Periodic(self.collector.flush, Setup.collector_flush_interval, "collector-flush").start()
+        if Setup.smtp_keepalive:
+            self.keepalive = Periodic(self.collector.keepalive, Setup.smtp_keepalive, "smtp-keepalive").start()
+        self.thread = threading.Thread(target=self.serve_forever, name="collector-http", daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+        if self.flusher is not None:
+            self.flusher.stop()
+        if self.keepalive is not None:
+            self.keepalive.stop()
+        self.collector.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Collect readings pushed by monitors and alert on them")
+    parser.add_argument("--host", default="127.0.0.1", help="address to listen on")
+    parser.add_argument("--port", type=int, default=Setup.collector_port, help="port to listen on")
+    parser.add_argument("--readings", default=Setup.readings_dir, help="readings directory to store devices in")
+    args = parser.parse_args(argv)
+
+    server = CollectorServer(Collector(args.readings), args.port, args.host).start()
+    log("Collecting on %s" % server.url)
+    try:
+        server.thread.join()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+import ast
+import re
+from collections import deque
+
+from config import DEFAULTS, validate
+from monitor_setup import Setup
+
+ASSIGNMENT = re.compile(r"^\s*(?:Setup\.)?([A-Za-z]\w*)\s*=\s*(.+?)\s*$")
+
+
+class SmsIntake:
+    # remembers the highest message id handled so each poll only fetches what arrived since
+
+    attributes = ["_id", "date", "address", "body"]
+
+    def __init__(self, since, index_size=256):
+        self.since_ms = since.timestamp() * 1000
+        self.cursor = None
+        self.index = deque(maxlen=index_size)
+        self.processed = set()
+
+    def mark(self, msg_id):
+        if len(self.index) == self.index.maxlen:
+            self.processed.discard(self.index[0])
+        self.index.append(msg_id)
+        self.processed.add(msg_id)
+        self.cursor = max(self.cursor or 0, msg_id)
+
+    def is_new(self, msg_id):
+        return msg_id > (self.cursor or 0) and msg_id not in self.processed
+
+    def start(self, device):
+        # one full read of the inbox, ids and dates only, to place the cursor
+        (msgid, messages, error) = device.smsGetMessages(False, "inbox", self.attributes)
+        if error is not None:
+            raise RuntimeError("smsGetMessages returned error: %s" % error)
+        self.cursor = 0
+        new = []
+        for m in sorted(messages, key=lambda m: int(m["_id"])):
+            if int(m["date"]) >= self.since_ms:
+                new.append(m)
+            self.mark(int(m["_id"]))
+        return new
+
+    def poll(self, device):
+        if self.cursor is None:
+            return self.start(device)
+        (msgid, ids, error) = device.smsGetMessageIds(False, "inbox")
+        if error is not None:
+            raise RuntimeError("smsGetMessageIds returned error: %s" % error)
+        messages = []
+        for msg_id in sorted(int(i) for i in ids):
+            if not self.is_new(msg_id):
+                continue
+            (msgid, m, error) = device.smsGetMessageById(msg_id, self.attributes)
+            if error is None and m:
+                messages.append(m)
+            self.mark(msg_id)
+        return messages
+
+
+class CommandTable:
+    # "name = value" sets a Setup attribute, through the config when there is one so the value
+    # reaches every device's snapshot; other commands are looked up by their first word
+
+    def __init__(self, monitor, config=None):
+        self.monitor = monitor
+        self.config = config
+        self.verbs = {"stop": self.stop}
+
+    def execute(self, text):
+        match = ASSIGNMENT.match(text)
+        if match:
+            return self.assign(*match.groups())
+        words = text.split()
+        handler = self.verbs.get(words[0].lower()) if words else None
+        if handler is None:
+            raise ValueError("Unknown command")
+        return handler(*words[1:])
+
+    def assign(self, name, text):
+        if name not in DEFAULTS:
+            raise ValueError("Unknown setting %s" % name)
+        try:
+            value = ast.literal_eval(text)
+        except (ValueError, SyntaxError):
+            raise ValueError("Invalid value %s" % text)
+        if self.config is not None:
+            self.config.set(name, value)
+        else:
+            setattr(Setup, name, validate(name, value))
+        return True
+
+    def stop(self):
+        self.monitor.stop = True
+        return True
@@ -0,0 +1,248 @@
+import json
+import os
+import threading
+from collections import namedtuple
+
+from clock import SYSTEM
+from logger import get_logger
+from monitor_setup import Setup
+from rules import RulePlan, make_rule
+
+SECTIONS = ("defaults", "devices")
+
+
+def setting_names():
+    return sorted(name for name in vars(Setup) if not name.startswith("_"))
+
+
+# Setup's values as written, taken before any config file or command changed them
+DEFAULTS = {name: getattr(Setup, name) for name in setting_names()}
+NONE = type(None)
+# types for the settings whose default does not tell: None defaults, and directories None switches off
+TYPES = {"config_file": (str,), "log_file": (str,), "metrics_file": (str,), "profile_file": (str,),
+         "push_url": (str,), "sms_event": (str,), "metrics_port": (int,),
+         "readings_dir": (str, NONE), "outbox_dir": (str, NONE), "checkpoint_dir": (str, NONE)}
+# numbers are >= 0 unless signed; these must be above 0, they divide or bound a loop
+SIGNED = {"temp_min", "temp_max", "external_temp_offset_c"}
+POSITIVE = {"adaptive_margin_f", "adaptive_crossing_fraction", "adaptive_sleep_min", "adaptive_sleep_max",
+            "sleep_between_get_temp", "battery_poll_delay", "battery_poll_max_delay", "predict_window",
+            "fleet_workers", "readings_segment_records", "readings_ring_size", "push_batch_records",
+            "push_buffer_records", "metrics_interval", "profile_interval", "log_flush_interval",
+            "collector_flush_interval"}
+MAXIMUM = {"adaptive_crossing_fraction": 1, "smtp_port": 65535, "metrics_port": 65535, "collector_port": 65535}
+
+
+def is_number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+def validate_rules(specs):
+    # compiled as rule_plan() compiles them, next to the built-in rules whose keys they must not reuse;
+    # monitor imports this module, so the built-in rules are looked up when a value is checked
+    from monitor import builtin_rules
+    for spec in specs:
+        if not isinstance(spec, dict):
+            raise ValueError("rules expects objects")
+        for field in ("threshold", "hysteresis", "min_duration"):
+            if field in spec and not is_number(spec[field]):
+                raise ValueError("rules: %s of %s expects a number" % (field, spec.get("key")))
+    try:
+        plan = RulePlan(builtin_rules() + [make_rule(spec) for spec in specs])
+    except KeyError as err:
+        raise ValueError("rules: every rule needs %s" % err)
+    except (TypeError, ValueError) as err:
+        raise ValueError("rules: %s" % err)
+    sample = {"battery_status": 0, "battery_level": 0, "temp_f": 0.0}
+    for rule in plan.rules:
+        try:
+            rule.format(sample, "")
+        except (KeyError, TypeError, ValueError) as err:
+            raise ValueError("rules: message of %s does not format: %s" % (rule.key, err))
+    return specs
+
+
+def validate_limits(limits):
+    # channel: (tokens per second, burst), as the notifier's buckets take them
+    valid = {}
+    for channel, limit in limits.items():
+        if not (isinstance(channel, str) and isinstance(limit, (list, tuple)) and len(limit) == 2
+                and all(is_number(number) for number in limit)):
+            raise ValueError("notify_limits expects channel: [rate, burst]")
+        rate, burst = limit
+        if not (rate > 0 and burst >= 1):
+            raise ValueError("notify_limits: %s needs a rate above 0 and a burst of at least 1" % channel)
+        valid[channel] = (rate, burst)
+    return valid
+
+
+# settings whose values have a structure of their own, checked after the type
+STRUCTURED = {"rules": validate_rules, "notify_limits": validate_limits}
+
+
+def expected_types(name):
+    if name in TYPES:
+        return TYPES[name]
+    return (type(DEFAULTS[name]),)
+
+
+def validate(name, value):
+    # a setting keeps the type of its default, ints pass for floats, and numbers stay in range
+    if name not in DEFAULTS:
+        raise ValueError("Unknown setting %s" % name)
+    types = expected_types(name)
+    if value is None and NONE in types:
+        return value
+    if float in types and isinstance(value, int) and not isinstance(value, bool):
+        value = float(value)
+    if isinstance(value, (list, tuple)) and (list in types or tuple in types):
+        value = types[0](value)
+    if type(value) not in types:
+        raise ValueError("%s expects %s" % (name, " or ".join(t.__name__ for t in types)))
+    if type(value) in (int, float):
+        if name in POSITIVE and not value > 0:
+            raise ValueError("%s must be above 0" % name)
+        if name not in SIGNED and value < 0:
+            raise ValueError("%s must not be negative" % name)
+        if name in MAXIMUM and value > MAXIMUM[name]:
+            raise ValueError("%s must be at most %s" % (name, MAXIMUM[name]))
+    if name in STRUCTURED:
+        value = STRUCTURED[name](value)
+    return value
+
+
+def validate_section(values, errors, where):
+    if not isinstance(values, dict):
+        errors.append("%s must be an object" % where)
+        return {}
+    valid = {}
+    for name, value in values.items():
+        try:
+            valid[name] = validate(name, value)
+        except ValueError as err:
+            errors.append("%s: %s" % (where, err))
+    return valid
+
+
+def parse(text):
+    # {"defaults": {name: value}, "devices": {device: {name: value}}}; every error is reported at once
+    document = json.loads(text)
+    errors = []
+    if not isinstance(document, dict):
+        raise ValueError("Config must be an object")
+    for section in document:
+        if section not in SECTIONS:
+            errors.append("unknown section %s" % section)
+    defaults = validate_section(document.get("defaults", {}), errors, "defaults")
+    devices = {}
+    sections = document.get("devices", {})
+    if not isinstance(sections, dict):
+        errors.append("devices must be an object")
+        sections = {}
+    for device, values in sections.items():
+        devices[device] = validate_section(values, errors, "devices.%s" % device)
+    if errors:
+        raise ValueError("; ".join(errors))
+    return defaults, devices
+
+
+class Config:
+    # Setup's defaults, overridden by the file's defaults, then by its section for the device.
+    # A reload builds the new layers aside and swaps them in with one assignment; readers get
+    # an immutable snapshot per device that is only rebuilt after a change.
+
+    def __init__(self, path, clock=SYSTEM):
+        self.path = path
+        self.clock = clock
+        self.names = sorted(DEFAULTS)
+        self.base = DEFAULTS
+        self.settings = namedtuple("Settings", self.names)
+        self.lock = threading.Lock()
+        # (version, defaults, devices, overrides, snapshots), replaced whole
+        self.layers = (0, {}, {}, {}, {})
+        self.stamp = None
+        self.checked = clock.time()
+        self.reloads = 0
+        self.errors = 0
+        self.reload()
+
+    @property
+    def version(self):
+        return self.layers[0]
+
+    def file_stamp(self):
+        try:
+            stat = os.stat(self.path)
+        except OSError:
+            return None
+        return stat.st_mtime_ns, stat.st_size
+
+    def check(self):
+        # one stat every config_check_interval; returns True when a changed file was applied
+        now = self.clock.time()
+        if now - self.checked < Setup.config_check_interval:
+            return False
+        self.checked = now
+        if self.file_stamp() == self.stamp:
+            return False
+        return self.reload()
+
+    def reload(self):
+        with self.lock:
+            stamp = self.file_stamp()
+            if stamp == self.stamp:
+                return False
+            self.stamp = stamp
+            if stamp is None:
+                defaults, devices = {}, {}
+            else:
+                try:
+                    with open(self.path) as f:
+                        defaults, devices = parse(f.read())
+                except (OSError, ValueError) as err:
+                    # a half written or mistyped file leaves the running config alone
+                    self.errors += 1
+                    get_logger().log("error", None, ("Config %s not applied:" % self.path, err))
+                    return False
+            # the file is the source of truth again, runtime changes do not outlive an edit
+            self.apply(self.version + 1, defaults, devices, {})
+            self.reloads += 1
+        get_logger().log("info", None, ("Config %s applied, version %d" % (self.path, self.version),))
+        return True
+
+    def apply(self, version, defaults, devices, overrides):
+        self.layers = (version, defaults, devices, overrides, {})
+        # modules that read Setup directly see the fleet wide values
+        for name in self.names:
+            setattr(Setup, name, overrides.get(name, defaults.get(name, self.base[name])))
+
+    def set(self, name, value):
+        # a runtime change, e.g. an SMS command, for every device until the file changes
+        value = validate(name, value)
+        with self.lock:
+            version, defaults, devices, overrides, snapshots = self.layers
+            self.apply(version + 1, defaults, devices, dict(overrides, **{name: value}))
+
+    def snapshot(self, device=None):
+        version, defaults, devices, overrides, snapshots = self.layers
+        snapshot = snapshots.get(device)
+        if snapshot is None:
+            values = dict(self.base)
+            values.update(defaults)
+            values.update(devices.get(device, {}))
+            values.update(overrides)
+            snapshot = snapshots[device] = self.settings(**values)
+        return snapshot
+
+
+CONFIG = None
+CONFIG_LOCK = threading.Lock()
+
+
+def get_config():
+    # None unless Setup names a config file
+    global CONFIG
+    if CONFIG is None and Setup.config_file:
+        with CONFIG_LOCK:
+            if CONFIG is None:
+                CONFIG = Config(Setup.config_file)
+    return CONFIG
@@ -0,0 +1,105 @@
+import select
+import threading
+
+from clock import SYSTEM
+from metrics import NULL, InstrumentedDevice
+from monitor_setup import Setup
+from rpc import pipeline
+
+
+class SynchronizedDevice:
+    # serializes RPCs so the sampling loop and the notification dispatcher can share one socket
+
+    def __init__(self, device, lock):
+        self.device = device
+        self.lock = lock
+
+    def __getattr__(self, name):
+        attr = getattr(self.device, name)
+        if not callable(attr):
+            return attr
+
+        def call(*args):
+            with self.lock:
+                return attr(*args)
+        return call
+
+    def pipeline(self, calls):
+        with self.lock:
+            return pipeline(self.device, calls)
+
+
+class DeviceConnection:
+
+    def __init__(self, addr=None, factory=None, clock=SYSTEM, metrics=NULL, name=None, setup=Setup):
+        self.addr = addr
+        self.factory = factory
+        self.clock = clock
+        self.metrics = metrics
+        self.name = name
+        self.setup = setup
+        self.device = None
+        self.last_ok = 0
+        self.sim_checked = 0
+        self.connects = 0
+        self.lock = threading.RLock()
+
+    def open(self):
+        if self.factory is None:
+            import android
+            device = android.Android(self.addr)
+        else:
+            device = self.factory(self.addr)
+        if self.setup.rpc_timeout:
+            device.conn.settimeout(self.setup.rpc_timeout)
+        self.connects += 1
+        if self.metrics.enabled:
+            device = InstrumentedDevice(device, self.metrics, self.name)
+        self.device = SynchronizedDevice(device, self.lock)
+        self.last_ok = self.clock.time()
+        self.sim_checked = 0
+        return self.device
+
+    def attach(self, device):
+        if device is not self.device:
+            self.close()
+        self.device = device
+        self.last_ok = self.sim_checked = self.clock.time()
+
+    def get(self):
+        with self.lock:
+            if self.device is not None and not self.is_healthy():
+                self.close()
+            if self.device is None:
+                self.open()
+            return self.device
+
+    def is_healthy(self):
+        now = self.clock.time()
+        if now - self.last_ok < self.setup.health_check_interval:
+            return True
+        # an idle RPC socket has nothing to read; readable means EOF or a stray reply
+        try:
+            readable, writable, failed = select.select([self.device.conn], [], [self.device.conn], 0)
+        except (OSError, ValueError, TypeError):
+            return False
+        if readable or failed:
+            return False
+        self.last_ok = now
+        return True
+
+    def sim_check_due(self):
+        return self.clock.time() - self.sim_checked >= self.setup.sim_refresh_interval
+
+    def sim_checked_now(self):
+        self.sim_checked = self.clock.time()
+
+    def close(self):
+        with self.lock:
+            if self.device is None:
+                return
+            try:
+                self.device.conn.close()
+            except (OSError, AttributeError):
+                pass
+            self.device = None
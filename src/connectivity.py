@@ -0,0 +1,60 @@
+from clock import SYSTEM
+from monitor_setup import Setup
+from wifi import Wifi
+
+
+class WifiState:
+    unknown = "unknown"
+    connected = "connected"
+    scanning = "scanning"
+    reconnecting = "reconnecting"
+    down = "down"
+
+
+class WifiTracker:
+    # last known Wi-Fi state; trusted for wifi_state_ttl seconds so bursts of sends skip the RPCs
+
+    def __init__(self, clock=SYSTEM, setup=Setup):
+        self.clock = clock
+        self.setup = setup
+        self.state = WifiState.unknown
+        self.checked = 0
+        self.changes = 0
+        self.toggle_failures = 0
+        self.next_toggle = 0
+
+    def set(self, state, now=None):
+        if state != self.state:
+            self.changes += 1
+            self.state = state
+        self.checked = self.clock.time() if now is None else now
+        return state
+
+    def update(self, info, now=None):
+        if info[Wifi.state] == Wifi.state_completed and info[Wifi.ip] > 0:
+            return self.set(WifiState.connected, now)
+        if info[Wifi.state] == Wifi.state_scanning:
+            return self.set(WifiState.scanning, now)
+        return self.set(WifiState.reconnecting, now)
+
+    def is_connected(self, now=None):
+        now = self.clock.time() if now is None else now
+        return self.state == WifiState.connected and now - self.checked < self.setup.wifi_state_ttl
+
+    def may_toggle(self, now=None):
+        return (self.clock.time() if now is None else now) >= self.next_toggle
+
+    def toggle_failed(self, now=None):
+        now = self.clock.time() if now is None else now
+        self.toggle_failures += 1
+        delay = min(self.setup.wifi_backoff_max, self.setup.wifi_backoff_base * 2 ** (self.toggle_failures - 1))
+        self.next_toggle = now + delay
+        self.set(WifiState.down, now)
+
+    def toggle_succeeded(self, now=None):
+        self.toggle_failures = 0
+        self.next_toggle = 0
+        self.set(WifiState.reconnecting, now)
+
+    def invalidate(self):
+        self.checked = 0
@@ -0,0 +1,94 @@
+import queue
+import threading
+import traceback
+from collections import deque
+from time import time
+
+from monitor_setup import Setup
+
+
+class Outcome:
+    def __init__(self, name, result, error, submitted, finished):
+        self.name = name
+        self.result = result
+        self.error = error
+        self.submitted = submitted
+        self.finished = finished
+
+    @property
+    def latency(self):
+        return self.finished - self.submitted
+
+
+class Dispatcher:
+    # runs delivery jobs on one background thread so sampling never waits for the network
+
+    def __init__(self, size=None, on_outcome=None):
+        self.queue = queue.Queue(Setup.dispatch_queue_size if size is None else size)
+        self.on_outcome = on_outcome
+        self.outcomes = deque(maxlen=100)
+        self.thread = None
+        self.lock = threading.Lock()
+        self.completed = 0
+        self.failed = 0
+        self.dropped = 0
+        self.latency_total = 0.0
+        self.latency_max = 0.0
+
+    def start(self):
+        with self.lock:
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run, name="dispatcher", daemon=True)
+                self.thread.start()
+
+    def submit(self, name, job, on_outcome=None):
+        # on_outcome overrides the dispatcher's for this job, e.g. the submitting device's of a shared one
+        self.start()
+        try:
+            self.queue.put_nowait((name, job, time(), on_outcome or self.on_outcome))
+            return True
+        except queue.Full:
+            self.dropped += 1
+            return False
+
+    def depth(self):
+        return self.queue.qsize()
+
+    def run(self):
+        while True:
+            item = self.queue.get()
+            try:
+                if item is None:
+                    return
+                self.execute(*item)
+            finally:
+                self.queue.task_done()
+
+    def execute(self, name, job, submitted, on_outcome):
+        result = error = None
+        try:
+            result = job()
+        except Exception:
+            error = traceback.format_exc()
+        outcome = Outcome(name, result, error, submitted, time())
+        self.completed += 1
+        if error is not None:
+            self.failed += 1
+        self.latency_total += outcome.latency
+        self.latency_max = max(self.latency_max, outcome.latency)
+        self.outcomes.append(outcome)
+        if on_outcome is not None:
+            on_outcome(outcome)
+
+    def mean_latency(self):
+        return self.latency_total / self.completed if self.completed else 0.0
+
+    def stop(self, drain=True):
+        with self.lock:
+            thread, self.thread = self.thread, None
+        if thread is None:
+            return
+        if drain:
+            self.queue.join()
+        self.queue.put(None)
+        thread.join()
@@ -0,0 +1,137 @@
+import heapq
+import os
+import threading
+import traceback
+from concurrent.futures import Future, ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+from clock import SYSTEM
+from metrics import get_registry
+from monitor import TempMonitor, log
+from monitor_setup import Setup
+from outbox import Outbox
+
+
+def device_name(addr):
+    return "%s:%s" % tuple(addr)
+
+
+def run_monitor_cycle(monitor):
+    try:
+        return monitor.run_cycle()
+    finally:
+        try:
+            monitor.release_device()
+        except Exception:
+            # logged here, the cycle's own error is the one the fleet reports
+            log(traceback.format_exc(), level="error", device=monitor.name)
+
+
+class Fleet:
+
+    def __init__(self, monitors, workers=None, clock=SYSTEM):
+        self.monitors = monitors
+        self.workers = workers or Setup.fleet_workers
+        self.clock = clock
+        self.stopped = threading.Event()
+        self.queue = []
+        self.running = {}
+        self.seq = 0
+        self.cycles = 0
+        self.errors = 0
+
+    @staticmethod
+    def from_addresses(addresses, workers=None, clock=SYSTEM):
+        monitors = [TempMonitor(addr, device_name(addr), clock) for addr in addresses]
+        # one notifier and dispatcher for the whole fleet, so alerts of different devices share digests,
+        # rate limits and a single delivery thread; each device still logs the deliveries it submitted.
+        # A digest mixes devices, so it is journaled in the fleet's outbox whichever monitor sent it.
+        outbox = Outbox(os.path.join(Setup.outbox_dir, "fleet.jsonl"), "fleet") if Setup.outbox_dir else None
+        for monitor in monitors:
+            monitor.notifier = monitors[0].notifier
+            monitor.dispatcher = monitors[0].dispatcher
+            monitor.outbox = outbox
+        return Fleet(monitors, workers, clock)
+
+    def shutdown(self):
+        # e.g. from a signal handler; cycles in flight finish, nothing new starts.
+        # Setting the event also ends an idle wait for the next due cycle
+        self.stopped.set()
+        for monitor in self.monitors:
+            monitor.stop = True
+
+    def close(self):
+        # shared parts are closed by the first monitor, again they are no-ops
+        for monitor in self.monitors:
+            try:
+                monitor.close()
+            except Exception:
+                log(traceback.format_exc(), level="error", device=monitor.name)
+
+    def resume(self):
+        for monitor in self.monitors:
+            monitor.resume()
+
+    def schedule(self, monitor, due):
+        # seq breaks ties so monitors themselves are never compared
+        self.seq += 1
+        heapq.heappush(self.queue, (due, self.seq, monitor))
+
+    def submit_due(self, executor):
+        now = self.clock.time()
+        while self.queue and self.queue[0][0] <= now:
+            due, seq, monitor = heapq.heappop(self.queue)
+            self.running[executor.submit(run_monitor_cycle, monitor)] = monitor
+
+    def complete(self, future):
+        monitor = self.running.pop(future)
+        self.cycles += 1
+        try:
+            sleep_period = future.result()
+        except Exception:
+            self.errors += 1
+            get_registry().inc("failures", device=monitor.name, op="cycle")
+            log(traceback.format_exc(), level="error", device=monitor.name)
+            monitor.device = None
+            sleep_period = Setup.fleet_error_retry
+        if monitor.stop:
+            return
+        self.schedule(monitor, self.clock.time() + sleep_period)
+
+    def next_timeout(self):
+        if not self.queue:
+            return None
+        return max(0, self.queue[0][0] - self.clock.time())
+
+    def schedule_all(self):
+        now = self.clock.time()
+        for monitor in self.monitors:
+            self.schedule(monitor, now)
+
+    def run(self):
+        self.schedule_all()
+
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            while not self.stopped.is_set() and (self.queue or self.running):
+                self.submit_due(executor)
+                timeout = self.next_timeout()
+                if not self.running:
+                    self.clock.wait(self.stopped, timeout)
+                    continue
+                done, not_done = wait(self.running, timeout=timeout, return_when=FIRST_COMPLETED)
+                for future in done:
+                    self.complete(future)
+
+    def run_inline(self, until=None):
+        # one cycle at a time on the calling thread, sleeping the clock up to each due time;
+        # with a virtual clock the whole schedule runs at CPU speed and in a repeatable order
+        self.schedule_all()
+        while not self.stopped.is_set() and self.queue and (until is None or self.queue[0][0] < until):
+            due, seq, monitor = heapq.heappop(self.queue)
+            self.clock.sleep(max(0, due - self.clock.time()))
+            future = Future()
+            try:
+                future.set_result(run_monitor_cycle(monitor))
+            except Exception as err:
+                future.set_exception(err)
+            self.running[future] = monitor
+            self.complete(future)
@@ -0,0 +1,216 @@
+import atexit
+import gzip
+import json
+import os
+import shutil
+import sys
+import threading
+import traceback
+from collections import deque
+from datetime import datetime
+from time import time
+
+from monitor_setup import Setup
+
+TIME_FORMAT = "%a %x %X"
+
+
+def compact_exception(err=None):
+    # "ValueError: message (file.py:12 in func)" for the innermost frame, instead of the whole traceback
+    if err is None:
+        err = sys.exc_info()[1]
+    if err is None:
+        return ""
+    frames = traceback.extract_tb(err.__traceback__)
+    text = "%s: %s" % (type(err).__name__, err)
+    if frames:
+        frame = frames[-1]
+        text += " (%s:%d in %s)" % (os.path.basename(frame.filename), frame.lineno, frame.name)
+    return text
+
+
+def message_text(args):
+    return " ".join(str(arg) for arg in args)
+
+
+def format_text(record):
+    timestamp, level, device, args, fields = record
+    parts = [datetime.fromtimestamp(timestamp).strftime(TIME_FORMAT)]
+    if level != "info":
+        parts.append(level.upper())
+    if device is not None:
+        parts.append("[%s]" % device)
+    parts.append(message_text(args))
+    parts.extend("%s=%s" % (name, value) for name, value in fields.items())
+    return " ".join(parts)
+
+
+def format_json(record):
+    timestamp, level, device, args, fields = record
+    entry = {"time": datetime.fromtimestamp(timestamp).isoformat(timespec="milliseconds"), "level": level}
+    if device is not None:
+        entry["device"] = device
+    entry["msg"] = message_text(args)
+    entry.update(fields)
+    return json.dumps(entry, default=str)
+
+
+FORMATS = {"text": format_text, "json": format_json}
+
+
+class StreamSink:
+    # stdout by default, looked up per write so redirections apply
+
+    def __init__(self, stream=None):
+        self.stream = stream
+
+    def write(self, data):
+        stream = sys.stdout if self.stream is None else self.stream
+        stream.write(data)
+        stream.flush()
+
+    def close(self):
+        pass
+
+
+class RotatingFile:
+    # appends to path; past max_bytes or max_age the file becomes path.1.gz and older ones shift up to keep
+
+    def __init__(self, path, max_bytes=None, max_age=None, keep=None):
+        self.path = path
+        self.max_bytes = Setup.log_max_bytes if max_bytes is None else max_bytes
+        self.max_age = Setup.log_max_age if max_age is None else max_age
+        self.keep = Setup.log_keep if keep is None else keep
+        self.file = None
+        self.size = 0
+        self.opened = 0
+        self.rotations = 0
+
+    def open(self):
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.file = open(self.path, "a")
+        self.size = self.file.tell()
+        self.opened = time()
+
+    def rotated_path(self, n):
+        return "%s.%d.gz" % (self.path, n)
+
+    def due(self, incoming):
+        if self.size == 0:
+            return False
+        if self.max_bytes and self.size + incoming > self.max_bytes:
+            return True
+        return bool(self.max_age) and time() - self.opened >= self.max_age
+
+    def rotate(self):
+        self.file.close()
+        self.file = None
+        if os.path.exists(self.rotated_path(self.keep)):
+            os.remove(self.rotated_path(self.keep))
+        for n in range(self.keep - 1, 0, -1):
+            if os.path.exists(self.rotated_path(n)):
+                os.replace(self.rotated_path(n), self.rotated_path(n + 1))
+        if self.keep > 0:
+            with open(self.path, "rb") as src, gzip.open(self.rotated_path(1), "wb") as dst:
+                shutil.copyfileobj(src, dst)
+        os.remove(self.path)
+        self.rotations += 1
+
+    def write(self, data):
+        if self.file is None:
+            self.open()
+        if self.due(len(data)):
+            self.rotate()
+            self.open()
+        self.file.write(data)
+        self.file.flush()
+        self.size += len(data)
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+
+class Logger:
+    # log() only appends a record; formatting and I/O happen in batches on the flusher thread
+
+    def __init__(self, sink=None, fmt="text", flush_interval=1.0, max_pending=10000):
+        self.sink = StreamSink() if sink is None else sink
+        self.format = FORMATS[fmt]
+        self.flush_interval = flush_interval
+        self.pending = deque(maxlen=max_pending)
+        self.dropped = 0
+        self.written = 0
+        self.lock = threading.Lock()
+        # guards appends and the swap in flush(); never held across formatting or I/O like the flush lock
+        self.append_lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.stopped = False
+        self.thread = None
+
+    @staticmethod
+    def from_setup():
+        sink = None if Setup.log_file is None else RotatingFile(Setup.log_file)
+        return Logger(sink, Setup.log_format, Setup.log_flush_interval)
+
+    def start(self):
+        with self.lock:
+            if self.thread is None and not self.stopped:
+                self.thread = threading.Thread(target=self.run, name="log-flusher", daemon=True)
+                self.thread.start()
+
+    def log(self, level, device, args, fields=None, timestamp=None):
+        record = (time() if timestamp is None else timestamp, level, device, args, fields or {})
+        with self.append_lock:
+            if len(self.pending) == self.pending.maxlen:
+                # flash filling up or the sink stalled: the deque drops the oldest record
+                self.dropped += 1
+            self.pending.append(record)
+        if self.stopped:
+            # after shutdown nobody flushes for us
+            self.flush()
+        elif self.thread is None:
+            self.start()
+        if level == "error":
+            self.wakeup.set()
+
+    def run(self):
+        while not self.stopped:
+            self.wakeup.wait(self.flush_interval)
+            self.wakeup.clear()
+            self.flush()
+
+    def flush(self):
+        with self.lock:
+            with self.append_lock:
+                records, self.pending = self.pending, deque(maxlen=self.pending.maxlen)
+            lines = [self.format(record) for record in records]
+            if lines:
+                self.sink.write("\n".join(lines) + "\n")
+                self.written += len(lines)
+
+    def stop(self):
+        self.stopped = True
+        self.wakeup.set()
+        thread, self.thread = self.thread, None
+        if thread is not None and thread is not threading.current_thread():
+            thread.join()
+        self.flush()
+        self.sink.close()
+
+
+LOGGER = None
+LOGGER_LOCK = threading.Lock()
+
+
+def get_logger():
+    global LOGGER
+    if LOGGER is None:
+        with LOGGER_LOCK:
+            if LOGGER is None:
+                LOGGER = Logger.from_setup()
+                atexit.register(LOGGER.stop)
+    return LOGGER
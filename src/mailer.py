@@ -0,0 +1,155 @@
+import random
+import smtplib
+import threading
+from email.message import EmailMessage
+
+from clock import SYSTEM
+from metrics import NULL
+from monitor_setup import Setup
+
+
+class SmtpBackoff(smtplib.SMTPException):
+    pass
+
+
+class SmtpSession:
+    # one authenticated SMTP connection reused for every message until it goes stale
+
+    def __init__(self, host=None, port=None, user=None, password=None, use_ssl=None, clock=SYSTEM, metrics=NULL,
+                 name=None, setup=Setup):
+        self.setup = setup
+        self.clock = clock
+        self.host = setup.smtp_host if host is None else host
+        self.port = setup.smtp_port if port is None else port
+        self.user = setup.user if user is None else user
+        self.password = setup.password if password is None else password
+        self.use_ssl = setup.smtp_ssl if use_ssl is None else use_ssl
+        self.metrics = metrics
+        self.name = name
+        # the sending thread and a periodic keepalive share the session
+        self.lock = threading.RLock()
+        self.smtp = None
+        self.last_used = 0
+        self.failures = 0
+        self.retry_at = 0
+        self.connects = 0
+        self.sent = 0
+
+    def connect(self):
+        now = self.clock.time()
+        if now < self.retry_at:
+            raise SmtpBackoff("SMTP reconnect backing off for %.1fs" % (self.retry_at - now))
+        try:
+            with self.metrics.timer("email_phase_seconds", device=self.name, phase="login"):
+                smtp = self.login()
+        except (smtplib.SMTPException, OSError):
+            self.backoff()
+            raise
+        self.connects += 1
+        self.failures = 0
+        self.retry_at = 0
+        self.smtp = smtp
+        self.last_used = self.clock.time()
+
+    def login(self):
+        if self.use_ssl:
+            smtp = smtplib.SMTP_SSL(self.host, self.port, timeout=self.setup.smtp_timeout)
+        else:
+            smtp = smtplib.SMTP(self.host, self.port, timeout=self.setup.smtp_timeout)
+        try:
+            if self.setup.smtp_starttls:
+                smtp.starttls()
+            if self.user:
+                smtp.login(self.user, self.password)
+        except:
+            smtp.close()
+            raise
+        return smtp
+
+    def backoff(self):
+        self.failures += 1
+        delay = min(self.setup.smtp_backoff_max, self.setup.smtp_backoff_base * 2 ** (self.failures - 1))
+        self.retry_at = self.clock.time() + delay * random.uniform(0.5, 1.5)
+
+    def retry_delay(self):
+        return max(0, self.retry_at - self.clock.time())
+
+    def is_alive(self):
+        # skip the NOOP round trip while the session was used recently
+        if self.clock.time() - self.last_used < self.setup.smtp_keepalive:
+            return True
+        try:
+            code, message = self.smtp.noop()
+        except (smtplib.SMTPException, OSError):
+            return False
+        self.last_used = self.clock.time()
+        return code == 250
+
+    def keepalive(self):
+        # called between sends, so a session the server dropped is noticed before an alert needs it
+        with self.lock:
+            if self.smtp is not None and not self.is_alive():
+                self.close()
+
+    def ensure(self):
+        if self.smtp is not None and not self.is_alive():
+            self.close()
+        if self.smtp is None:
+            self.connect()
+        return self.smtp
+
+    def make_message(self, to, subject, body, headers=None):
+        message = EmailMessage()
+        message["From"] = self.user
+        message["To"] = ", ".join(to)
+        message["Subject"] = subject
+        for name, value in (headers or {}).items():
+            message[name] = value
+        message.set_content(body)
+        return message
+
+    def send(self, to, subject, body, headers=None):
+        if isinstance(to, str):
+            to = [to]
+        message = self.make_message(to, subject, body, headers)
+        with self.lock:
+            for attempt in range(2):
+                smtp = self.ensure()
+                try:
+                    with self.metrics.timer("email_phase_seconds", device=self.name, phase="send"):
+                        refused = smtp.send_message(message, self.user, to)
+                except (smtplib.SMTPServerDisconnected, OSError) as err:
+                    if isinstance(err, smtplib.SMTPException) and not isinstance(err, smtplib.SMTPServerDisconnected):
+                        # the server answered and refused, a new session would be refused the same way
+                        self.last_used = self.clock.time()
+                        raise
+                    # the server dropped an idle session, reconnect once right away
+                    self.close()
+                    if attempt > 0:
+                        self.backoff()
+                        raise
+                    continue
+                self.last_used = self.clock.time()
+                self.sent += 1
+                return refused
+
+    def reconfigure(self, setup):
+        # a new config snapshot; another server or account needs a new session
+        if setup is self.setup:
+            return
+        server = (setup.smtp_host, setup.smtp_port, setup.user, setup.password, setup.smtp_ssl)
+        with self.lock:
+            if server != (self.host, self.port, self.user, self.password, self.use_ssl):
+                self.close()
+                self.host, self.port, self.user, self.password, self.use_ssl = server
+            self.setup = setup
+
+    def close(self):
+        with self.lock:
+            if self.smtp is None:
+                return
+            try:
+                self.smtp.quit()
+            except (smtplib.SMTPException, OSError):
+                self.smtp.close()
+            self.smtp = None
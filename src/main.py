@@ -1,12 +1,42 @@
+import signal
 import traceback
 from time import sleep
 
+from fleet import Fleet
+from metrics import start_exporters
 from monitor import TempMonitor, log
+from monitor_setup import Setup
 
-while True:
+exporters = start_exporters()
+fleet = None
+
+
+def shutdown(signum, frame):
+    fleet.shutdown()
+
+
+while fleet is None or not fleet.stopped.is_set():
     try:
-        TempMonitor().run()
+        if Setup.devices:
+            fleet = Fleet.from_addresses(Setup.devices)
+            # the cycles in flight finish and the monitors close before the process exits
+            signal.signal(signal.SIGTERM, shutdown)
+            try:
+                fleet.resume()
+                fleet.run()
+            finally:
+                fleet.close()
+        else:
+            monitor = TempMonitor()
+            # the replacement monitor must not share the outbox with a crashed one still delivering
+            try:
+                monitor.resume()
+                monitor.run()
+            finally:
+                monitor.close()
+    except KeyboardInterrupt:
+        break
     except:
         info = traceback.format_exc()
-        log(info)
+        log(info, level="error")
         sleep(2)
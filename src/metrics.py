@@ -0,0 +1,307 @@
+import http.server
+import os
+import sys
+import threading
+from bisect import bisect_left
+from collections import Counter
+from contextlib import contextmanager
+from time import perf_counter, sleep
+
+from monitor_setup import Setup
+from rpc import pipeline
+
+# seconds, from a local RPC up to an SMTP login over a slow link
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+PREFIX = "tempmonitor_"
+
+
+def label_key(labels):
+    return tuple(sorted((name, str(value)) for name, value in labels.items() if value is not None))
+
+
+def format_labels(key, extra=()):
+    pairs = list(key) + list(extra)
+    if not pairs:
+        return ""
+    return "{%s}" % ",".join('%s="%s"' % (name, value.replace("\\", "\\\\").replace('"', '\\"'))
+                             for name, value in pairs)
+
+
+class Histogram:
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class Registry:
+    # counters and histograms keyed by name and labels, rendered in the Prometheus text format
+
+    enabled = True
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters = {}
+        self.histograms = {}
+
+    def inc(self, name, value=1, **labels):
+        key = (name, label_key(labels))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name, seconds, **labels):
+        key = (name, label_key(labels))
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram()
+            histogram.observe(seconds)
+
+    @contextmanager
+    def timer(self, name, **labels):
+        started = perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, perf_counter() - started, **labels)
+
+    def render(self):
+        with self.lock:
+            counters = dict(self.counters)
+            histograms = {key: (list(h.counts), h.sum, h.count, h.buckets) for key, h in self.histograms.items()}
+
+        lines = []
+        for name in sorted(set(name for name, key in counters)):
+            lines.append("# TYPE %s%s counter" % (PREFIX, name))
+            for (counter, key), value in sorted(counters.items()):
+                if counter == name:
+                    lines.append("%s%s_total%s %s" % (PREFIX, name, format_labels(key), value))
+        for name in sorted(set(name for name, key in histograms)):
+            lines.append("# TYPE %s%s histogram" % (PREFIX, name))
+            for (histogram, key), (counts, total, count, buckets) in sorted(histograms.items()):
+                if histogram != name:
+                    continue
+                cumulative = 0
+                for bound, bucket_count in zip(list(buckets) + ["+Inf"], counts):
+                    cumulative += bucket_count
+                    lines.append("%s%s_bucket%s %d" % (PREFIX, name, format_labels(key, [("le", str(bound))]),
+                                                       cumulative))
+                lines.append("%s%s_sum%s %.6f" % (PREFIX, name, format_labels(key), total))
+                lines.append("%s%s_count%s %d" % (PREFIX, name, format_labels(key), count))
+        return "\n".join(lines) + "\n"
+
+    def write(self, path):
+        # atomic, a textfile collector never reads half a file
+        tmp = path + ".tmp"
+        with open(tmp, "w") as f:
+            f.write(self.render())
+        os.replace(tmp, path)
+
+
+class NullRegistry:
+    # what everything holds while metrics are off: no locks, no clocks, no allocations
+
+    enabled = False
+
+    def inc(self, name, value=1, **labels):
+        pass
+
+    def observe(self, name, seconds, **labels):
+        pass
+
+    @contextmanager
+    def timer(self, name, **labels):
+        yield
+
+    def render(self):
+        return ""
+
+
+REGISTRY = Registry()
+NULL = NullRegistry()
+
+
+def get_registry():
+    return REGISTRY if Setup.metrics else NULL
+
+
+class InstrumentedDevice:
+    # times every RPC per method and counts the errors the device reports
+
+    def __init__(self, device, metrics, name=None):
+        self.device = device
+        self.metrics = metrics
+        self.name = name
+
+    def __getattr__(self, method):
+        attr = getattr(self.device, method)
+        if not callable(attr):
+            return attr
+
+        def call(*args):
+            started = perf_counter()
+            try:
+                result = attr(*args)
+            except Exception:
+                self.metrics.inc("rpc_failures", device=self.name, method=method)
+                raise
+            finally:
+                self.metrics.observe("rpc_seconds", perf_counter() - started, device=self.name, method=method)
+            if isinstance(result, tuple) and len(result) == 3 and result[2] is not None:
+                self.metrics.inc("rpc_errors", device=self.name, method=method)
+            return result
+        return call
+
+    def pipeline(self, calls):
+        # the batch is one round trip, timed as a whole; errors still count per method
+        started = perf_counter()
+        try:
+            results = pipeline(self.device, calls)
+        except Exception:
+            self.metrics.inc("rpc_failures", device=self.name, method="pipeline")
+            raise
+        finally:
+            self.metrics.observe("rpc_seconds", perf_counter() - started, device=self.name, method="pipeline")
+        for call, result in zip(calls, results):
+            if result.error is not None:
+                self.metrics.inc("rpc_errors", device=self.name, method=call[0])
+        return results
+
+
+class MetricsHandler(http.server.BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = self.server.registry.render().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class MetricsServer(http.server.ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, registry, port, host="127.0.0.1"):
+        super().__init__((host, port), MetricsHandler)
+        self.registry = registry
+        self.thread = None
+
+    def start(self):
+        self.thread = threading.Thread(target=self.serve_forever, name="metrics-http", daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+class Periodic:
+    # calls job every interval seconds on a daemon thread, once more when stopped
+
+    def __init__(self, job, interval, name):
+        self.job = job
+        self.interval = interval
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run, name=name, daemon=True)
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            self.job()
+
+    def stop(self):
+        self.stopped.set()
+        self.thread.join()
+        self.job()
+
+
+class SamplingProfiler:
+    # samples every other thread's stack each interval and keeps folded stacks for flame graphs
+
+    def __init__(self, interval=0.01, max_depth=64):
+        self.interval = interval
+        self.max_depth = max_depth
+        self.stacks = Counter()
+        self.samples = 0
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run, name="profiler", daemon=True)
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def run(self):
+        own = threading.get_ident()
+        names = {}
+        while not self.stopped.is_set():
+            for thread in threading.enumerate():
+                names[thread.ident] = thread.name
+            for ident, frame in sys._current_frames().items():
+                if ident != own:
+                    self.sample(names.get(ident, str(ident)), frame)
+            sleep(self.interval)
+
+    def sample(self, thread_name, frame):
+        functions = []
+        while frame is not None and len(functions) < self.max_depth:
+            code = frame.f_code
+            functions.append("%s:%s" % (os.path.basename(code.co_filename), code.co_name))
+            frame = frame.f_back
+        stack = ";".join([thread_name] + functions[::-1])
+        with self.lock:
+            self.stacks[stack] += 1
+            self.samples += 1
+
+    def write(self, path):
+        with self.lock:
+            stacks = sorted(self.stacks.items())
+        tmp = path + ".tmp"
+        with open(tmp, "w") as f:
+            for stack, count in stacks:
+                f.write("%s %d\n" % (stack, count))
+        os.replace(tmp, path)
+
+    def stop(self):
+        self.stopped.set()
+        self.thread.join()
+
+
+def start_exporters(registry=None):
+    # whatever Setup asks for; the returned objects are stopped on shutdown
+    registry = get_registry() if registry is None else registry
+    started = []
+    if registry.enabled and Setup.metrics_port:
+        started.append(MetricsServer(registry, Setup.metrics_port).start())
+    if registry.enabled and Setup.metrics_file:
+        started.append(Periodic(lambda: registry.write(Setup.metrics_file), Setup.metrics_interval,
+                                "metrics-file").start())
+    if Setup.profile_file:
+        profiler = SamplingProfiler(Setup.profile_interval).start()
+        started.append(profiler)
+        started.append(Periodic(lambda: profiler.write(Setup.profile_file), Setup.metrics_interval,
+                                "profile-file").start())
+    return started
+
+
+def stop_exporters(started):
+    for exporter in reversed(started):
+        exporter.stop()
@@ -1,25 +1,46 @@
-import traceback
+import os
+from collections import Counter
 from datetime import datetime
-from time import sleep
 
 from alert import Alert
+from checkpoint import Checkpoint
+from clock import SYSTEM
+from commands import SmsIntake, CommandTable
+from config import get_config
+from connection import DeviceConnection
+from connectivity import WifiTracker, WifiState
+from dispatcher import Dispatcher
+from logger import get_logger, compact_exception
+from mailer import SmtpSession
+from metrics import get_registry
 from monitor_setup import Setup
-from wifi import Wifi
+from notify import Notifier
+from outbox import Outbox
+from push import PushClient
+from readings import ReadingStore
+from rpc import pipeline, is_unknown_rpc
+from rules import Rule, RulePlan, RuleState, ABOVE, BELOW, make_rule
+from schedule import AdaptiveSchedule
+from trend import RollingTrend
+from wakelock import WakeLock
+
+
+# warnings ahead of a threshold; they do not mean the device is already in trouble
+PREDICTIVE_KEYS = ("freezing_soon", "frying_soon")
 
 
 def c_to_f(temp_c):
     return temp_c * 1.8 + 32
 
 
-def log(*args):
-    print(datetime.now().strftime('%a %x %X'), end=" ")
-    print(*args)
+def log(*args, level="info", device=None, timestamp=None, **fields):
+    get_logger().log(level, device, args, fields, timestamp)
 
 
-def get_external_temp_c(temp_c):
+def get_external_temp_c(temp_c, setup=Setup):
     # http://opensignal.com/reports/battery-temperature-weather/
     # return 2.55 * temp_c - 60.55  # does not work well on Galaxy4
-    return temp_c - Setup.external_temp_offset_c
+    return temp_c - setup.external_temp_offset_c
 
 
 class BatteryStatus:
@@ -30,14 +51,78 @@ class BatteryStatus:
     full = 5
 
 
+def builtin_rules(setup=Setup):
+    return [Rule("freezing", "Freezing", "temp_f", BELOW, setup.temp_min,
+                 "Freezing below %(threshold).0fF: %(info)s", setup.temp_hysteresis_f),
+            Rule("frying", "Frying", "temp_f", ABOVE, setup.temp_max,
+                 "Frying above %(threshold).0fF: %(info)s", setup.temp_hysteresis_f),
+            Rule("power_loss", "Power loss", "battery_level", BELOW, setup.low_battery,
+                 "Battery level below %(threshold)s %(info)s", setup.battery_hysteresis,
+                 statuses=[BatteryStatus.notcharging, BatteryStatus.discharging])]
+
+
+def default_rules(setup=Setup):
+    return builtin_rules(setup) + [make_rule(spec) for spec in setup.rules]
+
+
+def compile_rules(setup=Setup, previous=None):
+    # commands and config files are validated, but Setup may be edited by hand: a plan that does not
+    # compile keeps the previous one, or just the built-in rules, instead of failing every cycle
+    try:
+        return RulePlan(default_rules(setup))
+    except (KeyError, TypeError, ValueError):
+        log("Rules not applied:", compact_exception(), level="error")
+        return RulePlan(builtin_rules(setup)) if previous is None else previous
+
+
+def rules_signature(setup=Setup):
+    return (setup.temp_min, setup.temp_max, setup.low_battery, setup.temp_hysteresis_f,
+            setup.battery_hysteresis, repr(setup.rules))
+
+
 class TempMonitor:
 
-    def __init__(self):
+    def __init__(self, addr=None, name=None, clock=SYSTEM):
+        self.addr = addr
+        self.name = name
+        self.clock = clock
+        self.config = get_config()
+        # Setup itself, or this device's snapshot of the config file
+        self.setup = Setup if self.config is None else self.config.snapshot(name)
+        self.metrics = get_registry()
         self.stop = False
-        self.device = None
+        self.connection = DeviceConnection(addr, clock=clock, metrics=self.metrics, name=name, setup=self.setup)
         self.mailer = None
         self.sim_exists = None
-        self.last_msg_time = datetime.now()
+        self.last_msg_time = clock.now()
+        self.battery_data_supported = True
+        self.readings = None
+        self.counters = Counter()
+        self.rules = None
+        self.rules_signature = None
+        self.rule_state = RuleState()
+        self.notifier = Notifier()
+        self.dispatcher = Dispatcher(on_outcome=self.log_delivery) if self.setup.async_notifications else None
+        self.outbox = None
+        self.push = None
+        self.checkpoint = None
+        self.checkpoint_key = None
+        self.wifi = WifiTracker(clock, self.setup)
+        self.sms = SmsIntake(self.last_msg_time)
+        self.commands = CommandTable(self, config=self.config)
+        self.trend = RollingTrend(self.setup.predict_window)
+        self.schedule = AdaptiveSchedule(self.counters, self.trend, self.setup)
+        self.wake_lock = WakeLock(self.init_device, clock=clock)
+        self.wake_lock_day = None
+        self.last_cycle_wakelock = None
+
+    @property
+    def device(self):
+        return self.connection.device
+
+    @device.setter
+    def device(self, device):
+        self.connection.attach(device)
 
     @staticmethod
     def battery_to_string(battery_status, battery_level):
@@ -52,36 +137,92 @@ class TempMonitor:
     def get_battery_info(self):
         self.init_device()
         self.device.batteryStartMonitoring()
-
-        # program halt to allow time for battery information
-        sleep(10)
-
-        # gets temp from system and sets temp_c10 as temp in celcius( * 10)
-        (id_temp, temp_in_c10, error_temp) = self.device.batteryGetTemperature()
-        (id_level, battery_level, error_level) = self.device.batteryGetLevel()
-        (id_status, battery_status, error_status) = self.device.batteryGetStatus()
-
-        self.device.batteryStopMonitoring()
-
-        for name, error in [("temperature", error_temp), ("level", error_level), ("status", error_status)]:
-            if error is not None:
-                raise RuntimeError("Error getting battery %s: %s" % (name, error))
+        try:
+            battery_status, battery_level, temp_in_c10 = self.wait_battery_info()
+        finally:
+            self.device.batteryStopMonitoring()
 
         battery_status_str = self.battery_to_string(battery_status, battery_level)
 
         # divides so temp will come out correct in C
         temp_c = temp_in_c10 / 10.0
         temp_f = c_to_f(temp_c)
-        if Setup.calc_external_temp:
-            external_temp_c = get_external_temp_c(temp_c)
+        if self.setup.calc_external_temp:
+            external_temp_c = get_external_temp_c(temp_c, self.setup)
             external_temp_f = c_to_f(external_temp_c)
             self.log(self.make_info_string(battery_status_str, temp_f, external_temp_f))
             temp_f = external_temp_f
         else:
+            external_temp_c = float("nan")
             self.log(self.make_info_string(battery_status_str, temp_f))
+        self.record_reading(battery_status, battery_level, temp_c, external_temp_c)
 
         return battery_status, battery_level, temp_f
 
+    def wait_battery_info(self):
+        # battery values read as None until the first battery broadcast after start monitoring
+        started = self.clock.time()
+        delay = self.setup.battery_poll_delay
+        while True:
+            # gets temp from system and sets temp_c10 as temp in celcius( * 10)
+            temp_in_c10, battery_level, battery_status = self.read_battery()
+            waited = self.clock.time() - started
+            if None not in (temp_in_c10, battery_level, battery_status):
+                self.metrics.observe("battery_ready_seconds", waited, device=self.name)
+                return battery_status, battery_level, temp_in_c10
+            if waited >= self.setup.battery_ready_timeout:
+                raise RuntimeError("Battery information not ready after %.1fs" % waited)
+            self.metrics.inc("retries", device=self.name, op="battery_poll")
+            self.clock.sleep(min(delay, self.setup.battery_ready_timeout - waited))
+            delay = min(delay * 2, self.setup.battery_poll_max_delay)
+
+    def read_battery(self):
+        if self.battery_data_supported:
+            (data_id, data, error) = self.device.readBatteryData()
+            if error is None:
+                data = data or {}
+                return data.get("temperature"), data.get("level"), data.get("status")
+            if not is_unknown_rpc(error):
+                raise RuntimeError("Error getting battery data: %s" % error)
+            self.log("readBatteryData not supported, reading battery fields separately")
+            self.battery_data_supported = False
+
+        with self.connection.lock:
+            results = pipeline(self.device, [("batteryGetTemperature",), ("batteryGetLevel",), ("batteryGetStatus",)])
+        for name, result in zip(["temperature", "level", "status"], results):
+            if result.error is not None:
+                raise RuntimeError("Error getting battery %s: %s" % (name, result.error))
+        return tuple(result.result for result in results)
+
+    def open_readings(self):
+        if self.readings is None and self.setup.readings_dir:
+            self.readings = ReadingStore(self.setup.readings_dir, self.name or "local",
+                                         self.setup.readings_segment_records, self.setup.readings_ring_size)
+        return self.readings
+
+    def record_reading(self, battery_status, battery_level, temp_c, external_temp_c):
+        record = (self.clock.time(), battery_status, battery_level, temp_c, external_temp_c)
+        readings = self.open_readings()
+        if readings is not None:
+            readings.append(*record)
+        push = self.open_push()
+        if push is not None:
+            push.add(record)
+
+    def open_push(self):
+        if self.push is None and self.setup.push_url:
+            self.push = PushClient(self.setup.push_url, self.name, self.clock, self.metrics)
+        return self.push
+
+    def push_readings(self):
+        # True while the collector takes our readings and alerts on them in our place
+        push = self.open_push()
+        if push is None:
+            return False
+        if push.due():
+            push.push()
+        return push.healthy()
+
     @staticmethod
     def make_info_string(battery_status_str, temp_f, external_temp_f=None):
         if external_temp_f is None:
@@ -95,172 +236,424 @@ class TempMonitor:
         except Exception as err:
             self.log_error(err.args)
 
+    def rule_plan(self):
+        # settings may change at runtime by an SMS command or a config edit, recompile only when they did
+        signature = rules_signature(self.setup)
+        if signature != self.rules_signature:
+            self.rules = compile_rules(self.setup, self.rules)
+            self.rules_signature = signature
+        return self.rules
+
     def make_alerts(self, battery_status, battery_level, temp_f):
-        alerts = []
-        current_info = self.make_info_string(self.battery_to_string(battery_status, battery_level), temp_f)
-        if temp_f < Setup.temp_min:
-            alert = Alert("Freezing", ("Freezing below %.0fF: " % Setup.temp_min) + current_info)
-            alerts.append(alert)
-        elif temp_f > Setup.temp_max:
-            alert = Alert("Frying", ("Frying above %.0fF: " % Setup.temp_max) + current_info)
-            alerts.append(alert)
-        if battery_status in [BatteryStatus.notcharging, BatteryStatus.discharging]:
-            if battery_level < Setup.low_battery:
-                alert = Alert("Power loss", ("Battery level below %s " % Setup.low_battery) + current_info)
-                alerts.append(alert)
+        sample = {"battery_status": battery_status, "battery_level": battery_level, "temp_f": temp_f}
 
+        def current_info():
+            return self.make_info_string(self.battery_to_string(battery_status, battery_level), temp_f)
+
+        fired = self.rule_plan().evaluate(sample, self.rule_state, self.clock.time())
+        alerts = [Alert(rule.title, lambda rule=rule: rule.format(sample, current_info()), rule.key)
+                  for rule in fired]
+        if self.setup.predict_horizon and not any(rule.field == "temp_f" for rule in fired):
+            alerts.extend(self.make_predictive_alerts(current_info))
         return alerts
 
+    def make_predictive_alerts(self, current_info):
+        slope = self.trend.slope()
+        if not slope:
+            return []
+        if slope < 0:
+            key, title, word, threshold = "freezing_soon", "Freezing soon", "below", self.setup.temp_min
+        else:
+            key, title, word, threshold = "frying_soon", "Frying soon", "above", self.setup.temp_max
+        seconds = self.trend.time_to_reach(threshold, self.clock.time())
+        if seconds is None or seconds > self.setup.predict_horizon:
+            return []
+        prefix = "%s %s %.0fF in ~%.0f min: " % (title, word, threshold, seconds / 60)
+        return [Alert(title, lambda: prefix + current_info(), key)]
+
+    def account_wake_lock(self):
+        # reports the cycle that just ended, sampling plus the idle time after it
+        self.last_cycle_wakelock = self.wake_lock.end_cycle()
+        self.counters["wakelock_seconds"] += self.last_cycle_wakelock
+        today = self.clock.today()
+        if self.wake_lock_day is not None and self.wake_lock_day != today:
+            self.log("Wake lock held %.0fs on %s" % (self.wake_lock.held_on(self.wake_lock_day), self.wake_lock_day))
+        self.wake_lock_day = today
+
+    def run_cycle(self):
+        with self.metrics.timer("cycle_seconds", device=self.name):
+            return self.sample_and_alert()
+
+    def refresh_setup(self):
+        # a changed file is applied between cycles, a cycle always sees one snapshot
+        if self.config is not None:
+            self.config.check()
+            setup = self.config.snapshot(self.name)
+            if setup is not self.setup:
+                self.setup = setup
+                # the helpers read the same snapshot; the mailer picks it up with its next send
+                self.connection.setup = self.wifi.setup = self.schedule.setup = setup
+
+    def sample_and_alert(self):
+        self.refresh_setup()
+        self.account_wake_lock()
+        self.acquire_device()
+        battery_info = self.try_get_battery_info()
+        if battery_info is None:
+            # the error is logged; no sample to trend or alert on, try again after the usual period
+            self.counters["battery_errors"] += 1
+            self.metrics.inc("failures", device=self.name, op="battery")
+            return self.setup.sleep_between_get_temp
+        battery_status, battery_level, temp_f = battery_info
+        self.trend.add(self.clock.time(), temp_f)
+
+        if self.push_readings():
+            alerts = []
+        else:
+            alerts = self.make_alerts(battery_status, battery_level, temp_f)
+        self.counters["cycles"] += 1
+        self.counters["alerts"] += len(alerts)
+        if self.metrics.enabled:
+            for alert in alerts:
+                self.metrics.inc("alerts", device=self.name, key=alert.key)
+        if len(alerts) == 0:
+            self.notifier.resolve(self.name)
+            if self.notifier.pending_count() > 0:
+                # a digest the rate limit held back goes out once tokens are back, new alerts or not
+                self.flush_notifications(self.notification_channels())
+        else:
+            self.send_notification(alerts)
+        if any(getattr(alert, "key", None) not in PREDICTIVE_KEYS for alert in alerts):
+            sleep_period = self.setup.sleep_after_send_sms
+        elif self.setup.adaptive_sampling:
+            # a prediction keeps sampling at the usual pace, the window it warns about is the one to watch
+            sleep_period = self.schedule.next_interval(temp_f, self.clock.time())
+        else:
+            sleep_period = self.setup.sleep_between_get_temp
+        # every cycle: while an alert stays active the notifier holds its repeats back, and nothing
+        # else would retry what the journal still holds
+        if self.mailer is not None:
+            # on the delivery thread, which is the one sending through the session
+            self.deliver("keepalive", self.mailer.keepalive)
+        if self.open_outbox() is not None and len(self.outbox) > 0:
+            self.deliver("outbox", self.flush_outbox)
+        self.save_checkpoint()
+        return sleep_period
+
     def run(self):
 
         while True:
-            self.acquire_device()
-            battery_status, battery_level, temp_f = self.try_get_battery_info()
-
-            alerts = self.make_alerts(battery_status, battery_level, temp_f)
-            if len(alerts) == 0:
-                sleep_period = Setup.sleep_between_get_temp
-            else:
-                sleep_period = Setup.sleep_after_send_sms
-                self.send_notification(alerts)
+            sleep_period = self.run_cycle()
+            if self.setup.wakelock_idle_release:
+                # let the device sleep until the next sample, only polls and deliveries wake it
+                self.release_device()
 
             if self.stop:
                 break
 
-            if Setup.process_input:
+            if self.setup.process_input:
                 self.process_input(sleep_period)
             else:
-                sleep(sleep_period)
+                self.clock.sleep(sleep_period)
             self.release_device()
 
-        self.release_device()
+        self.close()
 
     def acquire_device(self):
-        self.init_device().wakeLockAcquirePartial()
+        self.wake_lock.acquire()
 
     def send_notification(self, alerts):
-        for alert in alerts:
-            if self.sim_exists:
-                self.log("Texting to %s:" % Setup.phones_numbers, alert.title)
-                for phone_number in Setup.phones_numbers:
-                    self.init_device().smsSend(phone_number, alert.msg)
-            self.log("Emailing to %s:" % Setup.emails, alert.title)
+        channels = self.notification_channels()
+        self.notifier.submit(self.name, alerts, self.clock.time(), [name for name, send in channels],
+                             self.setup.notify_repeat_interval)
+        self.flush_notifications(channels)
+
+    def flush_notifications(self, channels):
+        if not self.deliver("notify", lambda: self.notifier.flush(channels, self.clock.time())):
+            # alerts stay pending in the notifier and go out with the next flush
+            self.log("Notification queue full, %d alerts pending" % self.notifier.pending_count())
+
+    def deliver(self, name, job):
+        def held_job():
+            with self.wake_lock.held():
+                return job()
+        if self.dispatcher is None:
+            held_job()
+            return True
+        return self.dispatcher.submit(name, held_job, self.log_delivery)
+
+    def log_delivery(self, outcome):
+        self.metrics.observe("delivery_seconds", outcome.latency, device=self.name, job=outcome.name)
+        if outcome.error is not None:
+            self.metrics.inc("failures", device=self.name, op="delivery")
+            self.log_error("Notification delivery failed after %.1fs:" % outcome.latency, outcome.error)
+        elif outcome.result:
+            self.log("Delivered %s in %.1fs" % (", ".join(outcome.result), outcome.latency))
+
+    def notification_channels(self):
+        channels = [("email", self.send_email_notification)]
+        if self.sim_exists:
+            channels.insert(0, ("sms", self.send_sms_notification))
+        return channels
+
+    def send_sms_notification(self, alert):
+        self.log("Texting to %s:" % self.setup.phones_numbers, alert.title)
+        for phone_number in self.setup.phones_numbers:
+            self.init_device().smsSend(phone_number, alert.msg)
+        return True
+
+    def send_email_notification(self, alert):
+        outbox = self.open_outbox()
+        if outbox is None:
+            self.log("Emailing to %s:" % self.setup.emails, alert.title)
             if self.try_send_email(alert):
                 self.log("Email sent")
+                return True
+            return False
+        # once journaled the alert is the outbox's to deliver, even across restarts
+        outbox.add(alert.title, alert.msg)
+        self.flush_outbox()
+        return True
+
+    def open_outbox(self):
+        if self.outbox is None and self.setup.outbox_dir:
+            name = self.name or "local"
+            self.outbox = Outbox(os.path.join(self.setup.outbox_dir, name.replace(":", "-") + ".jsonl"), name)
+        return self.outbox
+
+    def flush_outbox(self):
+        # in sequence order over the one SMTP session; stops at the first failure to keep the order
+        for seq, record in self.outbox.items():
+            self.log("Emailing to %s:" % self.setup.emails, record["title"], "#%d" % seq)
+            if not self.try_send_email(Alert(record["title"], record["msg"]), self.outbox.message_id(seq)):
+                self.log("Email #%d kept in outbox, %d pending" % (seq, len(self.outbox)))
+                return False
+            self.outbox.ack(seq)
+            self.log("Email sent")
+        return True
+
+    def open_checkpoint(self):
+        if self.checkpoint is None and self.setup.checkpoint_dir:
+            name = self.name or "local"
+            self.checkpoint = Checkpoint(os.path.join(self.setup.checkpoint_dir, name.replace(":", "-") + ".json"))
+        return self.checkpoint
+
+    def snapshot(self):
+        return {"sim_exists": self.sim_exists,
+                "last_msg_time": self.last_msg_time.timestamp(),
+                "sms_cursor": self.sms.cursor,
+                "sms_processed": list(self.sms.index),
+                "rules_active": sorted(self.rule_state.active),
+                "rules_pending": self.rule_state.pending,
+                "notifier": self.notifier.export(self.name),
+                "trend": list(self.trend.samples),
+                "counters": dict(self.counters)}
+
+    def restore(self, state):
+        self.sim_exists = state["sim_exists"]
+        self.last_msg_time = datetime.fromtimestamp(state["last_msg_time"])
+        self.sms.since_ms = state["last_msg_time"] * 1000
+        if state["sms_cursor"] is not None:
+            for msg_id in state["sms_processed"]:
+                self.sms.mark(msg_id)
+            self.sms.cursor = state["sms_cursor"]
+        self.rule_state.active = set(state["rules_active"])
+        self.rule_state.pending = dict(state["rules_pending"])
+        self.notifier.restore(self.name, state["notifier"])
+        for t, temp_f in state["trend"]:
+            self.trend.add(t, temp_f)
+        self.counters.update(state["counters"])
+
+    def resume(self):
+        # warm restart: alerts already sent stay sent and handled SMS stay handled
+        checkpoint = self.open_checkpoint()
+        state = None if checkpoint is None else checkpoint.load()
+        if state is None:
+            return False
+        self.restore(state)
+        self.checkpoint_key = self.checkpoint_state()
+        self.log("Resumed from checkpoint saved %.0fs ago" % (self.clock.time() - state["saved_at"]))
+        return True
+
+    def checkpoint_state(self):
+        # what must never be lost; the rest is saved every checkpoint_interval
+        return (self.sim_exists, self.sms.cursor, frozenset(self.rule_state.active), self.notifier.active_keys(self.name))
+
+    def save_checkpoint(self, force=False):
+        checkpoint = self.open_checkpoint()
+        if checkpoint is None:
+            return
+        key = self.checkpoint_state()
+        now = self.clock.time()
+        if force or key != self.checkpoint_key or now - checkpoint.saved_at >= self.setup.checkpoint_interval:
+            checkpoint.save(self.snapshot(), now)
+            self.checkpoint_key = key
 
     def process_input(self, sleep_time):
         slept = 0
         short_sleep = 5
         while slept < sleep_time:
-            now = datetime.now()
-            (msgid, messages, error) = self.init_device().smsGetMessages(False, 'inbox')
-            if error is not None:
-                self.log_error("smsGetMessages returned error:", error)
+            try:
+                with self.wake_lock.held():
+                    messages = self.sms.poll(self.init_device())
+            except RuntimeError as err:
+                self.log_error(*err.args)
+                messages = []
+            if messages:
+                # the cursor is saved before the commands run, a command that crashes us is not run again
+                self.save_checkpoint()
 
             for m in messages:
-                if datetime.fromtimestamp(int(m["date"])/1000) >= self.last_msg_time:
-                    self.log("Received message", m)
-                    self.last_msg_time = now
+                self.log("Received message", m)
+                self.last_msg_time = self.clock.now()
 
-                    if self.execute_command(m["body"]):
-                        return
+                if self.execute_command(m["body"]):
+                    return
 
-            sleep(short_sleep)
+            self.wait_input(short_sleep)
             slept += short_sleep
 
+    def wait_input(self, seconds):
+        if self.setup.sms_event:
+            # returns early when the SMS event fires, otherwise after the timeout. SL4A leaves the event
+            # in its buffer, where every later wait would find it at once; the poll that follows reads
+            # the inbox itself, so clearing the buffer loses nothing
+            device = self.init_device()
+            (event_id, event, error) = device.eventWaitFor(self.setup.sms_event, int(seconds * 1000))
+            if event is not None:
+                device.eventClearBuffer()
+        else:
+            self.clock.sleep(seconds)
+
     def execute_command(self, text):
         try:
-            exec(text)
+            self.commands.execute(text)
             self.log("Executed:", text)
             return True
         except Exception as err:
             self.log_error("Error execution command %s. error %s" % (text, err.args))
 
-    @staticmethod
-    def log(*args):
-        log(*args)
+    def log(self, *args, **fields):
+        log(*args, device=self.name, timestamp=self.clock.time(), **fields)
 
-    def log_error(self, *args):
-        self.log(*args)
+    def log_error(self, *args, **fields):
+        log(*args, level="error", device=self.name, timestamp=self.clock.time(), **fields)
 
     def init_device(self):
-        if self.device is None:
-            import android
-            self.device = android.Android()
-            (opid, result, error) = self.device.getNetworkOperatorName()
+        device = self.connection.get()
+        if self.connection.sim_check_due():
+            (opid, result, error) = device.getNetworkOperatorName()
+            self.connection.sim_checked_now()
             sim_exists = len(result) > 1
             if self.sim_exists != sim_exists:
                 self.log("getNetworkOperatorName: ", opid, result, error)
                 self.sim_exists = sim_exists
-        return self.device
+        return device
 
-    def send_email(self, alert):
+    def send_email(self, alert, message_id=None):
         ret = False
         try:
-            self.ensure_wifi()
+            with self.metrics.timer("email_phase_seconds", device=self.name, phase="wifi"):
+                self.ensure_wifi()
             if self.mailer is None:
-                import yagmail
-                self.mailer = yagmail.SMTP(Setup.user, Setup.password)
+                self.mailer = SmtpSession(clock=self.clock, metrics=self.metrics, name=self.name, setup=self.setup)
             else:
-                self.mailer.login(Setup.password)
-
-            ret = self.mailer.send(Setup.emails, alert.title, alert.msg)
+                self.mailer.reconfigure(self.setup)
+            headers = None if message_id is None else {"Message-ID": message_id}
+            ret = self.mailer.send(self.setup.emails, alert.title, alert.msg, headers)
         except:
-            info = traceback.format_exc()
-            self.log(info)
+            # the failure may be the network, do not trust the cached Wi-Fi state for the retry
+            self.wifi.invalidate()
+            self.log_error("Sending email failed:", compact_exception())
 
-        if self.mailer is not None:
-            self.mailer.close()
-
-        if ret is False:
-            return False
-        elif isinstance(ret, dict):
+        if isinstance(ret, dict):
             if len(ret) == 0:
                 return True
             else:
                 self.log("Refused recipients:", ret)
-        else:
+        elif ret is not False:
             self.log("Unexpected return value from send:", ret)
+        self.metrics.inc("failures", device=self.name, op="email")
         return False
 
     def ensure_wifi(self):
+        if self.wifi.is_connected():
+            self.counters["wifi_cached"] += 1
+            return True
+        if self.wifi.state == WifiState.down and not self.wifi.may_toggle():
+            # toggling again so soon after failing only burns RPCs, wait for the backoff
+            self.counters["wifi_backoff"] += 1
+            return False
         self.init_device()
         if self.reconnect_wifi():
             for i in range(10):
                 (info_id, info, error) = self.device.wifiGetConnectionInfo()
+                self.counters["wifi_rpcs"] += 1
                 if error is None:
-                    if info[Wifi.state] == Wifi.state_completed and info[Wifi.ip] > 0:
-                        return
-                sleep(Setup.sleep_waiting_wifi)
+                    if self.wifi.update(info) == WifiState.connected:
+                        return True
+                self.clock.sleep(self.setup.sleep_waiting_wifi)
+        return False
 
     def reconnect_wifi(self):
         self.init_device()
         for i in range(3):
             (wifiid, is_connected, error) = self.device.checkWifiState()
+            self.counters["wifi_rpcs"] += 1
             if is_connected:
                 if i > 0:  # not first attempt
                     self.log("Connected to WiFi. attempt", i)
+                self.wifi.set(WifiState.reconnecting)
                 return True
             (wifiid, is_connected, error) = self.device.toggleWifiState(1)
+            self.counters["wifi_rpcs"] += 1
+            self.counters["wifi_toggles"] += 1
+            self.metrics.inc("retries", device=self.name, op="wifi_toggle")
             if is_connected:
                 self.log("Re-connected to WiFi after", i, "attempt")
+                self.wifi.toggle_succeeded()
                 return True
             else:
                 self.log("Failed attempt", i, "re-connecting WiFi. Error", error)
-            sleep(2)
+            self.clock.sleep(2)
         self.log("Cannot connect to WiFi")
+        self.wifi.toggle_failed()
         return False
 
-    def try_send_email(self, alert):
+    def try_send_email(self, alert, message_id=None):
         for i in range(3):
-            if self.send_email(alert):
+            if self.send_email(alert, message_id):
                 return True
-            sleep(2)
+            self.metrics.inc("retries", device=self.name, op="email")
+            # the session backs off reconnects with jitter, wait for that instead of a fixed delay
+            self.clock.sleep(self.mailer.retry_delay() if self.mailer is not None else self.setup.email_retry_delay)
         return False
 
     def release_device(self):
         if self.device is None:
+            self.wake_lock.reset()
             return
-        self.device.wakeLockRelease()
-        self.device.conn.close()
-        self.device = None
+        try:
+            self.wake_lock.release()
+        except OSError:
+            self.connection.close()
+            raise
+        if not self.setup.keep_connection:
+            self.connection.close()
+
+    def close_device(self):
+        self.release_device()
+        self.wake_lock.reset()
+        self.connection.close()
+
+    def close(self):
+        if self.dispatcher is not None:
+            self.dispatcher.stop()
+        self.save_checkpoint(force=True)
+        self.close_device()
+        if self.readings is not None:
+            self.readings.close()
+            self.readings = None
+        if self.outbox is not None:
+            self.outbox.close()
+            self.outbox = None
@@ -15,3 +15,73 @@ class Setup:
     sleep_after_send_sms = 1800
     sleep_waiting_wifi = 3
     process_input = False
+    rpc_timeout = 60
+    devices = []
+    fleet_workers = 32
+    fleet_error_retry = 60
+    keep_connection = True
+    health_check_interval = 30
+    sim_refresh_interval = 3600
+    battery_poll_delay = 0.05
+    battery_poll_max_delay = 1
+    battery_ready_timeout = 10
+    readings_dir = "readings"
+    readings_segment_records = 65536
+    readings_ring_size = 1024
+    adaptive_sampling = True
+    adaptive_sleep_min = 60
+    adaptive_sleep_max = 900
+    adaptive_margin_f = 15.0
+    adaptive_crossing_fraction = 0.25
+    predict_window = 12
+    predict_horizon = 1800
+    temp_hysteresis_f = 1.0
+    battery_hysteresis = 2
+    rules = []
+    notify_repeat_interval = 4 * 3600
+    # channel: (tokens per second, burst)
+    notify_limits = {"sms": (1.0 / 1800, 3), "email": (1.0 / 300, 5)}
+    smtp_host = "smtp.gmail.com"
+    smtp_port = 465
+    smtp_ssl = True
+    smtp_starttls = False
+    smtp_timeout = 30
+    smtp_keepalive = 60
+    smtp_backoff_base = 2
+    smtp_backoff_max = 300
+    email_retry_delay = 2
+    async_notifications = True
+    dispatch_queue_size = 16
+    outbox_dir = "outbox"
+    wifi_state_ttl = 120
+    wifi_backoff_base = 30
+    wifi_backoff_max = 900
+    sms_event = None
+    # nothing wakes the phone from deep sleep yet, time.sleep stops with it; keep the lock between samples
+    wakelock_idle_release = False
+    metrics = False
+    metrics_file = None
+    metrics_port = None
+    metrics_interval = 15
+    profile_file = None
+    profile_interval = 0.01
+    log_file = None
+    log_format = "text"
+    log_flush_interval = 1.0
+    log_max_bytes = 1 << 20
+    log_max_age = 86400
+    log_keep = 5
+    checkpoint_dir = "checkpoint"
+    checkpoint_interval = 300
+    # push mode: readings go to a collector (collector.py) that alerts for the whole fleet
+    push_url = None
+    push_interval = 0
+    push_batch_records = 256
+    push_buffer_records = 65536
+    push_timeout = 10
+    push_fallback_after = 1800
+    collector_port = 8750
+    collector_flush_interval = 5
+    # JSON file of {"defaults": {...}, "devices": {name: {...}}} over these values, reloaded when it changes
+    config_file = None
+    config_check_interval = 5
@@ -0,0 +1,137 @@
+import threading
+from collections import OrderedDict
+
+from alert import Alert
+from monitor_setup import Setup
+
+
+class TokenBucket:
+
+    def __init__(self, rate, capacity, now=0.0):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = now
+
+    def take(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+
+
+def make_digest(entries):
+    # entries are (source, alert); a single alert from an unnamed source goes out untouched
+    if len(entries) == 1:
+        source, alert = entries[0]
+        if source is None:
+            return alert
+        return Alert(alert.title, lambda: "[%s] %s" % (source, alert.msg), alert.key)
+    titles = []
+    for source, alert in entries:
+        if alert.title not in titles:
+            titles.append(alert.title)
+    return Alert("%d alerts: %s" % (len(entries), ", ".join(titles)),
+                 lambda: "\n".join(alert.msg if source is None else "[%s] %s" % (source, alert.msg)
+                                   for source, alert in entries),
+                 "digest")
+
+
+class Notifier:
+    # alerts are deduplicated per (source, key), coalesced into one digest per flush
+    # and delivered per channel as the channel's token bucket allows
+
+    def __init__(self, limits=None):
+        # None follows Setup.notify_limits, also after a config change
+        self.limits = limits
+        self.lock = threading.Lock()
+        self.active = {}
+        self.pending = {}
+        self.buckets = {}
+        self.sent = 0
+        self.suppressed = 0
+
+    def bucket(self, channel, now):
+        limits = Setup.notify_limits if self.limits is None else self.limits
+        # the default is only evaluated for a channel without limits, sleep_after_send_sms may be 0
+        rate, capacity = limits[channel] if channel in limits else (1.0 / Setup.sleep_after_send_sms, 1)
+        bucket = self.buckets.get(channel)
+        if bucket is None:
+            bucket = self.buckets[channel] = TokenBucket(rate, capacity, now)
+        else:
+            # changed limits apply from the next take on, the tokens saved up are kept
+            bucket.rate, bucket.capacity = rate, capacity
+        return bucket
+
+    def submit(self, source, alerts, now, channels, repeat_interval=None):
+        # limits and buckets are per channel and shared, the repeat interval may differ per source
+        repeat_interval = Setup.notify_repeat_interval if repeat_interval is None else repeat_interval
+        with self.lock:
+            keys = set()
+            for alert in alerts:
+                key = (source, alert.key)
+                keys.add(key)
+                last = self.active.get(key)
+                if last is not None and now - last < repeat_interval:
+                    self.suppressed += 1
+                    continue
+                self.active[key] = now
+                for channel in channels:
+                    self.pending.setdefault(channel, OrderedDict())[key] = (source, alert)
+            for key in [key for key in self.active if key[0] == source and key not in keys]:
+                del self.active[key]
+
+    def resolve(self, source):
+        self.submit(source, [], 0, [])
+
+    def flush(self, channels, now):
+        # channels is [(name, send)]; send(alert) returns True once delivered. The entries are taken
+        # out under the lock and sent without it, a slow channel must not hold up submit() on the
+        # sampling threads
+        delivered = []
+        for name, send in channels:
+            with self.lock:
+                entries = self.pending.get(name)
+                if not entries or not self.bucket(name, now).take(now):
+                    continue
+                del self.pending[name]
+            sent = False
+            try:
+                sent = send(make_digest(list(entries.values())))
+            finally:
+                with self.lock:
+                    if sent:
+                        self.sent += 1
+                    else:
+                        # back ahead of what was submitted meanwhile, a newer alert for the same key wins
+                        entries.update(self.pending.get(name, {}))
+                        self.pending[name] = entries
+            if sent:
+                delivered.append(name)
+        return delivered
+
+    def active_keys(self, source):
+        with self.lock:
+            return frozenset(key for (key_source, key) in self.active if key_source == source)
+
+    def export(self, source):
+        # what was sent and what still waits for a channel, for one source's checkpoint
+        with self.lock:
+            active = [[key, sent] for (key_source, key), sent in self.active.items() if key_source == source]
+            pending = [[channel, key, alert.title, alert.msg]
+                       for channel, entries in self.pending.items()
+                       for (key_source, key), (entry_source, alert) in entries.items() if key_source == source]
+        return {"active": active, "pending": pending}
+
+    def restore(self, source, state):
+        with self.lock:
+            for key, sent in state.get("active", []):
+                self.active[(source, key)] = sent
+            for channel, key, title, msg in state.get("pending", []):
+                self.pending.setdefault(channel, OrderedDict())[(source, key)] = (source, Alert(title, msg, key))
+
+    def pending_count(self):
+        with self.lock:
+            return sum(len(entries) for entries in self.pending.values())
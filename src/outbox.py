@@ -0,0 +1,100 @@
+import json
+import os
+import threading
+from collections import OrderedDict
+from time import time
+
+
+class Outbox:
+    # append-only journal of undelivered alerts: {"seq": ...} adds one, {"ack": seq} marks it delivered
+
+    def __init__(self, path, name="local"):
+        self.path = path
+        self.name = name
+        self.lock = threading.Lock()
+        self.pending = OrderedDict()
+        self.next_seq = 1
+        self.file = None
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.load()
+        self.open()
+
+    def load(self):
+        if not os.path.exists(self.path):
+            return
+        with open(self.path) as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # a torn last line from a crash mid write, its alert was never acknowledged to the caller
+                    continue
+                if "ack" in record:
+                    self.pending.pop(record["ack"], None)
+                elif "seq" in record:
+                    self.pending[record["seq"]] = record
+                    self.next_seq = max(self.next_seq, record["seq"] + 1)
+                elif "next" in record:
+                    self.next_seq = max(self.next_seq, record["next"])
+
+    def open(self):
+        self.file = open(self.path, "a+")
+        self.file.seek(0, os.SEEK_END)
+        if self.file.tell() > 0:
+            self.file.seek(self.file.tell() - 1)
+            if self.file.read(1) != "\n":
+                self.file.write("\n")
+
+    def write(self, record):
+        self.file.write(json.dumps(record) + "\n")
+        self.file.flush()
+        os.fsync(self.file.fileno())
+
+    def __len__(self):
+        return len(self.pending)
+
+    def add(self, title, msg):
+        with self.lock:
+            seq = self.next_seq
+            record = {"seq": seq, "time": time(), "title": title, "msg": msg}
+            self.write(record)
+            self.next_seq += 1
+            self.pending[seq] = record
+            return seq
+
+    def items(self):
+        with self.lock:
+            return list(self.pending.items())
+
+    def ack(self, seq):
+        with self.lock:
+            if seq not in self.pending:
+                return
+            self.write({"ack": seq})
+            del self.pending[seq]
+            if not self.pending:
+                self.compact()
+
+    def compact(self):
+        # rewrites the journal with just the pending alerts, keeping the sequence across restarts
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w") as f:
+            f.write(json.dumps({"next": self.next_seq}) + "\n")
+            for record in self.pending.values():
+                f.write(json.dumps(record) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        self.file.close()
+        os.replace(tmp_path, self.path)
+        self.open()
+
+    def message_id(self, seq):
+        record = self.pending.get(seq, {})
+        return "<tempr.%s.%d.%d@monitor>" % (self.name.replace(":", "-"), seq, int(record.get("time", 0)))
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
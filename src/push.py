@@ -0,0 +1,78 @@
+import json
+import os
+import urllib.request
+from collections import deque
+from itertools import islice
+from urllib.parse import urlencode
+
+from clock import SYSTEM
+from metrics import NULL
+from monitor_setup import Setup
+from readings import RECORD
+
+
+class PushClient:
+    # readings wait here until the collector acknowledges them, so a device that lost the network
+    # sends its backlog once it is back; the oldest go first when the buffer is full. The collector
+    # acknowledges sequence numbers, not the phone's timestamps, which step back with its clock
+
+    def __init__(self, url, name, clock=SYSTEM, metrics=NULL, batch_records=None, buffer_records=None):
+        self.url = url
+        self.name = name
+        self.clock = clock
+        self.metrics = metrics
+        self.batch_records = Setup.push_batch_records if batch_records is None else batch_records
+        self.buffer = deque(maxlen=Setup.push_buffer_records if buffer_records is None else buffer_records)
+        # a restarted client numbers from 0 again under a new boot id
+        self.boot = os.urandom(8).hex()
+        self.seq = 0
+        self.acked_at = None
+        self.active = []
+        self.batches = 0
+        self.failures = 0
+        self.dropped = 0
+
+    def add(self, record):
+        if len(self.buffer) == self.buffer.maxlen:
+            self.dropped += 1
+        self.buffer.append((self.seq, record))
+        self.seq += 1
+
+    def due(self):
+        return bool(self.buffer) and self.clock.time() - self.buffer[0][1][0] >= Setup.push_interval
+
+    def send(self, entries):
+        # the buffer only drops from the front, a batch has consecutive sequence numbers
+        query = urlencode({"device": self.name or "local", "boot": self.boot, "seq": entries[0][0]})
+        request = urllib.request.Request(self.url + "?" + query,
+                                         b"".join(RECORD.pack(*record) for seq, record in entries),
+                                         {"Content-Type": "application/octet-stream"})
+        with self.metrics.timer("push_seconds", device=self.name):
+            with urllib.request.urlopen(request, timeout=Setup.push_timeout) as response:
+                return json.load(response)
+
+    def push(self):
+        # returns False when the collector could not be reached, the records stay buffered
+        while self.buffer:
+            try:
+                reply = self.send(list(islice(self.buffer, self.batch_records)))
+                ack, active = reply["ack"], reply["active"]
+            except (OSError, ValueError, KeyError, TypeError):
+                # unreachable, or a reply that is not the collector's
+                self.failures += 1
+                self.metrics.inc("failures", device=self.name, op="push")
+                return False
+            waiting = len(self.buffer)
+            while self.buffer and self.buffer[0][0] <= ack:
+                self.buffer.popleft()
+            self.acked_at = self.clock.time()
+            self.active = active
+            self.batches += 1
+            if len(self.buffer) == waiting:
+                # nothing of the batch was acknowledged, try again next cycle instead of looping
+                return False
+        return True
+
+    def healthy(self):
+        # the collector alerts for us as long as it keeps acknowledging
+        return self.acked_at is not None and self.clock.time() - self.acked_at < Setup.push_fallback_after
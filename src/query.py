@@ -0,0 +1,157 @@
+import argparse
+import csv
+import os
+import sys
+from datetime import datetime
+
+import numpy as np
+
+from readings import RECORD, Segment, segment_names
+
+DTYPE = np.dtype({"names": ["timestamp", "battery_status", "battery_level", "temp_c", "external_temp_c"],
+                  "formats": ["<f8", "u1", "u1", "<f4", "<f4"],
+                  "offsets": [0, 8, 9, 12, 16],
+                  "itemsize": RECORD.size})
+STATS = ["min", "max", "mean"]
+
+
+def list_devices(root):
+    return sorted(name for name in os.listdir(root) if os.path.isdir(os.path.join(root, name)))
+
+
+def load(root, device, start=None, end=None):
+    path = os.path.join(root, device)
+    chunks = []
+    for name in segment_names(path):
+        segment = Segment(os.path.join(path, name))
+        try:
+            view = segment.view()
+            records = np.frombuffer(view, dtype=DTYPE)
+            timestamps = records["timestamp"]
+            if np.all(timestamps[1:] >= timestamps[:-1]):
+                # segments are appended in time order, so a range is a slice found by binary search
+                lo = 0 if start is None else np.searchsorted(timestamps, start, "left")
+                hi = len(records) if end is None else np.searchsorted(timestamps, end, "left")
+                if hi > lo:
+                    chunks.append(records[lo:hi].copy())
+            else:
+                # unless the phone's clock stepped back while it recorded
+                keep = np.ones(len(records), dtype=bool)
+                if start is not None:
+                    keep &= timestamps >= start
+                if end is not None:
+                    keep &= timestamps < end
+                if keep.any():
+                    chunks.append(records[keep])
+            del records, timestamps
+            view.release()
+        finally:
+            segment.close()
+    if not chunks:
+        return np.empty(0, dtype=DTYPE)
+    return np.concatenate(chunks)
+
+
+def bucket_stats(values, starts, percentiles):
+    # NaNs sort last in their bucket and are left out as numpy's nan functions do,
+    # a bucket of nothing but NaNs gives NaN
+    nan = np.isnan(values)
+    valid = np.add.reduceat((~nan).astype(np.int64), starts)
+    counts = np.maximum(valid, 1)
+    ends = starts + counts - 1
+    sums = np.add.reduceat(np.where(nan, 0.0, values), starts)
+    stats = {"min": values[starts], "max": values[ends],
+             "mean": np.where(valid > 0, sums / counts, np.nan)}
+    for p in percentiles:
+        # linear interpolation between closest ranks, as numpy.percentile does
+        position = starts + (counts - 1) * (p / 100.0)
+        lower = np.floor(position).astype(np.int64)
+        upper = np.minimum(lower + 1, ends)
+        fraction = position - lower
+        stats["p%g" % p] = values[lower] * (1 - fraction) + values[upper] * fraction
+    return stats
+
+
+def aggregate(records, bucket_seconds, fields, percentiles=()):
+    if len(records) == 0:
+        return {"bucket": np.empty(0), "count": np.empty(0, dtype=np.int64)}
+    # stored in time order unless the phone's clock stepped back; np.unique offsets need it
+    records = records[np.argsort(records["timestamp"], kind="stable")]
+    buckets = (records["timestamp"] // bucket_seconds).astype(np.int64)
+    keys, starts, counts = np.unique(buckets, return_index=True, return_counts=True)
+    columns = {"bucket": keys * float(bucket_seconds), "count": counts}
+    for field in fields:
+        values = records[field].astype(np.float64)
+        order = np.lexsort((values, buckets))
+        # buckets are the primary sort key, so np.unique offsets still delimit each bucket
+        for stat, column in bucket_stats(values[order], starts, percentiles).items():
+            columns["%s_%s" % (field, stat)] = column
+    return columns
+
+
+def query(root, devices, start, end, bucket_seconds, fields, percentiles):
+    results = {}
+    for device in devices:
+        results[device] = aggregate(load(root, device, start, end), bucket_seconds, fields, percentiles)
+    return results
+
+
+def export_csv(results, out):
+    writer = None
+    for device, columns in results.items():
+        names = list(columns)
+        if writer is None:
+            writer = csv.writer(out)
+            writer.writerow(["device"] + names)
+        for row in zip(*(columns[name].tolist() for name in names)):
+            writer.writerow([device] + list(row))
+
+
+def export_npz(results, path):
+    arrays = {}
+    for device, columns in results.items():
+        for name, column in columns.items():
+            arrays["%s/%s" % (device, name)] = column
+    np.savez_compressed(path, **arrays)
+
+
+def parse_time(text):
+    if text is None:
+        return None
+    try:
+        return float(text)
+    except ValueError:
+        return datetime.fromisoformat(text).timestamp()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Aggregate stored temperature readings per time bucket")
+    parser.add_argument("--dir", default="readings")
+    parser.add_argument("--device", action="append", help="device name, all devices when omitted")
+    parser.add_argument("--start", help="epoch seconds or ISO date/time")
+    parser.add_argument("--end", help="epoch seconds or ISO date/time")
+    parser.add_argument("--bucket", type=float, default=3600, help="bucket width in seconds")
+    parser.add_argument("--fields", default="temp_c,battery_level")
+    parser.add_argument("--percentiles", default="50,95")
+    parser.add_argument("--format", choices=["csv", "npz"], default="csv")
+    parser.add_argument("--output", help="output file, stdout for csv when omitted")
+    args = parser.parse_args(argv)
+
+    devices = args.device or list_devices(args.dir)
+    fields = [field for field in args.fields.split(",") if field]
+    percentiles = [float(p) for p in args.percentiles.split(",") if p]
+    results = query(args.dir, devices, parse_time(args.start), parse_time(args.end), args.bucket, fields, percentiles)
+
+    if args.format == "npz":
+        if args.output is None:
+            parser.error("--output is required for npz")
+        export_npz(results, args.output)
+    elif args.output is None:
+        export_csv(results, sys.stdout)
+    else:
+        with open(args.output, "w", newline="") as out:
+            export_csv(results, out)
+
+
+if __name__ == "__main__":
+    main()
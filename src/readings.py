@@ -0,0 +1,167 @@
+import mmap
+import os
+import struct
+from array import array
+
+# timestamp, battery_status, battery_level, temp_c, external_temp_c
+RECORD = struct.Struct("<dBBxxff")
+# magic, version, record size, record count
+HEADER = struct.Struct("<4sHHQ")
+MAGIC = b"TMPR"
+VERSION = 1
+SEGMENT_SUFFIX = ".seg"
+
+
+def segment_names(path):
+    return sorted(name for name in os.listdir(path) if name.endswith(SEGMENT_SUFFIX))
+
+
+class Segment:
+
+    def __init__(self, path, capacity=None):
+        self.path = path
+        writable = capacity is not None
+        if writable and not os.path.exists(path):
+            # sized and stamped aside, a crash never leaves a segment without its header
+            temp = path + ".tmp"
+            with open(temp, "wb") as f:
+                f.truncate(HEADER.size + capacity * RECORD.size)
+                f.write(HEADER.pack(MAGIC, VERSION, RECORD.size, 0))
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(temp, path)
+        self.file = open(path, "r+b" if writable else "rb")
+        self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_WRITE if writable else mmap.ACCESS_READ)
+        magic, version, record_size, self.count = HEADER.unpack_from(self.map)
+        if (magic, version, record_size, self.count) == (bytes(len(MAGIC)), 0, 0, 0):
+            # the filesystem may zero a file whose header never reached the disk: an empty segment
+            magic, version, record_size = MAGIC, VERSION, RECORD.size
+            if writable:
+                HEADER.pack_into(self.map, 0, MAGIC, VERSION, RECORD.size, 0)
+        if magic != MAGIC or version != VERSION or record_size != RECORD.size:
+            self.close()
+            raise ValueError("Not a readings segment: %s" % path)
+        self.capacity = (len(self.map) - HEADER.size) // RECORD.size
+
+    def is_full(self):
+        return self.count >= self.capacity
+
+    def append(self, record):
+        RECORD.pack_into(self.map, HEADER.size + self.count * RECORD.size, *record)
+        # the count is bumped after the record so a crash never exposes a half written record
+        self.count += 1
+        HEADER.pack_into(self.map, 0, MAGIC, VERSION, RECORD.size, self.count)
+
+    def view(self):
+        return memoryview(self.map)[HEADER.size:HEADER.size + self.count * RECORD.size]
+
+    def records(self):
+        return RECORD.iter_unpack(self.view())
+
+    def flush(self):
+        self.map.flush()
+
+    def close(self):
+        self.map.close()
+        self.file.close()
+
+
+class RingBuffer:
+
+    def __init__(self, size):
+        self.size = size
+        self.count = 0
+        self.head = 0
+        self.timestamps = array("d", bytes(8 * size))
+        self.statuses = array("B", bytes(size))
+        self.levels = array("B", bytes(size))
+        self.temps_c = array("f", bytes(4 * size))
+        self.external_temps_c = array("f", bytes(4 * size))
+
+    def append(self, record):
+        (self.timestamps[self.head], self.statuses[self.head], self.levels[self.head],
+         self.temps_c[self.head], self.external_temps_c[self.head]) = record
+        self.head = (self.head + 1) % self.size
+        self.count = min(self.count + 1, self.size)
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, i):
+        # i counts back from the latest record: -1 is the newest
+        if not -self.count <= i < 0:
+            raise IndexError(i)
+        i = (self.head + i) % self.size
+        return (self.timestamps[i], self.statuses[i], self.levels[i],
+                self.temps_c[i], self.external_temps_c[i])
+
+    def latest(self, n=None):
+        n = self.count if n is None else min(n, self.count)
+        return [self[i] for i in range(-n, 0)]
+
+
+class ReadingStore:
+
+    def __init__(self, root, device, segment_records=65536, ring_size=1024):
+        self.path = os.path.join(root, device)
+        self.segment_records = segment_records
+        self.recent = RingBuffer(ring_size)
+        self.segment = None
+        os.makedirs(self.path, exist_ok=True)
+        names = self.segment_names()
+        if names:
+            self.segment = Segment(os.path.join(self.path, names[-1]), segment_records)
+        for record in self.tail(ring_size):
+            self.recent.append(record)
+
+    def segment_names(self):
+        return segment_names(self.path)
+
+    def next_segment_path(self):
+        names = self.segment_names()
+        index = int(names[-1][:-len(SEGMENT_SUFFIX)]) + 1 if names else 0
+        return os.path.join(self.path, "%08d%s" % (index, SEGMENT_SUFFIX))
+
+    def append(self, timestamp, battery_status, battery_level, temp_c, external_temp_c):
+        if self.segment is None or self.segment.is_full():
+            if self.segment is not None:
+                self.segment.close()
+            self.segment = Segment(self.next_segment_path(), self.segment_records)
+        record = (timestamp, battery_status, battery_level, temp_c, external_temp_c)
+        self.segment.append(record)
+        self.recent.append(record)
+
+    def tail(self, n):
+        records = []
+        for name in reversed(self.segment_names()):
+            if len(records) >= n:
+                break
+            segment = Segment(os.path.join(self.path, name))
+            try:
+                records[:0] = list(segment.records())[-(n - len(records)):]
+            finally:
+                segment.close()
+        return records
+
+    def segments(self):
+        for name in self.segment_names():
+            segment = Segment(os.path.join(self.path, name))
+            try:
+                yield segment
+            finally:
+                segment.close()
+
+    def records(self, start=None, end=None):
+        for segment in self.segments():
+            for record in segment.records():
+                if (start is None or record[0] >= start) and (end is None or record[0] < end):
+                    yield record
+
+    def flush(self):
+        if self.segment is not None:
+            self.segment.flush()
+
+    def close(self):
+        if self.segment is not None:
+            self.segment.close()
+            self.segment = None
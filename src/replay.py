@@ -0,0 +1,241 @@
+import argparse
+import contextlib
+import csv
+import json
+import math
+import os
+import random
+from bisect import bisect_right
+from datetime import datetime
+
+from clock import VirtualClock
+from commands import ASSIGNMENT, CommandTable
+from config import DEFAULTS
+from fleet import Fleet
+from logger import get_logger
+from monitor import TempMonitor, BatteryStatus
+from monitor_setup import Setup
+from readings import ReadingStore
+from simulator import SimulatedPhone, LocalDevice
+
+
+class Trace:
+    # (timestamp, battery temp_c, level, status) samples, each holding until the next one
+
+    def __init__(self, name, samples):
+        self.name = name
+        self.samples = sorted(samples)
+        self.times = [sample[0] for sample in self.samples]
+        if not self.samples:
+            raise ValueError("Trace %s has no samples" % name)
+
+    @property
+    def start(self):
+        return self.times[0]
+
+    @property
+    def end(self):
+        return self.times[-1]
+
+    def at(self, timestamp):
+        return self.samples[max(bisect_right(self.times, timestamp) - 1, 0)][1:]
+
+
+def load_csv(path, level=100, status=BatteryStatus.charging):
+    # rows of time,temp_c[,level,status] with time in epoch seconds; a header row is skipped
+    samples = []
+    with open(path, newline="") as f:
+        for row in csv.reader(f):
+            try:
+                values = [float(value) for value in row]
+            except ValueError:
+                continue
+            if len(values) < 2:
+                continue
+            samples.append((values[0], values[1],
+                            int(values[2]) if len(values) > 2 else level,
+                            int(values[3]) if len(values) > 3 else status))
+    return Trace(os.path.splitext(os.path.basename(path))[0], samples)
+
+
+def load_readings(root, device, start=None, end=None):
+    store = ReadingStore(root, device)
+    try:
+        samples = [(timestamp, temp_c, battery_level, battery_status)
+                   for timestamp, battery_status, battery_level, temp_c, external_temp_c in store.records(start, end)]
+    finally:
+        store.close()
+    return Trace(device, samples)
+
+
+def synthetic_trace(name, start, days, period=300, outages=1, seed=None):
+    # a day/night swing around 20C inside, and power outages during which the heating stops,
+    # the room drifts towards the outside temperature and the battery drains
+    rng = random.Random(seed)
+    end = start + days * 86400
+    windows = sorted((t, t + rng.uniform(2, 8) * 3600)
+                     for t in (rng.uniform(start, end - 8 * 3600) for i in range(outages)))
+    samples = []
+    temp_c, level = 20.0, 100
+    t = start
+    while t < end:
+        normal = 20 + 3 * math.sin(2 * math.pi * (t - start) / 86400) + rng.gauss(0, 0.3)
+        outside = -5 + 5 * math.sin(2 * math.pi * (t - start) / 86400)
+        if any(begin <= t < finish for begin, finish in windows):
+            temp_c += (outside - temp_c) * (1 - math.exp(-period / (4 * 3600.0)))
+            level = max(0, level - period / 600.0)
+            status = BatteryStatus.discharging
+        else:
+            temp_c += (normal - temp_c) * (1 - math.exp(-period / 1800.0))
+            level = min(100, level + period / 300.0)
+            status = BatteryStatus.charging if level < 100 else BatteryStatus.full
+        samples.append((t, temp_c + Setup.external_temp_offset_c, int(level), status))
+        t += period
+    return Trace(name, samples)
+
+
+class TracePhone(SimulatedPhone):
+    # answers battery reads from the trace at the clock's time
+
+    def __init__(self, trace, clock):
+        super().__init__(clock=clock.time)
+        self.trace = trace
+
+    def battery(self):
+        return self.trace.at(self.clock())
+
+
+class RecordingMailer:
+    # stands in for the SMTP session: every email goes through at once and is noted at the replay time
+
+    def __init__(self, clock, device, events):
+        self.clock = clock
+        self.device = device
+        self.events = events
+
+    def send(self, to, subject, body, headers=None):
+        self.events.append({"time": self.clock.time(), "device": self.device, "channel": "email",
+                            "title": subject, "msg": body})
+        return {}
+
+    def retry_delay(self):
+        return 0
+
+    def reconfigure(self, setup):
+        pass
+
+    def keepalive(self):
+        pass
+
+    def close(self):
+        pass
+
+
+def replay_setup():
+    # deliveries inline and in order, nothing written to the real readings, outbox or checkpoints
+    return {"async_notifications": False, "outbox_dir": None, "readings_dir": None, "checkpoint_dir": None,
+            "process_input": False, "phones_numbers": ["replay"], "emails": ["replay@localhost"]}
+
+
+def replay(traces, settings=(), verbose=False):
+    clock = VirtualClock(min(trace.start for trace in traces))
+    overrides = replay_setup()
+    saved = {name: getattr(Setup, name) for name in overrides}
+    for text in settings:
+        match = ASSIGNMENT.match(text)
+        if match is None:
+            raise ValueError("Expected name=value, got %s" % text)
+        # checked before anything changes, restoring must not add a setting Setup never had
+        if match.group(1) not in DEFAULTS:
+            raise ValueError("Unknown setting %s" % match.group(1))
+        saved.setdefault(match.group(1), getattr(Setup, match.group(1)))
+
+    events = []
+    monitors, phones = [], []
+    with contextlib.ExitStack() as stack:
+        if not verbose:
+            stack.enter_context(contextlib.redirect_stdout(stack.enter_context(open(os.devnull, "w"))))
+        try:
+            for name, value in overrides.items():
+                setattr(Setup, name, value)
+            table = CommandTable(None)
+            for text in settings:
+                table.execute(text)
+            for trace in traces:
+                phone = TracePhone(trace, clock)
+                monitor = TempMonitor(trace.name, trace.name, clock)
+                monitor.connection.factory = lambda addr, phone=phone: LocalDevice(phone)
+                monitor.mailer = RecordingMailer(clock, trace.name, events)
+                phones.append(phone)
+                monitors.append(monitor)
+            # shared like a fleet's, so digests and rate limits span devices
+            for monitor in monitors[1:]:
+                monitor.notifier = monitors[0].notifier
+            fleet = Fleet(monitors, clock=clock)
+            fleet.run_inline(until=max(trace.end for trace in traces))
+        finally:
+            for monitor in monitors:
+                monitor.close()
+            get_logger().flush()
+            for name, value in saved.items():
+                setattr(Setup, name, value)
+
+    for phone, trace in zip(phones, traces):
+        for timestamp, address, text in phone.sent_sms:
+            events.append({"time": timestamp, "device": trace.name, "channel": "sms", "title": None, "msg": text})
+    events.sort(key=lambda event: event["time"])
+    devices = [{"device": trace.name, "cycles": monitor.counters["cycles"], "alerts": monitor.counters["alerts"],
+                "rpcs": phone.rpc_count()}
+               for trace, monitor, phone in zip(traces, monitors, phones)]
+    return {"start": min(trace.start for trace in traces), "end": clock.time(), "errors": fleet.errors,
+            "devices": devices, "events": events}
+
+
+def format_report(report):
+    lines = ["Replayed %s .. %s, %d errors" % (datetime.fromtimestamp(report["start"]).strftime("%x %X"),
+                                               datetime.fromtimestamp(report["end"]).strftime("%x %X"),
+                                               report["errors"])]
+    for device in report["devices"]:
+        # no wake lock column: a cycle takes no virtual time, so the lock would always read 0s held
+        lines.append("%-20s %6d cycles %4d alerts %7d rpcs" % (
+            device["device"], device["cycles"], device["alerts"], device["rpcs"]))
+    for event in report["events"]:
+        lines.append("%s %-20s %-5s %s" % (datetime.fromtimestamp(event["time"]).strftime("%x %X"),
+                                           event["device"], event["channel"], event["msg"].replace("\n", " | ")))
+    return "\n".join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Replay temperature traces through the alerting logic")
+    parser.add_argument("--csv", nargs="+", default=[], help="trace files of time,temp_c[,level,status]")
+    parser.add_argument("--readings", help="readings directory to replay devices from")
+    parser.add_argument("--device", nargs="+", default=[], help="devices under --readings")
+    parser.add_argument("--start", type=float, help="first reading to replay, epoch seconds")
+    parser.add_argument("--end", type=float, help="end of the readings to replay, epoch seconds")
+    parser.add_argument("--synthetic", type=int, default=0, help="number of synthetic devices")
+    parser.add_argument("--days", type=float, default=7, help="length of synthetic traces")
+    parser.add_argument("--outages", type=int, default=1, help="power outages per synthetic trace")
+    parser.add_argument("--seed", type=int, help="seed for synthetic traces")
+    parser.add_argument("--set", nargs="+", default=[], metavar="NAME=VALUE", help="Setup values to replay with")
+    parser.add_argument("--json", action="store_true", help="print JSON instead of a report")
+    parser.add_argument("--verbose", action="store_true", help="show the monitors' log")
+    args = parser.parse_args(argv)
+
+    traces = [load_csv(path) for path in args.csv]
+    traces += [load_readings(args.readings, device, args.start, args.end) for device in args.device]
+    start = args.start or datetime.now().timestamp() - args.days * 86400
+    traces += [synthetic_trace("synthetic%d" % i, start, args.days, outages=args.outages,
+                               seed=None if args.seed is None else args.seed + i)
+               for i in range(args.synthetic)]
+    if not traces:
+        parser.error("nothing to replay, give --csv, --readings with --device, or --synthetic")
+
+    report = replay(traces, args.set, args.verbose)
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        print(format_report(report))
+
+
+if __name__ == "__main__":
+    main()
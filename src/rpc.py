@@ -0,0 +1,37 @@
+import json
+from collections import namedtuple
+
+Result = namedtuple("Result", "id,result,error")
+
+
+def is_unknown_rpc(error):
+    return error is not None and "Unknown RPC" in str(error)
+
+
+def pipeline(device, calls):
+    # writes all requests before reading any reply, one network round trip for the batch;
+    # device is an android.Android, whose client/id are the JSON-RPC stream and request counter.
+    # Wrappers that lock or time RPCs define pipeline() and hand the batch on to what they wrap.
+    wrapper = getattr(type(device), "pipeline", None)
+    if wrapper is not None:
+        return wrapper(device, calls)
+    ids = []
+    requests = []
+    for call in calls:
+        method, params = call[0], list(call[1:])
+        ids.append(device.id)
+        requests.append(json.dumps({"id": device.id, "method": method, "params": params}))
+        device.id += 1
+    device.client.write("\n".join(requests) + "\n")
+    device.client.flush()
+
+    pending = set(ids)
+    results = {}
+    while pending:
+        response = device.client.readline()
+        if not response:
+            raise ConnectionError("RPC connection closed with %d replies pending" % len(pending))
+        reply = json.loads(response)
+        pending.discard(reply["id"])
+        results[reply["id"]] = Result(reply["id"], reply["result"], reply["error"])
+    return [results[request_id] for request_id in ids]
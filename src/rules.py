@@ -0,0 +1,108 @@
+from bisect import bisect_left, bisect_right
+
+ABOVE = "above"
+BELOW = "below"
+
+
+class Rule:
+
+    def __init__(self, key, title, field, op, threshold, message,
+                 hysteresis=0.0, min_duration=0, statuses=None):
+        if op not in (ABOVE, BELOW):
+            raise ValueError("Unknown rule operator %s" % op)
+        self.key = key
+        self.title = title
+        self.field = field
+        self.op = op
+        self.threshold = threshold
+        self.message = message
+        self.hysteresis = hysteresis
+        self.min_duration = min_duration
+        self.statuses = frozenset(statuses) if statuses else None
+
+    def holds(self, value):
+        # an active rule stays active until the value is back past the hysteresis band
+        if self.op == ABOVE:
+            return value > self.threshold - self.hysteresis
+        return value < self.threshold + self.hysteresis
+
+    def format(self, sample, info):
+        return self.message % dict(sample, threshold=self.threshold, info=info)
+
+
+class RuleState:
+
+    def __init__(self):
+        self.active = set()
+        self.pending = {}
+
+
+class RulePlan:
+    # rules grouped per field and sorted by threshold: one bisect finds every rule a value trips
+
+    def __init__(self, rules):
+        self.rules = list(rules)
+        self.order = {rule.key: i for i, rule in enumerate(self.rules)}
+        if len(self.order) != len(self.rules):
+            raise ValueError("Duplicate rule keys")
+        self.fields = {}
+        for rule in self.rules:
+            above, below = self.fields.setdefault(rule.field, ([], []))
+            (above if rule.op == ABOVE else below).append(rule)
+        self.plan = []
+        for field, (above, below) in self.fields.items():
+            above.sort(key=lambda rule: rule.threshold)
+            below.sort(key=lambda rule: rule.threshold)
+            self.plan.append((field, [rule.threshold for rule in above], above,
+                              [rule.threshold for rule in below], below))
+        self.by_key = {rule.key: rule for rule in self.rules}
+
+    def triggered(self, sample):
+        rules = []
+        for field, above_thresholds, above, below_thresholds, below in self.plan:
+            value = sample.get(field)
+            if value is None:
+                continue
+            rules.extend(above[:bisect_left(above_thresholds, value)])
+            rules.extend(below[bisect_right(below_thresholds, value):])
+        return rules
+
+    def evaluate(self, sample, state, now):
+        status = sample.get("battery_status")
+        holding = set()
+        for rule in self.triggered(sample):
+            if rule.statuses is None or status in rule.statuses:
+                holding.add(rule.key)
+        for key in state.active:
+            rule = self.by_key.get(key)
+            if key in holding or rule is None:
+                continue
+            value = sample.get(rule.field)
+            if value is not None and rule.holds(value) and (rule.statuses is None or status in rule.statuses):
+                holding.add(key)
+
+        for key in list(state.pending):
+            if key not in holding:
+                del state.pending[key]
+        active = set()
+        for key in holding:
+            rule = self.by_key[key]
+            since = state.pending.setdefault(key, now)
+            if key in state.active or now - since >= rule.min_duration:
+                active.add(key)
+        state.active = active
+        return sorted((self.by_key[key] for key in active), key=lambda rule: self.order[rule.key])
+
+    def evaluate_batch(self, samples, states, now):
+        fired = {}
+        for device, sample in samples.items():
+            state = states.get(device)
+            if state is None:
+                state = states[device] = RuleState()
+            fired[device] = self.evaluate(sample, state, now)
+        return fired
+
+
+def make_rule(spec):
+    return Rule(spec["key"], spec["title"], spec["field"], spec["op"], spec["threshold"], spec["message"],
+                spec.get("hysteresis", 0.0), spec.get("min_duration", 0), spec.get("statuses"))
@@ -0,0 +1,35 @@
+from monitor_setup import Setup
+
+
+class AdaptiveSchedule:
+
+    def __init__(self, counters, trend, setup=Setup):
+        self.counters = counters
+        self.trend = trend
+        self.setup = setup
+
+    def time_to_threshold(self, now):
+        # seconds until the trend reaches the threshold it is moving towards, None when not approaching
+        slope = self.trend.slope()
+        if not slope:
+            return None
+        return self.trend.time_to_reach(self.setup.temp_max if slope > 0 else self.setup.temp_min, now)
+
+    def next_interval(self, temp_f, now):
+        low, high = self.setup.adaptive_sleep_min, self.setup.adaptive_sleep_max
+        margin = min(temp_f - self.setup.temp_min, self.setup.temp_max - temp_f)
+        interval = high * max(0.0, min(1.0, margin / self.setup.adaptive_margin_f))
+        crossing = self.time_to_threshold(now)
+        if crossing is not None:
+            interval = min(interval, crossing * self.setup.adaptive_crossing_fraction)
+        interval = max(low, min(high, interval))
+
+        self.counters["adaptive_samples"] += 1
+        self.counters["adaptive_seconds"] += interval
+        # samples a fixed sleep_between_get_temp schedule would have taken over the same time
+        self.counters["fixed_samples"] += interval / self.setup.sleep_between_get_temp
+        if interval <= low:
+            self.counters["adaptive_fast"] += 1
+        elif interval >= high:
+            self.counters["adaptive_slow"] += 1
+        return interval
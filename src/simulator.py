@@ -0,0 +1,308 @@
+import json
+import random
+import socket
+import socketserver
+import threading
+from collections import Counter
+from time import time, sleep
+
+from rpc import Result
+from wifi import Wifi
+
+
+class RpcError(Exception):
+    pass
+
+
+class SimulatedPhone:
+    # the device side of the SL4A calls TempMonitor makes; rpc_<name> implements RPC <name>
+
+    def __init__(self, temps=(25.0,), level=80, status=3, operator="SimCarrier", wifi=True,
+                 ready_delay=0.0, error_rate=0.0, seed=None, clock=time):
+        # temps: list of temperatures in C, one per sample (the last one repeats), or a function of time
+        self.temps = temps if callable(temps) else list(temps)
+        self.sample = -1
+        self.level = level
+        self.status = status
+        self.operator = operator
+        self.wifi = wifi
+        self.wifi_recovers = True
+        self.ready_delay = ready_delay
+        self.error_rate = error_rate
+        self.random = random.Random(seed)
+        self.clock = clock
+        self.lock = threading.Lock()
+        # SL4A's event buffer: events stay until read with eventWait/eventPoll or cleared
+        self.events = []
+        self.event_posted = threading.Condition(self.lock)
+        self.sms_event = "sms_received"
+        self.calls = Counter()
+        self.failures = Counter()
+        self.monitoring_since = None
+        self.wake_lock_since = None
+        self.wake_lock_seconds = 0.0
+        self.sent_sms = []
+        self.inbox = []
+        self.offline = False
+
+    def fail(self, method, times=1):
+        self.failures[method] += times
+
+    def call(self, method, params):
+        with self.lock:
+            self.calls[method] += 1
+            if self.failures[method] > 0:
+                self.failures[method] -= 1
+                raise RpcError("Injected failure in %s" % method)
+            if self.error_rate and not method.startswith("_") and self.random.random() < self.error_rate:
+                raise RpcError("Random failure in %s" % method)
+            handler = getattr(self, "rpc_" + method, None)
+            if handler is None:
+                raise RpcError("Unknown RPC.")
+            return handler(*params)
+
+    def rpc_count(self):
+        return sum(count for method, count in self.calls.items() if not method.startswith("_"))
+
+    def temperature_c(self):
+        if callable(self.temps):
+            return self.temps(self.clock())
+        return self.temps[min(max(self.sample, 0), len(self.temps) - 1)]
+
+    def battery(self):
+        # temperature in C, level and status of the current sample
+        return self.temperature_c(), self.level, self.status
+
+    def battery_ready(self):
+        return self.monitoring_since is not None and self.clock() - self.monitoring_since >= self.ready_delay
+
+    def add_sms(self, body, address="5550100"):
+        msg_id = len(self.inbox) + 1
+        self.inbox.append({"_id": msg_id, "date": str(int(self.clock() * 1000)), "address": address, "body": body})
+        if self.sms_event:
+            self.post_event(self.sms_event, {"_id": msg_id})
+        return msg_id
+
+    def post_event(self, name, data=None):
+        with self.event_posted:
+            self.events.append({"name": name, "data": data, "time": int(self.clock() * 1000)})
+            self.event_posted.notify_all()
+
+    def rpc__authenticate(self, handshake):
+        return True
+
+    def rpc_getNetworkOperatorName(self):
+        return self.operator
+
+    def rpc_batteryStartMonitoring(self):
+        self.monitoring_since = self.clock()
+        self.sample += 1
+
+    def rpc_batteryStopMonitoring(self):
+        self.monitoring_since = None
+
+    def rpc_readBatteryData(self):
+        if not self.battery_ready():
+            return None
+        temp_c, level, status = self.battery()
+        return {"temperature": int(round(temp_c * 10)), "level": level, "status": status,
+                "health": 2, "plugged": 0, "battery_present": True}
+
+    def rpc_batteryGetTemperature(self):
+        return int(round(self.battery()[0] * 10)) if self.battery_ready() else None
+
+    def rpc_batteryGetLevel(self):
+        return self.battery()[1] if self.battery_ready() else None
+
+    def rpc_batteryGetStatus(self):
+        return self.battery()[2] if self.battery_ready() else None
+
+    def rpc_wakeLockAcquirePartial(self):
+        if self.wake_lock_since is None:
+            self.wake_lock_since = self.clock()
+
+    def rpc_wakeLockRelease(self):
+        if self.wake_lock_since is not None:
+            self.wake_lock_seconds += self.clock() - self.wake_lock_since
+            self.wake_lock_since = None
+
+    def rpc_checkWifiState(self):
+        return self.wifi
+
+    def rpc_toggleWifiState(self, enabled=None):
+        self.wifi = self.wifi_recovers
+        return self.wifi
+
+    def rpc_wifiGetConnectionInfo(self):
+        if self.wifi:
+            return {Wifi.state: Wifi.state_completed, Wifi.ip: 167772170}
+        return {Wifi.state: Wifi.state_scanning, Wifi.ip: 0}
+
+    def rpc_smsSend(self, address, text):
+        self.sent_sms.append((self.clock(), address, text))
+
+    def rpc_smsGetMessages(self, unread_only, folder="inbox", attributes=None):
+        return [self.select(m, attributes) for m in self.inbox]
+
+    def rpc_smsGetMessageIds(self, unread_only, folder="inbox"):
+        return [m["_id"] for m in self.inbox]
+
+    def rpc_smsGetMessageById(self, msg_id, attributes=None):
+        for m in self.inbox:
+            if m["_id"] == msg_id:
+                return self.select(m, attributes)
+        return None
+
+    def find_event(self, name):
+        for event in self.events:
+            if event["name"] == name:
+                return event
+        return None
+
+    def rpc_eventWaitFor(self, name, timeout_ms=None):
+        # like SL4A, returns the event without taking it out of the buffer, None after the timeout;
+        # runs under self.lock, which the wait releases
+        self.event_posted.wait_for(lambda: self.find_event(name) is not None,
+                                   None if timeout_ms is None else timeout_ms / 1000.0)
+        return self.find_event(name)
+
+    def rpc_eventWait(self, timeout_ms=None):
+        self.event_posted.wait_for(lambda: self.events, None if timeout_ms is None else timeout_ms / 1000.0)
+        return self.events.pop(0) if self.events else None
+
+    def rpc_eventClearBuffer(self):
+        del self.events[:]
+
+    @staticmethod
+    def select(message, attributes):
+        if not attributes:
+            return dict(message)
+        return {name: message[name] for name in attributes if name in message}
+
+
+class Sl4aHandler(socketserver.StreamRequestHandler):
+
+    def handle(self):
+        server = self.server
+        buffer = b""
+        while True:
+            data = self.request.recv(65536)
+            if not data or server.phone.offline:
+                return
+            *lines, buffer = (buffer + data).split(b"\n")
+            if not lines:
+                continue
+            # the latency is per round trip: requests that arrived together, a pipelined batch, wait once
+            if server.latency:
+                sleep(server.latency * (1 + server.jitter * (2 * server.phone.random.random() - 1)))
+            responses = []
+            for line in lines:
+                request = json.loads(line.decode())
+                try:
+                    result, error = server.phone.call(request["method"], request.get("params", [])), None
+                except RpcError as err:
+                    result, error = None, str(err)
+                responses.append(json.dumps({"id": request["id"], "result": result, "error": error}) + "\n")
+            self.request.sendall("".join(responses).encode())
+
+
+class Sl4aServer(socketserver.ThreadingTCPServer):
+    # a local stand-in for the SL4A JSON-RPC server running on a phone
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, phone=None, latency=0.0, jitter=0.0, host="127.0.0.1", port=0):
+        super().__init__((host, port), Sl4aHandler)
+        self.phone = SimulatedPhone() if phone is None else phone
+        self.latency = latency
+        self.jitter = jitter
+        self.thread = None
+
+    @property
+    def address(self):
+        return self.server_address
+
+    def start(self):
+        self.thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+class Sl4aClient:
+    # speaks the same line protocol as android.Android, for hosts without the SL4A android module
+
+    def __init__(self, addr, handshake=None):
+        self.conn = socket.create_connection(tuple(addr))
+        self.client = self.conn.makefile("rw")
+        self.id = 0
+        if handshake is not None:
+            self._rpc("_authenticate", handshake)
+
+    def _rpc(self, method, *args):
+        request = {"id": self.id, "method": method, "params": list(args)}
+        self.id += 1
+        self.client.write(json.dumps(request) + "\n")
+        self.client.flush()
+        response = self.client.readline()
+        if not response:
+            raise ConnectionError("SL4A connection closed")
+        reply = json.loads(response)
+        return Result(reply["id"], reply["result"], reply["error"])
+
+    def __getattr__(self, name):
+        if name.startswith("__"):
+            raise AttributeError(name)
+
+        def rpc(*args):
+            return self._rpc(name, *args)
+        return rpc
+
+
+class LocalConn:
+    # DeviceConnection sets a timeout on, health-checks and closes a real socket; an idle socket pair
+    # passes its checks, and closing this end closes the peer too
+
+    def __init__(self):
+        self.sock, self.peer = socket.socketpair()
+
+    def fileno(self):
+        return self.sock.fileno()
+
+    def settimeout(self, timeout):
+        self.sock.settimeout(timeout)
+
+    def close(self):
+        self.sock.close()
+        self.peer.close()
+
+
+class LocalDevice:
+    # calls the phone in process, for replays where a socket per RPC would dominate the run time
+
+    def __init__(self, phone):
+        self.phone = phone
+        self.conn = LocalConn()
+        self.id = 0
+
+    def close(self):
+        self.conn.close()
+
+    def _rpc(self, method, *args):
+        self.id += 1
+        try:
+            return Result(self.id, self.phone.call(method, args), None)
+        except RpcError as err:
+            return Result(self.id, None, str(err))
+
+    def __getattr__(self, name):
+        if name.startswith("__"):
+            raise AttributeError(name)
+
+        def rpc(*args):
+            return self._rpc(name, *args)
+        return rpc
@@ -0,0 +1,66 @@
+from collections import deque
+
+
+class RollingTrend:
+    # least-squares line over the last `window` samples, kept as running sums
+
+    def __init__(self, window):
+        self.window = window
+        self.samples = deque()
+        self.origin = None
+        self.since_rebase = 0
+        self.sum_t = self.sum_y = self.sum_tt = self.sum_ty = 0.0
+
+    def __len__(self):
+        return len(self.samples)
+
+    def add(self, t, y):
+        if self.origin is None:
+            self.origin = t
+        self.samples.append((t, y))
+        self.accumulate(t - self.origin, y, 1)
+        if len(self.samples) > self.window:
+            old_t, old_y = self.samples.popleft()
+            self.accumulate(old_t - self.origin, old_y, -1)
+        self.since_rebase += 1
+        if self.since_rebase >= self.window:
+            self.rebase()
+
+    def accumulate(self, t, y, sign):
+        self.sum_t += sign * t
+        self.sum_y += sign * y
+        self.sum_tt += sign * t * t
+        self.sum_ty += sign * t * y
+
+    def rebase(self):
+        # once per window, so still O(1) amortized; keeps t small and drops accumulated rounding error
+        self.origin = self.samples[0][0]
+        self.since_rebase = 0
+        self.sum_t = self.sum_y = self.sum_tt = self.sum_ty = 0.0
+        for t, y in self.samples:
+            self.accumulate(t - self.origin, y, 1)
+
+    def slope(self):
+        n = len(self.samples)
+        if n < 2:
+            return None
+        denominator = n * self.sum_tt - self.sum_t * self.sum_t
+        if denominator <= 0:
+            return None
+        return (n * self.sum_ty - self.sum_t * self.sum_y) / denominator
+
+    def predict(self, t):
+        slope = self.slope()
+        if slope is None:
+            return None
+        n = len(self.samples)
+        intercept = (self.sum_y - slope * self.sum_t) / n
+        return intercept + slope * (t - self.origin)
+
+    def time_to_reach(self, level, now):
+        # seconds from now until the fitted line reaches level, None when it is not heading there
+        slope = self.slope()
+        if not slope:
+            return None
+        seconds = (level - self.predict(now)) / slope
+        return seconds if seconds >= 0 else None
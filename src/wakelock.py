@@ -0,0 +1,88 @@
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+
+from clock import SYSTEM
+
+
+class WakeLock:
+    # reference counted partial wake lock: the device is kept awake while anyone holds it,
+    # and the time it was held is accounted per cycle and per day
+
+    def __init__(self, get_device, days=7, clock=SYSTEM):
+        self.get_device = get_device
+        self.days = days
+        self.clock = clock
+        self.lock = threading.Lock()
+        self.count = 0
+        self.device = None
+        self.acquired_at = None
+        self.acquisitions = 0
+        self.cycle_seconds = 0.0
+        self.total_seconds = 0.0
+        self.daily = OrderedDict()
+
+    def acquire(self):
+        with self.lock:
+            device = self.get_device()
+            # a reconnected device has not seen our earlier acquire
+            if self.count == 0 or device is not self.device:
+                device.wakeLockAcquirePartial()
+                self.device = device
+            if self.count == 0:
+                self.acquired_at = self.clock.time()
+                self.acquisitions += 1
+            self.count += 1
+
+    def release(self):
+        with self.lock:
+            if self.count == 0:
+                return
+            self.count -= 1
+            if self.count > 0:
+                return
+            acquired_at, self.acquired_at = self.acquired_at, None
+            device, self.device = self.device, None
+            self.account(acquired_at, self.clock.time())
+            device.wakeLockRelease()
+
+    @contextmanager
+    def held(self):
+        self.acquire()
+        try:
+            yield
+        finally:
+            self.release()
+
+    def reset(self):
+        # the device went away and took its wake lock with it
+        with self.lock:
+            if self.count > 0:
+                self.account(self.acquired_at, self.clock.time())
+            self.count = 0
+            self.device = None
+            self.acquired_at = None
+
+    def account(self, start, end):
+        self.cycle_seconds += end - start
+        self.total_seconds += end - start
+        while start < end:
+            day = datetime.fromtimestamp(start).date()
+            midnight = datetime.combine(day + timedelta(days=1), datetime.min.time()).timestamp()
+            self.daily[day] = self.daily.get(day, 0.0) + min(end, midnight) - start
+            start = midnight
+        while len(self.daily) > self.days:
+            self.daily.popitem(last=False)
+
+    def end_cycle(self):
+        with self.lock:
+            if self.count > 0:
+                now = self.clock.time()
+                self.account(self.acquired_at, now)
+                self.acquired_at = now
+            seconds, self.cycle_seconds = self.cycle_seconds, 0.0
+            return seconds
+
+    def held_on(self, day):
+        return self.daily.get(day, 0.0)
@@ -1,22 +1,28 @@
 from unittest import TestCase
 
-from mock import Mock
+from mock import Mock, patch
 
+from metrics import Registry
 from monitor import TempMonitor, BatteryStatus, c_to_f
 from monitor_setup import Setup
+from rpc import Result
 
 
 class TestBatteryInfo(TestCase):
 
     def setUp(self):
         self.device = Mock()
-        self.device.batteryGetStatus = Mock(return_value=(0, BatteryStatus.unknown, None))
-        self.device.batteryGetLevel = Mock(return_value=(0, 77, None))
+        self.device.readBatteryData = Mock(return_value=(0, self.battery_data(None), None))
         self.mon = TempMonitor()
         self.mon.init_device = Mock(return_value=self.device)
         self.mon.device = self.device
         self.mon.log = Mock()
         self.mon.log_error = Mock()
+        self.mon.readings = Mock()
+
+    @staticmethod
+    def battery_data(temp_in_c10, battery_level=77, battery_status=BatteryStatus.unknown):
+        return {"temperature": temp_in_c10, "level": battery_level, "status": battery_status}
 
     def test_battery_to_string(self):
         self.assertEqual("10+", self.mon.battery_to_string(BatteryStatus.charging, 10))
@@ -26,20 +32,11 @@ class TestBatteryInfo(TestCase):
         self.assertEqual("14?", self.mon.battery_to_string(BatteryStatus.unknown, 14))
 
     def test_get_battery_info(self):
-        id_temp = "id_temp"
         temp_in_c10 = 200.0
-        error_temp = None
-        self.device.batteryGetTemperature.return_value = (id_temp, temp_in_c10, error_temp)
-
-        id_level = "id_level"
         battery_level = 20
-        error_level = None
-        self.device.batteryGetLevel.return_value = (id_level, battery_level, error_level)
-
-        id_status = "id_status"
         battery_status = BatteryStatus.charging
-        error_status = None
-        self.device.batteryGetStatus.return_value = (id_status, battery_status, error_status)
+        self.device.readBatteryData.return_value = \
+            ("id_data", self.battery_data(temp_in_c10, battery_level, battery_status), None)
 
         (actual_battery_status, actual_battery_level, temp_f) = self.mon.get_battery_info()
 
@@ -47,15 +44,29 @@ class TestBatteryInfo(TestCase):
         self.assertEqual(battery_level, actual_battery_level)
         self.assertEqual(59.0, temp_f)
         assert self.device.batteryStartMonitoring.called
-        assert self.device.batteryGetTemperature.called
-        assert self.device.batteryGetLevel.called
-        assert self.device.batteryGetStatus.called
+        self.assertEqual(1, self.device.readBatteryData.call_count)
+        self.assertEqual((battery_status, battery_level, 20.0), self.mon.readings.append.call_args[0][1:4])
+        assert not self.device.batteryGetTemperature.called
+
+    def test_get_battery_info_separate_calls(self):
+        self.device.readBatteryData.return_value = (1, None, "Unknown RPC.")
+        results = [Result(2, 200.0, None), Result(3, 20, None), Result(4, BatteryStatus.charging, None)]
+        with patch("monitor.pipeline", return_value=results) as pipeline:
+            (battery_status, battery_level, temp_f) = self.mon.get_battery_info()
+            self.mon.get_battery_info()
+
+        self.assertEqual(BatteryStatus.charging, battery_status)
+        self.assertEqual(20, battery_level)
+        self.assertEqual(1, self.device.readBatteryData.call_count)
+        self.assertEqual(2, pipeline.call_count)
+        self.assertEqual(["batteryGetTemperature", "batteryGetLevel", "batteryGetStatus"],
+                         [call[0] for call in pipeline.call_args[0][1]])
 
     def test_get_temp(self):
         expected_c_temp = 10.12345
         expected_f_temp = c_to_f(expected_c_temp)
         Setup.calc_external_temp = False
-        self.device.batteryGetTemperature = Mock(return_value=(1, expected_c_temp * 10, None))
+        self.device.readBatteryData.return_value = (1, self.battery_data(expected_c_temp * 10), None)
 
         battery_status, battery_level, temp_in_f = self.mon.get_battery_info()
         self.assertEquals(expected_f_temp, temp_in_f)
@@ -65,7 +76,36 @@ class TestBatteryInfo(TestCase):
 
     def test_try_get_temp_error(self):
         error = "Mock error"
-        self.device.batteryGetTemperature = Mock(return_value=(1, 0, error))
+        self.device.readBatteryData.return_value = (1, None, error)
+
+        self.assertIsNone(self.mon.try_get_battery_info())
+        self.mon.log_error.assert_called_with(("Error getting battery data: " + error,))
+
+    def test_cycle_skipped_without_reading(self):
+        self.device.readBatteryData.return_value = (1, None, "Mock error")
+        for name in ("account_wake_lock", "acquire_device", "save_checkpoint"):
+            setattr(self.mon, name, Mock())
+        self.mon.make_alerts = Mock()
+
+        self.assertEqual(Setup.sleep_between_get_temp, self.mon.sample_and_alert())
+        self.mon.make_alerts.assert_not_called()
+        self.assertEqual(1, self.mon.counters["battery_errors"])
+        self.assertEqual(0, len(self.mon.trend))
+
+    def test_get_battery_info_waits_until_ready(self):
+        self.device.readBatteryData.side_effect = [(1, None, None), (2, self.battery_data(None), None),
+                                                   (3, self.battery_data(200.0), None)]
+
+        self.mon.metrics = Registry()
+        battery_status, battery_level, temp_f = self.mon.get_battery_info()
+        self.assertEqual(3, self.device.readBatteryData.call_count)
+        self.assertIn("tempmonitor_battery_ready_seconds_count 1", self.mon.metrics.render())
+        assert self.device.batteryStopMonitoring.called
+
+    def test_get_battery_info_not_ready(self):
+        self.addCleanup(setattr, Setup, "battery_ready_timeout", Setup.battery_ready_timeout)
+        Setup.battery_ready_timeout = 0.1
+        self.device.readBatteryData.return_value = (1, self.battery_data(None), None)
 
         self.assertIsNone(self.mon.try_get_battery_info())
-        self.mon.log_error.assert_called_with(("Error getting battery temperature: " + error,))
+        assert self.device.batteryStopMonitoring.called
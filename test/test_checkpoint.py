@@ -0,0 +1,131 @@
+import os
+import tempfile
+from unittest import TestCase
+from unittest.mock import Mock
+
+from checkpoint import Checkpoint
+from clock import VirtualClock
+from monitor import TempMonitor, BatteryStatus
+from monitor_setup import Setup
+
+START = 1700000000.0
+
+
+class TestCheckpoint(TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.dir.name, "state", "local.json")
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def test_save_and_load(self):
+        checkpoint = Checkpoint(self.path)
+        self.assertIsNone(checkpoint.load())
+        checkpoint.save({"sms_cursor": 7}, START)
+        state = Checkpoint(self.path).load()
+        self.assertEqual(7, state["sms_cursor"])
+        self.assertEqual(START, state["saved_at"])
+        self.assertEqual(["local.json"], os.listdir(os.path.dirname(self.path)))
+
+    def test_corrupt_or_old_ignored(self):
+        os.makedirs(os.path.dirname(self.path))
+        with open(self.path, "w") as f:
+            f.write('{"sms_cursor": ')
+        self.assertIsNone(Checkpoint(self.path).load())
+        with open(self.path, "w") as f:
+            f.write('{"version": 0}')
+        self.assertIsNone(Checkpoint(self.path).load())
+
+
+class TestWarmRestart(TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.saved = {name: getattr(Setup, name) for name in ("checkpoint_dir", "checkpoint_interval", "temp_min",
+                                                              "temp_max", "predict_horizon", "async_notifications",
+                                                              "health_check_interval")}
+        Setup.checkpoint_dir = self.dir.name
+        Setup.checkpoint_interval = 300
+        Setup.temp_min = 50.0
+        Setup.temp_max = 90.0
+        Setup.predict_horizon = 0
+        Setup.async_notifications = False
+        # the mocked device has no socket to health check when the virtual clock jumps
+        Setup.health_check_interval = 86400
+        self.clock = VirtualClock(START)
+
+    def tearDown(self):
+        for name, value in self.saved.items():
+            setattr(Setup, name, value)
+        self.dir.cleanup()
+
+    def make_monitor(self):
+        mon = TempMonitor(name="garage", clock=self.clock)
+        mon.log = Mock()
+        mon.readings = Mock()
+        mon.outbox = Mock()
+        mon.outbox.__len__ = Mock(return_value=0)
+        mon.device = Mock()
+        mon.sim_exists = False
+        mon.send_email_notification = Mock(return_value=True)
+        return mon
+
+    def cycle(self, mon, temp_f):
+        mon.get_battery_info = Mock(return_value=(BatteryStatus.charging, 90, temp_f))
+        mon.notification_channels = Mock(return_value=[("email", mon.send_email_notification)])
+        mon.run_cycle()
+
+    def test_alert_not_resent(self):
+        mon = self.make_monitor()
+        self.cycle(mon, 95.0)
+        self.assertEqual(1, mon.send_email_notification.call_count)
+        self.assertEqual(1, mon.checkpoint.saves)
+
+        # the process dies; the next one starts from the checkpoint
+        self.clock.advance(60)
+        mon = self.make_monitor()
+        self.assertTrue(mon.resume())
+        self.assertEqual({"frying"}, mon.rule_state.active)
+        self.cycle(mon, 96.0)
+        self.assertEqual(0, mon.send_email_notification.call_count)
+
+    def test_sms_cursor_resumed(self):
+        mon = self.make_monitor()
+        mon.sms.cursor = 0
+        mon.sms.mark(12)
+        mon.save_checkpoint()
+
+        mon = self.make_monitor()
+        mon.resume()
+        mon.device.smsGetMessageIds = Mock(return_value=(1, [11, 12, 13], None))
+        mon.device.smsGetMessageById = Mock(return_value=(2, {"_id": 13, "body": "stop"}, None))
+        self.assertEqual([{"_id": 13, "body": "stop"}], mon.sms.poll(mon.device))
+        mon.device.smsGetMessageById.assert_called_once_with(13, mon.sms.attributes)
+
+    def test_saves_only_on_change_or_interval(self):
+        mon = self.make_monitor()
+        self.cycle(mon, 70.0)
+        self.cycle(mon, 70.0)
+        self.assertEqual(1, mon.checkpoint.saves)
+        self.clock.advance(300)
+        self.cycle(mon, 70.0)
+        self.assertEqual(2, mon.checkpoint.saves)
+        self.cycle(mon, 40.0)
+        self.assertEqual(3, mon.checkpoint.saves)
+
+    def test_trend_and_counters_restored(self):
+        mon = self.make_monitor()
+        for temp_f in (70.0, 69.0, 68.0):
+            self.cycle(mon, temp_f)
+            self.clock.advance(60)
+        mon.close()
+
+        mon = self.make_monitor()
+        mon.resume()
+        self.assertEqual(3, mon.counters["cycles"])
+        self.assertAlmostEqual(-1 / 60.0, mon.trend.slope())
+
+    def test_no_checkpoint(self):
+        self.assertFalse(self.make_monitor().resume())
@@ -0,0 +1,166 @@
+import json
+import os
+import tempfile
+import urllib.error
+import urllib.parse
+import urllib.request
+from unittest import TestCase
+from unittest.mock import Mock
+
+from clock import VirtualClock
+from collector import Collector, CollectorServer
+from monitor import TempMonitor, BatteryStatus, builtin_rules
+from monitor_setup import Setup
+from notify import Notifier
+from push import PushClient
+from readings import RECORD, ReadingStore
+from simulator import SimulatedPhone, LocalDevice
+
+START = 1700000000.0
+
+
+def record(t, temp_c, level=90, status=BatteryStatus.charging):
+    return START + t, status, level, temp_c, float("nan")
+
+
+class TestCollector(TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.saved = {name: getattr(Setup, name) for name in ("async_notifications", "temp_min", "temp_max",
+                                                              "push_url", "push_interval", "push_fallback_after",
+                                                              "predict_horizon", "readings_dir", "outbox_dir",
+                                                              "checkpoint_dir")}
+        Setup.async_notifications = False
+        Setup.temp_min = 50.0
+        Setup.temp_max = 90.0
+        Setup.push_interval = 0
+        Setup.push_fallback_after = 1800
+        Setup.predict_horizon = 0
+        Setup.readings_dir = None
+        Setup.outbox_dir = None
+        Setup.checkpoint_dir = None
+        self.clock = VirtualClock(START)
+        self.sent = []
+        self.collector = Collector(self.dir.name, [("email", self.send)], self.clock)
+        self.server = CollectorServer(self.collector, 0).start()
+
+    def tearDown(self):
+        self.server.stop()
+        for name, value in self.saved.items():
+            setattr(Setup, name, value)
+        self.dir.cleanup()
+
+    def send(self, alert):
+        self.sent.append((alert.title, alert.msg))
+        return True
+
+    def test_ingest_and_alert(self):
+        client = PushClient(self.server.url, "sim0", self.clock)
+        for t, temp_c in ((0, 20.0), (300, 25.0), (600, 35.0)):
+            client.add(record(t, temp_c))
+        self.assertTrue(client.push())
+        self.assertEqual(0, len(client.buffer))
+        self.assertEqual(["frying"], client.active)
+        self.assertEqual([("Frying", "[sim0] Frying above 90F: 90+, 95F")], self.sent)
+
+        self.collector.flush()
+        store = ReadingStore(self.dir.name, "sim0")
+        try:
+            self.assertEqual([20.0, 25.0, 35.0], [r[3] for r in store.records()])
+        finally:
+            store.close()
+
+    def test_resend_after_lost_ack(self):
+        batch = b"".join(RECORD.pack(*record(t, 20.0)) for t in (0, 300))
+        self.assertEqual(1, self.collector.ingest("sim0", batch, "boot1", 0))
+        self.assertEqual(1, self.collector.ingest("sim0", batch, "boot1", 0))
+        self.assertEqual(2, self.collector.records)
+        self.assertEqual(2, self.collector.duplicates)
+        self.assertRaises(ValueError, self.collector.ingest, "sim0", batch[:-1], "boot1", 2)
+
+    def test_clock_step_back_and_restarts(self):
+        # the phone's clock stepped back an hour; the readings are new all the same
+        self.collector.ingest("sim0", RECORD.pack(*record(3600, 20.0)), "boot1", 0)
+        self.assertEqual(1, self.collector.ingest("sim0", RECORD.pack(*record(0, 21.0)), "boot1", 1))
+        # a restarted phone numbers from 0 under a new boot id
+        self.assertEqual(0, self.collector.ingest("sim0", RECORD.pack(*record(300, 22.0)), "boot2", 0))
+        self.assertEqual(3, self.collector.records)
+        # a restarted collector still knows what it acknowledged
+        self.server.stop()
+        self.collector = Collector(self.dir.name, [("email", self.send)], self.clock)
+        self.server = CollectorServer(self.collector, 0).start()
+        self.assertEqual(0, self.collector.ingest("sim0", RECORD.pack(*record(300, 22.0)), "boot2", 0))
+        self.assertEqual(1, self.collector.duplicates)
+
+    def test_device_name_checked(self):
+        batch = RECORD.pack(*record(0, 20.0))
+        for device in ("../escaped", "a/b", "..", ""):
+            query = urllib.parse.urlencode({"device": device, "boot": "boot1", "seq": 0})
+            request = urllib.request.Request(self.server.url + "?" + query, data=batch, method="POST")
+            with self.assertRaises(urllib.error.HTTPError) as raised:
+                urllib.request.urlopen(request)
+            raised.exception.close()
+            self.assertIn(raised.exception.code, (400, 404))
+        self.assertEqual(0, self.collector.records)
+        self.assertFalse(os.path.exists(os.path.join(os.path.dirname(self.dir.name), "escaped")))
+
+    def test_quiet_batch_flushes_held_digest(self):
+        self.collector.notifier = Notifier({"email": (1.0 / 600, 1)})
+        freezing, frying, power_loss = builtin_rules(Setup)
+        self.collector.notify("sim0", record(0, 5.0), [freezing])
+        self.collector.notify("sim0", record(300, 5.0, level=5), [freezing, power_loss])
+        self.assertEqual(1, len(self.sent))
+        self.assertEqual(1, self.collector.notifier.pending_count())
+
+        self.clock.advance(600)
+        self.collector.notify("sim0", record(600, 20.0), [])
+        self.assertEqual(2, len(self.sent))
+        self.assertEqual(0, self.collector.notifier.pending_count())
+
+    def test_malformed_reply(self):
+        client = PushClient(self.server.url, "sim0", self.clock)
+        client.add(record(0, 20.0))
+        client.send = Mock(return_value={"error": "busy"})
+        self.assertFalse(client.push())
+        self.assertEqual(1, client.failures)
+        self.assertEqual(1, len(client.buffer))
+
+    def test_buffers_while_offline(self):
+        client = PushClient("http://127.0.0.1:1/push", "sim1", self.clock, batch_records=2)
+        for t in range(5):
+            client.add(record(t * 300, 20.0))
+        self.assertFalse(client.push())
+        self.assertEqual(5, len(client.buffer))
+        self.assertFalse(client.healthy())
+
+        client.url = self.server.url
+        self.assertTrue(client.push())
+        self.assertEqual(3, client.batches)
+        self.assertTrue(client.healthy())
+        with urllib.request.urlopen(self.server.url.replace("/push", "/status")) as response:
+            status = json.load(response)
+        self.assertEqual(4, status["sim1"]["acked"])
+        self.assertEqual(START + 1200, status["sim1"]["latest"])
+
+    def test_monitor_push_mode(self):
+        Setup.push_url = self.server.url
+        mon = TempMonitor(name="sim2", clock=self.clock)
+        mon.log = Mock()
+        phone = SimulatedPhone(temps=(40.0,), status=BatteryStatus.charging)
+        mon.connection.factory = lambda addr: LocalDevice(phone)
+        mon.send_email_notification = Mock(return_value=True)
+        mon.run_cycle()
+        # the collector alerted, the phone did not
+        self.assertEqual(0, mon.send_email_notification.call_count)
+        self.assertEqual(1, len(self.sent))
+        self.assertEqual(["frying"], mon.push.active)
+
+        # with the collector gone the phone alerts itself once the fallback delay passed
+        mon.push.url = "http://127.0.0.1:1/push"
+        self.clock.advance(1800)
+        mon.notification_channels = Mock(return_value=[("email", mon.send_email_notification)])
+        mon.run_cycle()
+        self.assertEqual(1, mon.send_email_notification.call_count)
+        self.assertEqual(1, len(mon.push.buffer))
+        mon.close()
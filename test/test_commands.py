@@ -0,0 +1,89 @@
+from datetime import datetime
+from unittest import TestCase
+from unittest.mock import Mock
+
+from commands import SmsIntake, CommandTable
+from monitor_setup import Setup
+
+
+def message(msg_id, date_ms, body="hi"):
+    return {"_id": msg_id, "date": str(date_ms), "address": "123", "body": body}
+
+
+class TestSmsIntake(TestCase):
+
+    def setUp(self):
+        self.since = datetime.fromtimestamp(1000)
+        self.intake = SmsIntake(self.since, index_size=3)
+        self.device = Mock()
+        self.device.smsGetMessages.return_value = (0, [message(2, 999000), message(1, 500000), message(3, 1000000)],
+                                                   None)
+
+    def test_start_only_returns_messages_since(self):
+        self.assertEqual([3], [m["_id"] for m in self.intake.poll(self.device)])
+        self.assertEqual(3, self.intake.cursor)
+        self.device.smsGetMessages.assert_called_once_with(False, "inbox", SmsIntake.attributes)
+
+    def test_poll_fetches_only_new_ids(self):
+        self.intake.poll(self.device)
+        self.device.smsGetMessageIds.return_value = (1, [1, 2, 3, 4, 5], None)
+        self.device.smsGetMessageById.side_effect = lambda i, attributes: (2, message(i, 2000000), None)
+        self.assertEqual([4, 5], [m["_id"] for m in self.intake.poll(self.device)])
+        self.assertEqual([4, 5], [call[0][0] for call in self.device.smsGetMessageById.call_args_list])
+        self.assertEqual([], self.intake.poll(self.device))
+        self.assertEqual(1, self.device.smsGetMessages.call_count)
+
+    def test_index_is_bounded(self):
+        for msg_id in range(10):
+            self.intake.mark(msg_id)
+        self.assertEqual(3, len(self.intake.processed))
+        self.assertEqual(9, self.intake.cursor)
+
+    def test_error(self):
+        self.device.smsGetMessages.return_value = (0, None, "no permission")
+        with self.assertRaises(RuntimeError):
+            self.intake.poll(self.device)
+
+
+class TestCommandTable(TestCase):
+
+    def setUp(self):
+        self.monitor = Mock()
+        self.monitor.stop = False
+        self.commands = CommandTable(self.monitor)
+        self.temp_min = Setup.temp_min
+        self.process_input = Setup.process_input
+
+    def tearDown(self):
+        Setup.temp_min = self.temp_min
+        Setup.process_input = self.process_input
+
+    def test_assign(self):
+        self.commands.execute("Setup.temp_min = 40")
+        self.assertEqual(40.0, Setup.temp_min)
+        self.assertIsInstance(Setup.temp_min, float)
+        self.commands.execute("process_input=True")
+        self.assertTrue(Setup.process_input)
+
+    def test_assign_rejected(self):
+        for text in ["Setup.temp_min = 'cold'", "Setup.nothing = 1", "Setup.temp_min = __import__('os')",
+                     "process_input = 1", "rules = [{'key': 'hot'}]", "rules = [1]",
+                     "rules = [{'key': 'frying', 'title': 'Hot', 'field': 'temp_f', 'op': 'above',"
+                     " 'threshold': 85, 'message': 'Hot'}]",
+                     "rules = [{'key': 'hot', 'title': 'Hot', 'field': 'temp_f', 'op': 'above',"
+                     " 'threshold': 85, 'message': 'Hot %(nothing)s'}]",
+                     "notify_limits = {'sms': 3}", "notify_limits = {'sms': (0, 3)}"]:
+            with self.assertRaises(ValueError):
+                self.commands.execute(text)
+        self.assertEqual(self.temp_min, Setup.temp_min)
+        self.assertEqual([], Setup.rules)
+
+    def test_stop(self):
+        self.commands.execute(" Stop ")
+        self.assertTrue(self.monitor.stop)
+
+    def test_unknown(self):
+        with self.assertRaises(ValueError):
+            self.commands.execute("hello there")
+        with self.assertRaises(ValueError):
+            self.commands.execute("")
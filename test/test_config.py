@@ -0,0 +1,156 @@
+import json
+import os
+import tempfile
+from unittest import TestCase
+from unittest.mock import Mock
+
+from clock import VirtualClock
+from commands import CommandTable
+from config import Config, parse, setting_names
+from monitor import TempMonitor
+from monitor_setup import Setup
+
+START = 1700000000.0
+
+
+class TestParse(TestCase):
+
+    def test_valid(self):
+        defaults, devices = parse('{"defaults": {"temp_min": 45, "emails": ["a@b"]},'
+                                  ' "devices": {"sim0": {"temp_max": 80.5}}}')
+        self.assertEqual({"temp_min": 45.0, "emails": ["a@b"]}, defaults)
+        self.assertIsInstance(defaults["temp_min"], float)
+        self.assertEqual({"sim0": {"temp_max": 80.5}}, devices)
+
+    def test_all_errors_reported(self):
+        with self.assertRaises(ValueError) as context:
+            parse('{"defaults": {"temp_min": "cold", "no_such": 1}, "devices": {"sim0": 3}, "extra": {}}')
+        message = str(context.exception)
+        for part in ("unknown section extra", "defaults: temp_min expects float",
+                     "defaults: Unknown setting no_such", "devices.sim0 must be an object"):
+            self.assertIn(part, message)
+        self.assertRaises(ValueError, parse, '{"defaults": ')
+
+    def test_none_defaults_and_ranges(self):
+        defaults, devices = parse('{"defaults": {"metrics_port": 9100, "push_url": "http://host/push",'
+                                  ' "readings_dir": null}}')
+        self.assertEqual({"metrics_port": 9100, "push_url": "http://host/push", "readings_dir": None}, defaults)
+        for text, error in (('{"metrics_port": "abc"}', "metrics_port expects int"),
+                            ('{"push_url": 1}', "push_url expects str"),
+                            ('{"adaptive_margin_f": 0}', "adaptive_margin_f must be above 0"),
+                            ('{"rpc_timeout": -1}', "rpc_timeout must not be negative"),
+                            ('{"adaptive_crossing_fraction": 2}', "adaptive_crossing_fraction must be at most 1")):
+            with self.assertRaises(ValueError) as context:
+                parse('{"defaults": %s}' % text)
+            self.assertIn(error, str(context.exception))
+        self.assertEqual({"temp_min": -10.0}, parse('{"defaults": {"temp_min": -10}}')[0])
+
+
+class TestConfig(TestCase):
+
+    def setUp(self):
+        self.saved = {name: getattr(Setup, name) for name in setting_names()}
+        self.dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.dir.name, "monitor.json")
+        self.clock = VirtualClock(START)
+        self.mtime = 0
+        self.write({"defaults": {"temp_min": 40}, "devices": {"sim0": {"temp_max": 80}}})
+        self.config = Config(self.path, self.clock)
+
+    def tearDown(self):
+        for name, value in self.saved.items():
+            setattr(Setup, name, value)
+        self.dir.cleanup()
+
+    def write(self, document):
+        with open(self.path, "w") as f:
+            f.write(document if isinstance(document, str) else json.dumps(document))
+        # an explicit, always different mtime instead of relying on the filesystem's resolution
+        self.mtime += 1
+        os.utime(self.path, ns=(self.mtime * 10 ** 9, self.mtime * 10 ** 9))
+
+    def test_device_scope(self):
+        sim0 = self.config.snapshot("sim0")
+        self.assertEqual((40.0, 80.0), (sim0.temp_min, sim0.temp_max))
+        self.assertEqual((40.0, self.saved["temp_max"]), (self.config.snapshot("sim1").temp_min,
+                                                          self.config.snapshot("sim1").temp_max))
+        self.assertIs(sim0, self.config.snapshot("sim0"))
+        # the fleet wide values reach modules that read Setup
+        self.assertEqual(40.0, Setup.temp_min)
+        with self.assertRaises(AttributeError):
+            sim0.temp_min = 0
+
+    def test_reload_on_change(self):
+        before = self.config.snapshot("sim0")
+        self.write({"defaults": {"temp_min": 35}})
+        self.assertFalse(self.config.check())
+        self.clock.advance(Setup.config_check_interval)
+        self.assertTrue(self.config.check())
+        self.assertEqual(2, self.config.version)
+        after = self.config.snapshot("sim0")
+        self.assertEqual((35.0, self.saved["temp_max"]), (after.temp_min, after.temp_max))
+        self.assertEqual(40.0, before.temp_min)
+
+    def test_invalid_file_keeps_config(self):
+        self.write({"defaults": {"temp_min": "cold"}})
+        self.clock.advance(Setup.config_check_interval)
+        self.assertFalse(self.config.check())
+        self.assertEqual(1, self.config.errors)
+        self.assertEqual(40.0, self.config.snapshot().temp_min)
+
+    def test_schema_survives_applied_values(self):
+        # the file set metrics_port; the next file is still checked against the declared type
+        self.write({"defaults": {"metrics_port": 9100}})
+        self.clock.advance(Setup.config_check_interval)
+        self.assertTrue(self.config.check())
+        self.assertEqual(9100, Setup.metrics_port)
+        self.write({"defaults": {"metrics_port": "abc"}})
+        self.clock.advance(Setup.config_check_interval)
+        self.assertFalse(self.config.check())
+        self.assertEqual(9100, Setup.metrics_port)
+
+    def test_command_updates_config(self):
+        commands = CommandTable(None, config=self.config)
+        commands.execute("temp_max = 85")
+        self.assertEqual(85.0, self.config.snapshot("sim1").temp_max)
+        self.assertEqual(85.0, Setup.temp_max)
+        self.assertRaises(ValueError, commands.execute, "temp_max = 'hot'")
+        # the next edit of the file wins over runtime changes
+        self.write({"defaults": {}})
+        self.clock.advance(Setup.config_check_interval)
+        self.config.check()
+        self.assertEqual(self.saved["temp_max"], self.config.snapshot("sim1").temp_max)
+
+    def test_monitor_applies_between_cycles(self):
+        mon = TempMonitor(name="sim0", clock=self.clock)
+        mon.config = self.config
+        mon.refresh_setup()
+        device = mon.connection.device = Mock()
+        self.assertEqual(80.0, mon.rule_plan().by_key["frying"].threshold)
+
+        self.write({"devices": {"sim0": {"temp_max": 70}}})
+        self.clock.advance(Setup.config_check_interval)
+        mon.refresh_setup()
+        self.assertEqual(70.0, mon.rule_plan().by_key["frying"].threshold)
+        self.assertIs(device, mon.connection.device)
+        # the schedule, connection and Wi-Fi state read the device's values too
+        for part in (mon.schedule, mon.connection, mon.wifi):
+            self.assertIs(mon.setup, part.setup)
+        self.assertEqual(self.saved["adaptive_sleep_min"], mon.schedule.next_interval(69.0, START))
+
+    def test_notifier_repeat_per_device(self):
+        self.write({"devices": {"sim0": {"notify_repeat_interval": 60}}})
+        self.clock.advance(Setup.config_check_interval)
+        self.config.check()
+        mon = TempMonitor(name="sim0", clock=self.clock)
+        mon.config = self.config
+        mon.refresh_setup()
+        mon.deliver = Mock(return_value=True)
+        mon.notification_channels = Mock(return_value=[("email", Mock())])
+        alert = Mock(key="frying")
+        mon.send_notification([alert])
+        mon.send_notification([alert])
+        self.assertEqual(1, mon.notifier.suppressed)
+        self.clock.advance(60)
+        mon.send_notification([alert])
+        self.assertEqual(1, mon.notifier.suppressed)
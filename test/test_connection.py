@@ -0,0 +1,64 @@
+import socket
+from unittest import TestCase
+from unittest.mock import Mock
+
+from connection import DeviceConnection
+from monitor_setup import Setup
+
+
+class FakeDevice:
+    def __init__(self, conn):
+        self.conn = conn
+
+
+class TestConnection(TestCase):
+
+    def setUp(self):
+        self.health_check_interval = Setup.health_check_interval
+        Setup.health_check_interval = 0
+        self.peers = []
+        self.factory = Mock(side_effect=self.make_device)
+        self.connection = DeviceConnection(("localhost", 1), self.factory)
+
+    def tearDown(self):
+        Setup.health_check_interval = self.health_check_interval
+        self.connection.close()
+        for peer in self.peers:
+            peer.close()
+
+    def make_device(self, addr):
+        local, peer = socket.socketpair()
+        self.peers.append(peer)
+        return FakeDevice(local)
+
+    def test_connection_reused(self):
+        device = self.connection.get()
+        self.assertIs(device, self.connection.get())
+        self.assertEqual(1, self.factory.call_count)
+
+    def test_reconnect_on_peer_close(self):
+        device = self.connection.get()
+        self.peers[0].close()
+        self.assertIsNot(device, self.connection.get())
+        self.assertEqual(2, self.connection.connects)
+
+    def test_reconnect_on_stray_data(self):
+        device = self.connection.get()
+        self.peers[0].send(b"{}\n")
+        self.assertIsNot(device, self.connection.get())
+
+    def test_health_check_skipped_within_interval(self):
+        Setup.health_check_interval = 60
+        device = self.connection.get()
+        self.peers[0].close()
+        self.assertIs(device, self.connection.get())
+
+    def test_sim_check_due(self):
+        Setup.sim_refresh_interval = 3600
+        self.connection.get()
+        self.assertTrue(self.connection.sim_check_due())
+        self.connection.sim_checked_now()
+        self.assertFalse(self.connection.sim_check_due())
+        self.connection.close()
+        self.connection.get()
+        self.assertTrue(self.connection.sim_check_due())
@@ -0,0 +1,57 @@
+import threading
+from unittest import TestCase
+from unittest.mock import Mock
+
+from connection import SynchronizedDevice
+from dispatcher import Dispatcher
+
+
+class TestDispatcher(TestCase):
+
+    def setUp(self):
+        self.outcomes = []
+        self.dispatcher = Dispatcher(size=2, on_outcome=self.outcomes.append)
+
+    def tearDown(self):
+        self.dispatcher.stop(drain=False)
+
+    def test_jobs_run_in_background(self):
+        threads = []
+        self.dispatcher.submit("a", lambda: threads.append(threading.current_thread().name) or ["email"])
+        self.dispatcher.stop()
+        self.assertEqual(["dispatcher"], threads)
+        self.assertEqual(["email"], self.outcomes[0].result)
+        self.assertGreaterEqual(self.outcomes[0].latency, 0)
+        self.assertEqual(1, self.dispatcher.completed)
+
+    def test_submit_does_not_block(self):
+        release = threading.Event()
+        self.dispatcher.submit("blocked", release.wait)
+        while self.dispatcher.depth():
+            pass
+        self.assertTrue(self.dispatcher.submit("a", Mock()))
+        self.assertTrue(self.dispatcher.submit("b", Mock()))
+        self.assertFalse(self.dispatcher.submit("c", Mock()))
+        self.assertEqual(2, self.dispatcher.depth())
+        self.assertEqual(1, self.dispatcher.dropped)
+        release.set()
+        self.dispatcher.stop()
+        self.assertEqual(3, self.dispatcher.completed)
+
+    def test_failure_reported(self):
+        self.dispatcher.submit("bad", Mock(side_effect=RuntimeError("smtp down")))
+        self.dispatcher.stop()
+        self.assertEqual(1, self.dispatcher.failed)
+        self.assertIn("smtp down", self.outcomes[0].error)
+
+    def test_synchronized_device(self):
+        device = Mock()
+        device.conn = "socket"
+        lock = Mock()
+        lock.__enter__ = Mock()
+        lock.__exit__ = Mock(return_value=False)
+        synchronized = SynchronizedDevice(device, lock)
+        synchronized.smsSend("1", "hi")
+        device.smsSend.assert_called_once_with("1", "hi")
+        self.assertEqual(1, lock.__enter__.call_count)
+        self.assertEqual("socket", synchronized.conn)
@@ -1,3 +1,4 @@
+import smtplib
 import socket
 from unittest.mock import Mock
 
@@ -27,9 +28,8 @@ class TestEmail(TestCase):
         self.mon.mailer.send.return_value = {}
         self.assertTrue(self.mon.send_email(Alert("test", "msg")))
         # assert ensure_wifi_mock.called
-        assert self.mon.mailer.login.called
-        assert self.mon.mailer.send.called
-        assert self.mon.mailer.close.called
+        self.mon.mailer.send.assert_called_once_with(Setup.emails, "test", "msg", None)
+        assert not self.mon.mailer.close.called
 
     def test_send_try_email(self):
         self.mon.send_email = Mock(return_value=True)
@@ -41,29 +41,30 @@ class TestEmail(TestCase):
         self.assertFalse(self.mon.try_send_email("test"))
         self.assertEqual(3, self.mon.send_email.call_count)
 
+    def test_send_try_email_waits_for_backoff(self):
+        self.mon.send_email = Mock(side_effect=[False, True])
+        self.mon.mailer = Mock()
+        self.mon.mailer.retry_delay.return_value = 0
+        self.assertTrue(self.mon.try_send_email("test"))
+        assert self.mon.mailer.retry_delay.called
+
     def test_send_email_mock_failed_send_exception(self):
         self.mon.ensure_wifi = Mock()
         self.mon.mailer = Mock()
         self.mon.mailer.send.side_effect = socket.gaierror
         self.assertFalse(self.mon.send_email(Alert("test1", "msg1")))
-        assert self.mon.mailer.login.called
         assert self.mon.mailer.send.called
-        assert self.mon.mailer.close.called
 
     def test_send_email_mock_failed_send_false(self):
         self.mon.ensure_wifi = Mock()
         self.mon.mailer = Mock()
         self.mon.mailer.send.return_value = False
         self.assertFalse(self.mon.send_email(Alert("test1", "msg1")))
-        assert self.mon.mailer.login.called
         assert self.mon.mailer.send.called
-        assert self.mon.mailer.close.called
 
     def test_send_email_mock_failed_login(self):
         self.mon.ensure_wifi = Mock()
         self.mon.mailer = Mock()
-        self.mon.mailer.login.side_effect = socket.gaierror
+        self.mon.mailer.send.side_effect = smtplib.SMTPAuthenticationError(535, b"bad credentials")
         self.assertFalse(self.mon.send_email(Alert("test1", "msg1")))
-        assert self.mon.mailer.login.called
-        assert self.mon.mailer.login.not_called
-        assert self.mon.mailer.close.called
+        assert self.mon.mailer.send.called
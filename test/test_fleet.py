@@ -0,0 +1,129 @@
+import tempfile
+import threading
+from time import sleep
+from unittest import TestCase
+from unittest.mock import MagicMock, Mock
+
+from fleet import Fleet, device_name, run_monitor_cycle
+from monitor_setup import Setup
+
+
+class FakeMonitor:
+    def __init__(self, name, period=0.05, delay=0.0, error=None, cycles=3):
+        self.name = name
+        self.period = period
+        self.delay = delay
+        self.error = error
+        self.cycles = cycles
+        self.calls = 0
+        self.stop = False
+        self.device = Mock()
+        self.threads = set()
+
+    def run_cycle(self):
+        self.calls += 1
+        self.threads.add(threading.current_thread().name)
+        if self.calls >= self.cycles:
+            self.stop = True
+        sleep(self.delay)
+        if self.error is not None:
+            raise self.error
+        return self.period
+
+    def release_device(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class TestFleet(TestCase):
+
+    def test_device_name(self):
+        self.assertEqual("10.0.0.2:4321", device_name(("10.0.0.2", 4321)))
+
+    def test_all_devices_sampled(self):
+        monitors = [FakeMonitor("m%d" % i) for i in range(5)]
+        Fleet(monitors, workers=2).run()
+        for monitor in monitors:
+            self.assertEqual(3, monitor.calls)
+
+    def test_slow_device_does_not_delay_others(self):
+        slow = FakeMonitor("slow", delay=1.0, cycles=1)
+        fast = FakeMonitor("fast", period=0.01, cycles=10)
+        fleet = Fleet([slow, fast], workers=2)
+        fleet.run()
+        self.assertEqual(10, fast.calls)
+        self.assertEqual(1, slow.calls)
+
+    def test_error_isolated(self):
+        broken = FakeMonitor("broken", error=RuntimeError("dead"), cycles=1)
+        healthy = FakeMonitor("healthy")
+        fleet = Fleet([broken, healthy], workers=2)
+        fleet.run()
+        self.assertEqual(3, healthy.calls)
+        self.assertEqual(1, fleet.errors)
+        self.assertIsNone(broken.device)
+
+    def test_release_error_does_not_mask_cycle_error(self):
+        monitor = FakeMonitor("broken", error=RuntimeError("dead"))
+        monitor.release_device = Mock(side_effect=OSError("socket gone"))
+        with self.assertRaisesRegex(RuntimeError, "dead"):
+            run_monitor_cycle(monitor)
+        monitor.error = None
+        self.assertEqual(monitor.period, run_monitor_cycle(monitor))
+
+    def test_shutdown(self):
+        monitors = [FakeMonitor("m%d" % i, cycles=1000) for i in range(2)]
+        fleet = Fleet(monitors, workers=2)
+        runner = threading.Thread(target=fleet.run)
+        runner.start()
+        sleep(0.2)
+        fleet.shutdown()
+        runner.join(5)
+        self.assertFalse(runner.is_alive())
+        self.assertTrue(all(monitor.stop for monitor in monitors))
+
+    def test_shutdown_while_idle(self):
+        monitor = FakeMonitor("m", period=600, cycles=1000)
+        fleet = Fleet([monitor], workers=1)
+        runner = threading.Thread(target=fleet.run)
+        runner.start()
+        sleep(0.2)
+        # the next cycle is 10 minutes away, the fleet must not wait for it
+        fleet.shutdown()
+        runner.join(5)
+        self.assertFalse(runner.is_alive())
+        self.assertEqual(1, monitor.calls)
+
+
+class TestSharedDelivery(TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.saved = {name: getattr(Setup, name) for name in ("outbox_dir", "checkpoint_dir", "readings_dir")}
+        Setup.outbox_dir = self.dir.name
+        Setup.checkpoint_dir = Setup.readings_dir = None
+        self.fleet = Fleet.from_addresses([("10.0.0.2", 4321), ("10.0.0.3", 4321)])
+        for monitor in self.fleet.monitors:
+            monitor.log = Mock()
+            monitor.wake_lock = MagicMock()
+
+    def tearDown(self):
+        self.fleet.close()
+        for name, value in self.saved.items():
+            setattr(Setup, name, value)
+        self.dir.cleanup()
+
+    def test_outcomes_logged_by_submitting_device(self):
+        first, second = self.fleet.monitors
+        self.assertIs(first.dispatcher, second.dispatcher)
+        second.deliver("notify", lambda: ["email"])
+        first.dispatcher.stop()
+        first.log.assert_not_called()
+        self.assertIn("Delivered email", second.log.call_args[0][0])
+
+    def test_one_outbox_for_the_fleet(self):
+        first, second = self.fleet.monitors
+        self.assertIs(first.open_outbox(), second.open_outbox())
+        self.assertEqual("fleet", second.open_outbox().name)
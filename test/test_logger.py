@@ -0,0 +1,161 @@
+import gzip
+import json
+import os
+import tempfile
+import threading
+from datetime import datetime
+from time import sleep
+from unittest import TestCase
+
+import logger
+from logger import Logger, RotatingFile, compact_exception, format_text
+from monitor import TempMonitor
+
+
+class ListSink:
+    def __init__(self):
+        self.writes = []
+
+    def write(self, data):
+        self.writes.append(data)
+
+    def close(self):
+        pass
+
+
+class TestLogger(TestCase):
+
+    def test_text_format(self):
+        timestamp = datetime(2026, 3, 1, 12, 30).timestamp()
+        self.assertEqual(datetime(2026, 3, 1, 12, 30).strftime("%a %x %X") + " ERROR [sim0] Email failed: 3 seq=4",
+                         format_text((timestamp, "error", "sim0", ("Email failed:", 3), {"seq": 4})))
+
+    def test_batched(self):
+        sink = ListSink()
+        log = Logger(sink, flush_interval=60)
+        log.log("info", None, ("one",))
+        log.log("info", "sim0", ("two",), {"temp_f": 70})
+        self.assertEqual([], sink.writes)
+        log.flush()
+        self.assertEqual(1, len(sink.writes))
+        lines = sink.writes[0].splitlines()
+        self.assertTrue(lines[0].endswith(" one"))
+        self.assertTrue(lines[1].endswith(" [sim0] two temp_f=70"))
+        log.stop()
+
+    def test_json_format(self):
+        sink = ListSink()
+        log = Logger(sink, "json", flush_interval=60)
+        log.log("warning", "sim1", ("Battery", 69), {"level": 69}, timestamp=0)
+        log.stop()
+        entry = json.loads(sink.writes[0])
+        self.assertEqual({"level": 69, "device": "sim1", "msg": "Battery 69"},
+                         {name: entry[name] for name in ("level", "device", "msg")})
+        self.assertEqual(datetime.fromtimestamp(0).isoformat(timespec="milliseconds"), entry["time"])
+
+    def test_error_flushes_early(self):
+        sink = ListSink()
+        log = Logger(sink, flush_interval=60)
+        log.log("error", None, ("boom",))
+        for i in range(100):
+            if sink.writes:
+                break
+            sleep(0.01)
+        self.assertEqual(1, len(sink.writes))
+        log.stop()
+
+    def test_drops_oldest_when_full(self):
+        sink = ListSink()
+        log = Logger(sink, flush_interval=60, max_pending=2)
+        for i in range(3):
+            log.log("info", None, (i,))
+        log.stop()
+        self.assertEqual(1, log.dropped)
+        self.assertEqual(["1", "2"], [line.rsplit(" ", 1)[1] for line in sink.writes[0].splitlines()])
+
+    def test_concurrent_overflow_counted(self):
+        sink = ListSink()
+        log = Logger(sink, flush_interval=0.001, max_pending=50)
+
+        def worker():
+            for i in range(2000):
+                log.log("info", None, (i,))
+        threads = [threading.Thread(target=worker) for i in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        log.stop()
+        self.assertEqual(16000, log.written + log.dropped)
+
+    def test_monitor_log(self):
+        sink = ListSink()
+        saved, logger.LOGGER = logger.LOGGER, Logger(sink, flush_interval=60)
+        try:
+            mon = TempMonitor(name="sim2")
+            mon.log("Received message", {"body": "stop"})
+            mon.log_error("Error", 1)
+            logger.LOGGER.flush()
+        finally:
+            logger.LOGGER.stop()
+            logger.LOGGER = saved
+        lines = "".join(sink.writes).splitlines()
+        self.assertTrue(lines[0].endswith(" [sim2] Received message {'body': 'stop'}"))
+        self.assertTrue(lines[1].endswith(" ERROR [sim2] Error 1"))
+
+    def test_compact_exception(self):
+        try:
+            int("x")
+        except ValueError:
+            text = compact_exception()
+        self.assertTrue(text.startswith("ValueError: invalid literal"))
+        self.assertIn("(test_logger.py:", text)
+        self.assertTrue(text.endswith(" in test_compact_exception)"))
+
+
+class TestRotatingFile(TestCase):
+
+    def setUp(self):
+        self.root = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.root.name, "logs", "monitor.log")
+
+    def tearDown(self):
+        self.root.cleanup()
+
+    def test_rotate_by_size(self):
+        sink = RotatingFile(self.path, max_bytes=100, max_age=0, keep=2)
+        for i in range(4):
+            sink.write("%02d" % i + "x" * 58 + "\n")
+        sink.close()
+        self.assertEqual(3, sink.rotations)
+        self.assertEqual(["monitor.log", "monitor.log.1.gz", "monitor.log.2.gz"],
+                         sorted(os.listdir(os.path.dirname(self.path))))
+        with open(self.path) as f:
+            self.assertTrue(f.read().startswith("03"))
+        with gzip.open(self.path + ".1.gz", "rt") as f:
+            self.assertTrue(f.read().startswith("02"))
+        with gzip.open(self.path + ".2.gz", "rt") as f:
+            self.assertTrue(f.read().startswith("01"))
+
+    def test_rotate_by_age(self):
+        sink = RotatingFile(self.path, max_bytes=0, max_age=3600, keep=1)
+        sink.write("old\n")
+        sink.write("still current\n")
+        self.assertEqual(0, sink.rotations)
+        sink.opened -= 3600
+        sink.write("new\n")
+        sink.close()
+        self.assertEqual(1, sink.rotations)
+        with open(self.path) as f:
+            self.assertEqual("new\n", f.read())
+
+    def test_reopen_appends(self):
+        sink = RotatingFile(self.path, max_bytes=1000, max_age=0, keep=1)
+        sink.write("first\n")
+        sink.close()
+        sink = RotatingFile(self.path, max_bytes=1000, max_age=0, keep=1)
+        sink.write("second\n")
+        sink.close()
+        self.assertEqual(13, sink.size)
+        with open(self.path) as f:
+            self.assertEqual("first\nsecond\n", f.read())
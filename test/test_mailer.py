@@ -0,0 +1,92 @@
+import smtplib
+from unittest import TestCase
+from unittest.mock import patch
+
+from clock import VirtualClock
+from mailer import SmtpSession, SmtpBackoff
+from monitor_setup import Setup
+from smtp_server import LocalSmtpServer
+
+
+class TestMailer(TestCase):
+
+    def setUp(self):
+        self.keepalive = Setup.smtp_keepalive
+        self.server = LocalSmtpServer().start()
+        self.clock = VirtualClock(1700000000.0)
+        self.session = SmtpSession("127.0.0.1", self.server.port, "monitor@example.com", "secret", use_ssl=False,
+                                   clock=self.clock)
+
+    def tearDown(self):
+        Setup.smtp_keepalive = self.keepalive
+        self.session.close()
+        self.server.stop()
+
+    def test_messages_share_one_session(self):
+        self.assertEqual({}, self.session.send(["a@example.com"], "t1", "m1"))
+        self.assertEqual({}, self.session.send(["a@example.com", "b@example.com"], "t2", "m2"))
+        self.assertEqual(1, self.session.connects)
+        self.assertEqual(1, self.server.commands.count("AUTH"))
+        self.assertEqual(2, len(self.server.messages))
+        sender, recipients, message = self.server.messages[1]
+        self.assertEqual("monitor@example.com", sender)
+        self.assertEqual(["a@example.com", "b@example.com"], recipients)
+        self.assertEqual("t2", message["Subject"])
+        self.assertEqual("m2", message.get_payload().strip())
+
+    def test_refused_recipient(self):
+        self.server.refuse.add("b@example.com")
+        refused = self.session.send(["a@example.com", "b@example.com"], "t", "m")
+        self.assertIn("b@example.com", refused)
+
+    def test_all_recipients_refused_keeps_session(self):
+        self.server.refuse.add("b@example.com")
+        with self.assertRaises(smtplib.SMTPRecipientsRefused):
+            self.session.send("b@example.com", "t", "m")
+        self.assertIsNotNone(self.session.smtp)
+        self.assertEqual(0, self.session.failures)
+        self.session.send("a@example.com", "t", "m")
+        self.assertEqual(1, self.session.connects)
+        self.assertEqual(1, len(self.server.messages))
+
+    def test_noop_keepalive_when_idle(self):
+        Setup.smtp_keepalive = 0
+        self.session.send("a@example.com", "t1", "m1")
+        self.session.send("a@example.com", "t2", "m2")
+        self.assertIn("NOOP", self.server.commands)
+        self.assertEqual(1, self.session.connects)
+
+    def test_periodic_keepalive(self):
+        Setup.smtp_keepalive = 60
+        self.session.send("a@example.com", "t1", "m1")
+        self.session.keepalive()
+        self.assertNotIn("NOOP", self.server.commands)
+        self.clock.advance(60)
+        self.session.keepalive()
+        self.assertIn("NOOP", self.server.commands)
+        self.assertIsNotNone(self.session.smtp)
+        # a session the server dropped meanwhile is closed before the next alert
+        self.clock.advance(60)
+        self.server.fail_next = 1
+        self.session.keepalive()
+        self.assertIsNone(self.session.smtp)
+
+    def test_reconnect_after_server_drop(self):
+        Setup.smtp_keepalive = 0
+        self.session.send("a@example.com", "t1", "m1")
+        self.server.fail_next = 1
+        self.session.send("a@example.com", "t2", "m2")
+        self.assertEqual(2, self.session.connects)
+        self.assertEqual(2, len(self.server.messages))
+
+    @patch("mailer.random.uniform", return_value=1.0)
+    def test_backoff_after_connect_failure(self, uniform):
+        self.server.fail_next = 1
+        with self.assertRaises(Exception):
+            self.session.send("a@example.com", "t", "m")
+        self.assertGreater(self.session.retry_delay(), 0)
+        with self.assertRaises(SmtpBackoff):
+            self.session.send("a@example.com", "t", "m")
+        self.session.retry_at = 0
+        self.session.send("a@example.com", "t", "m")
+        self.assertEqual(0, self.session.failures)
@@ -0,0 +1,139 @@
+import os
+import tempfile
+import threading
+import urllib.error
+import urllib.request
+from time import sleep
+from unittest import TestCase
+from unittest.mock import Mock
+
+import metrics
+from metrics import Registry, NULL, InstrumentedDevice, MetricsServer, SamplingProfiler, get_registry
+from monitor import TempMonitor
+from monitor_setup import Setup
+from simulator import SimulatedPhone, Sl4aServer, Sl4aClient
+
+
+class TestRegistry(TestCase):
+
+    def test_render(self):
+        registry = Registry()
+        registry.inc("alerts", device="a", key="frying")
+        registry.inc("alerts", 2, device="a", key="frying")
+        registry.observe("rpc_seconds", 0.003, method="smsSend")
+        registry.observe("rpc_seconds", 2.0, method="smsSend")
+        text = registry.render()
+        self.assertIn("# TYPE tempmonitor_alerts counter", text)
+        self.assertIn('tempmonitor_alerts_total{device="a",key="frying"} 3', text)
+        self.assertIn('tempmonitor_rpc_seconds_bucket{method="smsSend",le="0.0025"} 0', text)
+        self.assertIn('tempmonitor_rpc_seconds_bucket{method="smsSend",le="0.005"} 1', text)
+        self.assertIn('tempmonitor_rpc_seconds_bucket{method="smsSend",le="+Inf"} 2', text)
+        self.assertIn('tempmonitor_rpc_seconds_sum{method="smsSend"} 2.003000', text)
+        self.assertIn('tempmonitor_rpc_seconds_count{method="smsSend"} 2', text)
+
+    def test_timer_and_write(self):
+        registry = Registry()
+        with registry.timer("cycle_seconds", device="a"):
+            pass
+        with tempfile.TemporaryDirectory() as root:
+            path = os.path.join(root, "monitor.prom")
+            registry.write(path)
+            with open(path) as f:
+                self.assertIn('tempmonitor_cycle_seconds_count{device="a"} 1', f.read())
+            self.assertEqual(["monitor.prom"], os.listdir(root))
+
+    def test_disabled(self):
+        self.assertFalse(Setup.metrics)
+        self.assertIs(NULL, get_registry())
+        with NULL.timer("cycle_seconds"):
+            NULL.inc("alerts")
+        self.assertEqual("", NULL.render())
+
+
+class TestInstrumentation(TestCase):
+
+    def setUp(self):
+        self.phone = SimulatedPhone()
+        self.server = Sl4aServer(self.phone).start()
+        self.dir = tempfile.TemporaryDirectory()
+        self.saved = {name: getattr(Setup, name) for name in ("readings_dir", "outbox_dir", "checkpoint_dir")}
+        for name in self.saved:
+            setattr(Setup, name, self.dir.name)
+
+    def tearDown(self):
+        self.server.stop()
+        for name, value in self.saved.items():
+            setattr(Setup, name, value)
+        self.dir.cleanup()
+
+    def test_device_rpcs(self):
+        registry = Registry()
+        client = Sl4aClient(self.server.address)
+        device = InstrumentedDevice(client, registry, "sim")
+        self.phone.fail("checkWifiState")
+        device.checkWifiState()
+        device.checkWifiState()
+        device.smsSend("5550100", "hi")
+        self.assertIs(client.conn, device.conn)
+        self.phone.offline = True
+        self.assertRaises(ConnectionError, device.smsSend, "5550100", "hi")
+        client.conn.close()
+        text = registry.render()
+        self.assertIn('tempmonitor_rpc_errors_total{device="sim",method="checkWifiState"} 1', text)
+        self.assertIn('tempmonitor_rpc_seconds_count{device="sim",method="checkWifiState"} 2', text)
+        self.assertIn('tempmonitor_rpc_failures_total{device="sim",method="smsSend"} 1', text)
+
+    def test_monitor_cycle(self):
+        Setup.metrics, enabled = True, Setup.metrics
+        try:
+            mon = TempMonitor(self.server.address, "metrics-test")
+        finally:
+            Setup.metrics = enabled
+        mon.connection.factory = Sl4aClient
+        mon.log = Mock()
+        mon.readings = Mock()
+        mon.send_notification = Mock()
+        try:
+            mon.run_cycle()
+        finally:
+            mon.close()
+        text = metrics.REGISTRY.render()
+        self.assertIn('tempmonitor_cycle_seconds_count{device="metrics-test"} 1', text)
+        self.assertIn('tempmonitor_rpc_seconds_count{device="metrics-test",method="readBatteryData"} 1', text)
+
+
+class TestExport(TestCase):
+
+    def test_http(self):
+        registry = Registry()
+        registry.inc("alerts")
+        server = MetricsServer(registry, 0).start()
+        try:
+            url = "http://127.0.0.1:%d" % server.server_address[1]
+            with urllib.request.urlopen(url + "/metrics") as response:
+                self.assertIn("tempmonitor_alerts_total 1", response.read().decode())
+            self.assertRaises(urllib.error.HTTPError, urllib.request.urlopen, url + "/other")
+        finally:
+            server.stop()
+
+    def test_profiler(self):
+        done = threading.Event()
+
+        def busy_wait():
+            while not done.is_set():
+                sum(range(1000))
+
+        worker = threading.Thread(target=busy_wait, name="busy")
+        worker.start()
+        profiler = SamplingProfiler(0.001).start()
+        sleep(0.05)
+        profiler.stop()
+        done.set()
+        worker.join()
+        self.assertTrue(profiler.samples > 0)
+        self.assertTrue(any(stack.startswith("busy;") and "busy_wait" in stack for stack in profiler.stacks))
+        with tempfile.TemporaryDirectory() as root:
+            path = os.path.join(root, "profile.folded")
+            profiler.write(path)
+            with open(path) as f:
+                self.assertTrue(f.readline().rsplit(" ", 1)[1].strip().isdigit())
@@ -0,0 +1,146 @@
+import threading
+from unittest import TestCase
+from unittest.mock import MagicMock, Mock
+
+from alert import Alert
+from clock import VirtualClock
+from monitor import TempMonitor
+from monitor_setup import Setup
+from notify import Notifier, TokenBucket, make_digest
+
+
+class TestNotify(TestCase):
+
+    def setUp(self):
+        Setup.notify_repeat_interval = 3600
+        self.notifier = Notifier({"sms": (1.0 / 600, 1), "email": (1.0, 2)})
+        self.sms = Mock(return_value=True)
+        self.email = Mock(return_value=True)
+        self.channels = [("sms", self.sms), ("email", self.email)]
+
+    def send(self, source, alerts, now):
+        self.notifier.submit(source, alerts, now, ["sms", "email"])
+        self.notifier.flush(self.channels, now)
+
+    def test_token_bucket(self):
+        bucket = TokenBucket(0.5, 2, 0)
+        self.assertTrue(bucket.take(0))
+        self.assertTrue(bucket.take(0))
+        self.assertFalse(bucket.take(1))
+        self.assertTrue(bucket.take(2))
+
+    def test_single_alert_untouched(self):
+        alert = Alert("Frying", "Frying above 90F")
+        self.send(None, [alert], 0)
+        self.sms.assert_called_once_with(alert)
+        self.email.assert_called_once_with(alert)
+
+    def test_alerts_coalesced_into_digest(self):
+        self.send(None, [Alert("Freezing", "cold"), Alert("Power loss", "power")], 0)
+        digest = self.email.call_args[0][0]
+        self.assertEqual("2 alerts: Freezing, Power loss", digest.title)
+        self.assertEqual("cold\npower", digest.msg)
+
+    def test_active_alert_deduplicated(self):
+        for now in range(0, 1800, 300):
+            self.send(None, [Alert("Freezing", "cold")], now)
+        self.assertEqual(1, self.email.call_count)
+        self.assertEqual(5, self.notifier.suppressed)
+        self.send(None, [Alert("Freezing", "cold")], 3600)
+        self.assertEqual(2, self.email.call_count)
+
+    def test_resolved_alert_notifies_again(self):
+        self.send(None, [Alert("Freezing", "cold")], 0)
+        self.notifier.resolve(None)
+        self.send(None, [Alert("Freezing", "cold")], 10)
+        self.assertEqual(2, self.email.call_count)
+
+    def test_rate_limited_channel_keeps_pending(self):
+        self.send("a", [Alert("Freezing", "cold")], 0)
+        self.send("b", [Alert("Frying", "hot")], 1)
+        self.send("c", [Alert("Frying", "hot")], 2)
+        self.assertEqual(1, self.sms.call_count)
+        self.assertEqual(2, self.notifier.pending_count())
+        self.notifier.flush(self.channels, 600)
+        digest = self.sms.call_args[0][0]
+        self.assertEqual("[b] hot\n[c] hot", digest.msg)
+        self.assertEqual(0, self.notifier.pending_count())
+
+    def test_failed_delivery_retried(self):
+        self.email.return_value = False
+        self.send(None, [Alert("Freezing", "cold")], 0)
+        self.assertEqual(1, self.notifier.pending_count())
+        self.email.return_value = True
+        self.notifier.flush(self.channels, 5)
+        self.assertEqual(0, self.notifier.pending_count())
+
+    def test_submit_not_blocked_by_send(self):
+        sending, release = threading.Event(), threading.Event()
+
+        def slow_email(alert):
+            sending.set()
+            release.wait(5)
+            return False
+        self.notifier.submit("a", [Alert("Freezing", "cold")], 0, ["email"])
+        flusher = threading.Thread(target=self.notifier.flush, args=([("email", slow_email)], 0))
+        flusher.start()
+        self.assertTrue(sending.wait(5))
+        # while the email is on its way another device submits and resolves without waiting
+        self.notifier.submit("b", [Alert("Frying", "hot")], 1, ["email"])
+        self.notifier.resolve("c")
+        release.set()
+        flusher.join()
+        # the failed digest is back in front of the alert submitted meanwhile
+        self.notifier.flush(self.channels, 5)
+        self.assertEqual("[a] cold\n[b] hot", self.email.call_args[0][0].msg)
+        self.assertEqual(0, self.notifier.pending_count())
+
+    def test_digest_sources(self):
+        digest = make_digest([("a", Alert("Freezing", "cold"))])
+        self.assertEqual("[a] cold", digest.msg)
+        self.assertEqual("Freezing", digest.title)
+
+
+class TestMonitorNotify(TestCase):
+
+    def setUp(self):
+        self.clock = VirtualClock(1700000000.0)
+        self.mon = TempMonitor(clock=self.clock)
+        self.mon.dispatcher = None
+        self.mon.log = Mock()
+        self.mon.wake_lock = MagicMock()
+        self.mon.notifier = Notifier({"email": (1.0 / 600, 1)})
+        self.email = Mock(return_value=True)
+        self.mon.notification_channels = Mock(return_value=[("email", self.email)])
+        for name in ("account_wake_lock", "acquire_device", "save_checkpoint"):
+            setattr(self.mon, name, Mock())
+        self.mon.try_get_battery_info = Mock(return_value=(1, 90, 60.0))
+        self.mon.push_readings = Mock(return_value=False)
+        self.mon.open_outbox = Mock(return_value=None)
+
+    def test_quiet_cycle_flushes_held_digest(self):
+        self.mon.send_notification([Alert("Freezing", "cold", "freezing")])
+        self.mon.send_notification([Alert("Freezing", "cold", "freezing"), Alert("Low", "battery", "low")])
+        self.assertEqual(1, self.email.call_count)
+        self.assertEqual(1, self.mon.notifier.pending_count())
+
+        self.mon.make_alerts = Mock(return_value=[])
+        self.clock.advance(600)
+        self.mon.sample_and_alert()
+        self.assertEqual(2, self.email.call_count)
+        self.assertEqual(0, self.mon.notifier.pending_count())
+
+    def test_alert_cycle_retries_outbox(self):
+        self.mon.send_notification([Alert("Freezing", "cold", "freezing")])
+        self.mon.outbox = ["cold"]
+        self.mon.open_outbox = Mock(return_value=self.mon.outbox)
+        self.mon.flush_outbox = Mock(return_value=True)
+        self.mon.mailer = Mock()
+
+        # the repeat is held back, the journalled email still gets its retry
+        self.mon.make_alerts = Mock(return_value=[Alert("Freezing", "cold", "freezing")])
+        self.clock.advance(600)
+        self.mon.sample_and_alert()
+        self.assertEqual(1, self.email.call_count)
+        self.mon.flush_outbox.assert_called_once_with()
+        self.mon.mailer.keepalive.assert_called_once_with()
@@ -0,0 +1,90 @@
+import os
+import tempfile
+from unittest import TestCase
+from unittest.mock import Mock
+
+from alert import Alert
+from monitor import TempMonitor
+from monitor_setup import Setup
+from outbox import Outbox
+
+
+class TestOutbox(TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.dir.name, "local.jsonl")
+        self.outbox = Outbox(self.path)
+
+    def tearDown(self):
+        self.outbox.close()
+        self.dir.cleanup()
+
+    def reopen(self):
+        self.outbox.close()
+        self.outbox = Outbox(self.path)
+
+    def test_pending_survives_restart(self):
+        self.assertEqual(1, self.outbox.add("Freezing", "cold"))
+        self.assertEqual(2, self.outbox.add("Frying", "hot"))
+        self.outbox.ack(1)
+        self.reopen()
+        self.assertEqual([2], [seq for seq, record in self.outbox.items()])
+        self.assertEqual("hot", self.outbox.items()[0][1]["msg"])
+        self.assertEqual(3, self.outbox.add("Power loss", "power"))
+
+    def test_sequence_kept_after_compaction(self):
+        self.outbox.add("Freezing", "cold")
+        self.outbox.ack(1)
+        self.assertEqual(1, len(open(self.path).readlines()))
+        self.reopen()
+        self.assertEqual(0, len(self.outbox))
+        self.assertEqual(2, self.outbox.add("Frying", "hot"))
+
+    def test_torn_write_ignored(self):
+        self.outbox.add("Freezing", "cold")
+        self.outbox.file.write('{"seq": 2, "tit')
+        self.outbox.file.flush()
+        self.reopen()
+        self.assertEqual(1, len(self.outbox))
+        self.outbox.add("Frying", "hot")
+        self.reopen()
+        self.assertEqual(["Freezing", "Frying"], [record["title"] for seq, record in self.outbox.items()])
+
+    def test_message_id_stable(self):
+        seq = self.outbox.add("Freezing", "cold")
+        message_id = self.outbox.message_id(seq)
+        self.reopen()
+        self.assertEqual(message_id, self.outbox.message_id(seq))
+
+
+class TestMonitorOutbox(TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.mon = TempMonitor()
+        self.mon.log = Mock()
+        self.mon.outbox = Outbox(os.path.join(self.dir.name, "local.jsonl"))
+        self.mon.try_send_email = Mock(return_value=False)
+
+    def tearDown(self):
+        self.mon.outbox.close()
+        self.dir.cleanup()
+
+    def test_offline_alerts_flushed_in_order(self):
+        self.assertTrue(self.mon.send_email_notification(Alert("Freezing", "cold")))
+        self.assertTrue(self.mon.send_email_notification(Alert("Freezing", "colder")))
+        self.assertEqual(2, len(self.mon.outbox))
+        self.assertEqual(2, self.mon.try_send_email.call_count)
+
+        self.mon.try_send_email = Mock(return_value=True)
+        self.assertTrue(self.mon.flush_outbox())
+        self.assertEqual(["cold", "colder"], [call[0][0].msg for call in self.mon.try_send_email.call_args_list])
+        self.assertEqual(0, len(self.mon.outbox))
+
+    def test_disabled_outbox_sends_directly(self):
+        self.mon.outbox = None
+        Setup.outbox_dir = None
+        self.assertFalse(self.mon.send_email_notification(Alert("Freezing", "cold")))
+        Setup.outbox_dir = "outbox"
+        self.mon.outbox = Outbox(os.path.join(self.dir.name, "local.jsonl"))
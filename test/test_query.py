@@ -0,0 +1,81 @@
+import io
+import os
+import tempfile
+from unittest import TestCase
+
+import numpy as np
+
+from query import load, aggregate, query, export_csv, export_npz, list_devices, parse_time, main
+from readings import ReadingStore
+
+
+class TestQuery(TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        store = ReadingStore(self.dir.name, "phone1", segment_records=7)
+        for i in range(20):
+            store.append(i * 30.0, 3, 80 - i, 10.0 + i, 5.0 + i)
+        store.close()
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def test_load_range_across_segments(self):
+        records = load(self.dir.name, "phone1", 60, 300)
+        self.assertEqual(list(range(60, 300, 30)), records["timestamp"].tolist())
+        self.assertEqual(20, len(load(self.dir.name, "phone1")))
+
+    def test_aggregate_matches_numpy(self):
+        records = load(self.dir.name, "phone1")
+        columns = aggregate(records, 120, ["temp_c", "battery_level"], [50, 90])
+        self.assertEqual([0, 120, 240, 360, 480], columns["bucket"].tolist())
+        self.assertEqual([4] * 5, columns["count"].tolist())
+        first = records["temp_c"][:4].astype(float)
+        self.assertEqual(first.min(), columns["temp_c_min"][0])
+        self.assertEqual(first.max(), columns["temp_c_max"][0])
+        self.assertAlmostEqual(first.mean(), columns["temp_c_mean"][0])
+        self.assertAlmostEqual(np.percentile(first, 90), columns["temp_c_p90"][0])
+        self.assertEqual(77, columns["battery_level_min"][0])
+
+    def test_unordered_records_and_nan(self):
+        store = ReadingStore(self.dir.name, "phone2")
+        # the clock stepped back by 200s after the third reading; the estimate is missing twice
+        for t, temp_c, external_c in ((0, 10.0, 1.0), (100, 11.0, float("nan")), (200, 12.0, 3.0),
+                                      (50, 13.0, float("nan")), (150, 14.0, 5.0)):
+            store.append(t, 3, 80, temp_c, external_c)
+        store.close()
+        records = load(self.dir.name, "phone2", 50, 150)
+        self.assertEqual([100.0, 50.0], records["timestamp"].tolist())
+        columns = aggregate(load(self.dir.name, "phone2"), 100, ["temp_c", "external_temp_c"], [50])
+        self.assertEqual([2, 2, 1], columns["count"].tolist())
+        self.assertEqual([13.0, 14.0, 12.0], columns["temp_c_max"].tolist())
+        self.assertEqual([1.0, 5.0, 3.0], columns["external_temp_c_max"].tolist())
+        self.assertEqual([1.0, 5.0, 3.0], columns["external_temp_c_mean"].tolist())
+        self.assertEqual([1.0, 5.0, 3.0], columns["external_temp_c_p50"].tolist())
+        nan = aggregate(load(self.dir.name, "phone2", 50, 51), 100, ["external_temp_c"])
+        self.assertTrue(np.isnan(nan["external_temp_c_mean"][0]))
+
+    def test_export(self):
+        results = query(self.dir.name, list_devices(self.dir.name), None, None, 300, ["temp_c"], [50])
+        out = io.StringIO()
+        export_csv(results, out)
+        lines = out.getvalue().splitlines()
+        self.assertEqual("device,bucket,count,temp_c_min,temp_c_max,temp_c_mean,temp_c_p50", lines[0])
+        self.assertEqual(3, len(lines))
+
+        path = os.path.join(self.dir.name, "out.npz")
+        export_npz(results, path)
+        with np.load(path) as data:
+            self.assertEqual([10, 10], data["phone1/count"].tolist())
+
+    def test_main_csv_file(self):
+        path = os.path.join(self.dir.name, "out.csv")
+        main(["--dir", self.dir.name, "--bucket", "600", "--output", path])
+        with open(path) as f:
+            self.assertEqual(2, len(f.read().splitlines()))
+
+    def test_parse_time(self):
+        self.assertEqual(12.5, parse_time("12.5"))
+        self.assertIsNone(parse_time(None))
+        self.assertIsInstance(parse_time("2026-01-02T03:04:05"), float)
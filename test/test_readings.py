@@ -0,0 +1,82 @@
+import math
+import os
+import tempfile
+from unittest import TestCase
+
+from readings import ReadingStore, RingBuffer, Segment, HEADER, RECORD
+
+
+class TestReadings(TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.store = ReadingStore(self.dir.name, "phone1", segment_records=4, ring_size=3)
+
+    def tearDown(self):
+        self.store.close()
+        self.dir.cleanup()
+
+    def append(self, count, start=0):
+        for i in range(start, start + count):
+            self.store.append(1000.0 + i, 2, 50 + i, 20.5, 15.5)
+
+    def test_append_and_read(self):
+        self.append(3)
+        records = list(self.store.records())
+        self.assertEqual(3, len(records))
+        self.assertEqual((1000.0, 2, 50, 20.5, 15.5), records[0])
+
+    def test_fixed_width_segments_rotate(self):
+        self.append(10)
+        self.assertEqual(["00000000.seg", "00000001.seg", "00000002.seg"], self.store.segment_names())
+        size = os.path.getsize(os.path.join(self.store.path, "00000000.seg"))
+        self.assertEqual(size, os.path.getsize(os.path.join(self.store.path, "00000002.seg")))
+        self.assertEqual(list(range(50, 60)), [r[2] for r in self.store.records()])
+
+    def test_range_query(self):
+        self.append(10)
+        self.assertEqual([1003.0, 1004.0], [r[0] for r in self.store.records(1003, 1005)])
+
+    def test_zero_copy_view(self):
+        self.append(2)
+        view = self.store.segment.view()
+        self.assertEqual(2 * RECORD.size, len(view))
+        self.assertEqual(1001.0, RECORD.unpack_from(view, RECORD.size)[0])
+        view.release()
+
+    def test_reopen_resumes(self):
+        self.append(6)
+        self.store.close()
+        self.store = ReadingStore(self.dir.name, "phone1", segment_records=4, ring_size=3)
+        self.assertEqual([1003.0, 1004.0, 1005.0], [r[0] for r in self.store.recent.latest()])
+        self.append(1, 6)
+        self.assertEqual(7, len(list(self.store.records())))
+
+    def test_ring_buffer(self):
+        ring = RingBuffer(2)
+        ring.append((1.0, 2, 3, 4.0, 5.0))
+        ring.append((2.0, 2, 3, 4.0, float("nan")))
+        ring.append((3.0, 2, 3, 4.0, 5.0))
+        self.assertEqual(2, len(ring))
+        self.assertEqual([2.0, 3.0], [r[0] for r in ring.latest()])
+        self.assertEqual(3.0, ring[-1][0])
+        self.assertTrue(math.isnan(ring.latest(3)[0][4]))
+
+    def test_not_a_segment(self):
+        path = os.path.join(self.dir.name, "bad.seg")
+        with open(path, "wb") as f:
+            f.write(b"x" * 64)
+        with self.assertRaises(ValueError):
+            Segment(path)
+
+    def test_zeroed_segment_is_empty(self):
+        self.append(4)
+        self.store.close()
+        # the next segment's header never reached the disk before a crash
+        path = os.path.join(self.store.path, "00000001.seg")
+        with open(path, "wb") as f:
+            f.truncate(HEADER.size + 4 * RECORD.size)
+        self.store = ReadingStore(self.dir.name, "phone1", segment_records=4, ring_size=3)
+        self.append(1, 4)
+        self.assertEqual(list(range(50, 55)), [r[2] for r in self.store.records()])
+        self.assertEqual(["00000000.seg", "00000001.seg"], sorted(os.listdir(self.store.path)))
@@ -0,0 +1,105 @@
+import os
+import tempfile
+from unittest import TestCase
+
+from clock import VirtualClock
+from fleet import Fleet
+from monitor import TempMonitor, BatteryStatus
+from monitor_setup import Setup
+from replay import Trace, load_csv, replay, synthetic_trace
+
+START = 1700000000.0
+
+
+class TestVirtualClock(TestCase):
+
+    def test_sleep_advances(self):
+        clock = VirtualClock(START)
+        clock.sleep(300)
+        clock.sleep(-5)
+        self.assertEqual(START + 300, clock.time())
+        self.assertEqual(START + 300, clock.now().timestamp())
+
+    def test_monitor_retries_on_clock(self):
+        clock = VirtualClock(START)
+        mon = TempMonitor(clock=clock)
+        mon.log = lambda *args: None
+        mon.mailer = None
+        mon.send_email = lambda alert, message_id=None: False
+        Setup.email_retry_delay, email_retry_delay = 7, Setup.email_retry_delay
+        try:
+            self.assertFalse(mon.try_send_email(None))
+        finally:
+            Setup.email_retry_delay = email_retry_delay
+        self.assertEqual(START + 21, clock.time())
+
+
+class CountingMonitor:
+    def __init__(self, name, period, clock, log):
+        self.name = name
+        self.period = period
+        self.clock = clock
+        self.log = log
+        self.stop = False
+        self.device = None
+
+    def run_cycle(self):
+        self.log.append((self.clock.time() - START, self.name))
+        return self.period
+
+    def release_device(self):
+        pass
+
+
+class TestReplay(TestCase):
+
+    def test_fleet_inline_order(self):
+        clock = VirtualClock(START)
+        log = []
+        monitors = [CountingMonitor("a", 300, clock, log), CountingMonitor("b", 200, clock, log)]
+        Fleet(monitors, clock=clock).run_inline(until=START + 601)
+        self.assertEqual([(0, "a"), (0, "b"), (200, "b"), (300, "a"), (400, "b"), (600, "a"), (600, "b")], log)
+
+    def test_trace_holds_samples(self):
+        trace = Trace("t", [(START + 60, 30.0, 90, 3), (START, 20.0, 100, 2)])
+        self.assertEqual((20.0, 100, 2), trace.at(START - 10))
+        self.assertEqual((20.0, 100, 2), trace.at(START + 59))
+        self.assertEqual((30.0, 90, 3), trace.at(START + 600))
+
+    def test_load_csv(self):
+        with tempfile.TemporaryDirectory() as root:
+            path = os.path.join(root, "garage.csv")
+            with open(path, "w") as f:
+                f.write("time,temp_c,level,status\n%d,25.0,80,3\n%d,26.5\n" % (START, START + 300))
+            trace = load_csv(path)
+        self.assertEqual("garage", trace.name)
+        self.assertEqual([(START, 25.0, 80, 3), (START + 300, 26.5, 100, BatteryStatus.charging)], trace.samples)
+
+    def test_replay_incident(self):
+        # room at 20C outside the battery offset, then a heat wave for two hours of a day
+        offset = Setup.external_temp_offset_c
+        samples = [(START + t, (40.0 if 36000 <= t < 43200 else 20.0) + offset, 100, BatteryStatus.full)
+                   for t in range(0, 86400, 600)]
+        temp_max = Setup.temp_max
+        report = replay([Trace("attic", samples)],
+                        ["temp_max = 95", "predict_horizon = 0", "notify_repeat_interval = 14400"])
+        self.assertEqual(temp_max, Setup.temp_max)
+        self.assertEqual(0, report["errors"])
+        emails = [event for event in report["events"] if event["channel"] == "email"]
+        self.assertEqual(1, len(emails))
+        self.assertEqual("Frying", emails[0]["title"])
+        self.assertTrue(START + 36000 <= emails[0]["time"] < START + 36000 + Setup.adaptive_sleep_max)
+        self.assertTrue(report["devices"][0]["cycles"] > 24)
+
+    def test_unknown_setting_rejected(self):
+        trace = Trace("attic", [(START, 20.0, 100, BatteryStatus.full)])
+        with self.assertRaisesRegex(ValueError, "Unknown setting temp_maxx"):
+            replay([trace], ["temp_maxx = 95"])
+        self.assertFalse(hasattr(Setup, "temp_maxx"))
+
+    def test_replay_synthetic_fleet(self):
+        traces = [synthetic_trace("s%d" % i, START, 2, outages=1, seed=i) for i in range(3)]
+        report = replay(traces)
+        self.assertEqual(["s0", "s1", "s2"], [device["device"] for device in report["devices"]])
+        self.assertTrue(all(device["cycles"] > 0 for device in report["devices"]))
+        self.assertEqual(report, replay(traces))
@@ -0,0 +1,77 @@
+import json
+import socket
+import threading
+from unittest import TestCase
+
+from connection import SynchronizedDevice
+from metrics import Registry, InstrumentedDevice
+from rpc import pipeline, is_unknown_rpc
+
+
+class SocketDevice:
+    def __init__(self, conn):
+        self.conn = conn
+        self.client = conn.makefile("rw")
+        self.id = 0
+
+
+class TestRpc(TestCase):
+
+    def setUp(self):
+        self.local, self.peer = socket.socketpair()
+        self.device = SocketDevice(self.local)
+        self.requests = []
+
+    def tearDown(self):
+        try:
+            self.device.client.close()
+        except OSError:
+            pass
+        self.local.close()
+        self.peer.close()
+
+    def serve(self, count, reverse=False):
+        stream = self.peer.makefile("rw")
+        requests = [json.loads(stream.readline()) for i in range(count)]
+        self.requests.extend(requests)
+        if reverse:
+            requests.reverse()
+        for request in requests:
+            stream.write(json.dumps({"id": request["id"], "result": request["method"], "error": None}) + "\n")
+        stream.flush()
+
+    def test_pipeline_demultiplexes_by_id(self):
+        server = threading.Thread(target=self.serve, args=(3, True))
+        server.start()
+        results = pipeline(self.device, [("batteryGetTemperature",), ("batteryGetLevel",), ("smsSend", "1", "hi")])
+        server.join()
+
+        self.assertEqual(["batteryGetTemperature", "batteryGetLevel", "smsSend"], [r.result for r in results])
+        self.assertEqual([0, 1, 2], [r.id for r in results])
+        self.assertEqual(["1", "hi"], self.requests[2]["params"])
+        self.assertEqual(3, self.device.id)
+
+    def test_pipeline_through_wrappers(self):
+        registry = Registry()
+        lock = threading.RLock()
+        device = SynchronizedDevice(InstrumentedDevice(self.device, registry, "sim"), lock)
+        server = threading.Thread(target=self.serve, args=(2,))
+        server.start()
+        results = pipeline(device, [("batteryGetTemperature",), ("batteryGetLevel",)])
+        server.join()
+
+        self.assertEqual([0, 1], [r.id for r in results])
+        # the request counter lives on the client, not on a wrapper
+        self.assertEqual(2, self.device.id)
+        self.assertNotIn("id", vars(device))
+        self.assertIn('tempmonitor_rpc_seconds_count{device="sim",method="pipeline"} 1', registry.render())
+
+    def test_pipeline_connection_closed(self):
+        self.peer.close()
+        with self.assertRaises(ConnectionError):
+            pipeline(self.device, [("batteryGetLevel",)])
+
+    def test_is_unknown_rpc(self):
+        self.assertTrue(is_unknown_rpc("Unknown RPC."))
+        self.assertFalse(is_unknown_rpc(None))
+        self.assertFalse(is_unknown_rpc("Mock error"))
@@ -0,0 +1,112 @@
+from unittest import TestCase
+from unittest.mock import Mock
+
+from alert import Alert
+from monitor import TempMonitor, BatteryStatus
+from monitor_setup import Setup
+from rules import Rule, RulePlan, RuleState, ABOVE, BELOW, make_rule
+
+
+class TestRules(TestCase):
+
+    def setUp(self):
+        self.plan = RulePlan([
+            Rule("hot", "Hot", "temp_f", ABOVE, 90, "above %(threshold)s", hysteresis=2),
+            Rule("very_hot", "Very hot", "temp_f", ABOVE, 100, "above %(threshold)s"),
+            Rule("cold", "Cold", "temp_f", BELOW, 50, "below %(threshold)s: %(info)s"),
+            Rule("slow_cold", "Slow cold", "temp_f", BELOW, 40, "cold", min_duration=600),
+            Rule("power", "Power", "battery_level", BELOW, 70, "power", statuses=[BatteryStatus.discharging])])
+        self.state = RuleState()
+
+    def keys(self, sample, now=0):
+        return [rule.key for rule in self.plan.evaluate(sample, self.state, now)]
+
+    def test_thresholds(self):
+        self.assertEqual([], self.keys({"temp_f": 70}))
+        self.assertEqual(["hot", "very_hot"], self.keys({"temp_f": 101}))
+        self.assertEqual(["cold"], self.keys({"temp_f": 45}))
+        self.assertEqual([], self.keys({"temp_f": 50}))
+
+    def test_hysteresis(self):
+        self.assertEqual(["hot"], self.keys({"temp_f": 91}))
+        self.assertEqual(["hot"], self.keys({"temp_f": 89}))
+        self.assertEqual(["hot"], self.keys({"temp_f": 90.5}))
+        self.assertEqual([], self.keys({"temp_f": 87.9}))
+        self.assertEqual([], self.keys({"temp_f": 89}))
+
+    def test_min_duration(self):
+        self.assertEqual(["cold"], self.keys({"temp_f": 35}, 0))
+        self.assertEqual(["cold"], self.keys({"temp_f": 35}, 300))
+        self.assertEqual(["cold", "slow_cold"], self.keys({"temp_f": 35}, 600))
+        self.assertEqual(["cold"], self.keys({"temp_f": 45}, 900))
+        self.assertEqual(["cold"], self.keys({"temp_f": 35}, 1000))
+
+    def test_battery_status(self):
+        self.assertEqual([], self.keys({"battery_level": 60, "battery_status": BatteryStatus.charging}))
+        self.assertEqual(["power"], self.keys({"battery_level": 60, "battery_status": BatteryStatus.discharging}))
+
+    def test_batch(self):
+        states = {}
+        fired = self.plan.evaluate_batch({"a": {"temp_f": 95}, "b": {"temp_f": 70}}, states, 0)
+        self.assertEqual(["hot"], [rule.key for rule in fired["a"]])
+        self.assertEqual([], fired["b"])
+        self.assertEqual({"hot"}, states["a"].active)
+
+    def test_format(self):
+        rule = self.plan.by_key["cold"]
+        self.assertEqual("below 50: info", rule.format({"temp_f": 45}, "info"))
+
+    def test_invalid(self):
+        with self.assertRaises(ValueError):
+            make_rule({"key": "k", "title": "t", "field": "f", "op": "equals", "threshold": 1, "message": ""})
+        with self.assertRaises(ValueError):
+            RulePlan([self.plan.rules[0], self.plan.rules[0]])
+
+    def test_lazy_alert_message(self):
+        make_msg = Mock(return_value="text")
+        alert = Alert("title", make_msg)
+        self.assertFalse(make_msg.called)
+        self.assertEqual("text", alert.msg)
+        self.assertEqual("text", alert.msg)
+        self.assertEqual(1, make_msg.call_count)
+
+
+class TestMonitorRules(TestCase):
+
+    def setUp(self):
+        Setup.temp_min = 50.0
+        Setup.temp_max = 90.0
+        Setup.low_battery = 70
+        self.mon = TempMonitor()
+
+    def test_make_alerts(self):
+        alerts = self.mon.make_alerts(BatteryStatus.discharging, 60, 40.0)
+        self.assertEqual(["Freezing", "Power loss"], [alert.title for alert in alerts])
+        self.assertEqual("Freezing below 50F: 60-, 40F", alerts[0].msg)
+        self.assertEqual("Battery level below 70 60-, 40F", alerts[1].msg)
+
+    def test_threshold_does_not_flap(self):
+        self.assertEqual(1, len(self.mon.make_alerts(BatteryStatus.charging, 90, 91.0)))
+        self.assertEqual(1, len(self.mon.make_alerts(BatteryStatus.charging, 90, 89.5)))
+        self.assertEqual(0, len(self.mon.make_alerts(BatteryStatus.charging, 90, 88.5)))
+
+    def test_recompiled_after_setup_change(self):
+        self.assertEqual(0, len(self.mon.make_alerts(BatteryStatus.charging, 90, 85.0)))
+        Setup.temp_max = 80.0
+        self.assertEqual(["Frying"], [alert.title for alert in self.mon.make_alerts(BatteryStatus.charging, 90, 85.0)])
+
+    def test_broken_rules_keep_previous_plan(self):
+        rules = Setup.rules
+        hot = {"key": "hot", "title": "Hot", "field": "temp_f", "op": ABOVE, "threshold": 85.0,
+               "message": "Hot %(info)s"}
+        try:
+            Setup.rules = [hot]
+            self.assertEqual(["Hot"], [alert.title for alert in self.mon.make_alerts(BatteryStatus.charging, 90, 86.0)])
+            # set by hand past validation: sampling goes on with the plan that compiled
+            Setup.rules = [{"key": "hot"}]
+            self.assertEqual(["Hot"], [alert.title for alert in self.mon.make_alerts(BatteryStatus.charging, 90, 86.0)])
+            # a new monitor starts with the built-in rules
+            self.assertEqual(["Frying"], [alert.title
+                                          for alert in TempMonitor().make_alerts(BatteryStatus.charging, 90, 95.0)])
+        finally:
+            Setup.rules = rules
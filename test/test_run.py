@@ -1,8 +1,12 @@
+import os
+import tempfile
 import unittest
 from datetime import datetime
 from unittest.mock import Mock
 from monitor import TempMonitor, c_to_f, BatteryStatus, get_external_temp_c
+from checkpoint import Checkpoint
 from monitor_setup import Setup
+from outbox import Outbox
 
 
 class TestRun(unittest.TestCase):
@@ -14,10 +18,16 @@ class TestRun(unittest.TestCase):
         self.mon.device = Mock()
         self.mon.log = Mock()
         self.mon.log_error = Mock()
+        self.mon.readings = Mock()
         self.mon.device.smsSend = Mock()
-        self.mon.device.batteryGetStatus = Mock(return_value=(0, BatteryStatus.unknown, None))
-        self.mon.device.batteryGetLevel = Mock(return_value=(0, 77, None))
         self.mon.device.init_device = Mock(return_value=self.mon.device)
+        self.outbox_dir = tempfile.TemporaryDirectory()
+        self.mon.outbox = Outbox(os.path.join(self.outbox_dir.name, "local.jsonl"))
+        self.mon.checkpoint = Checkpoint(os.path.join(self.outbox_dir.name, "local.json"))
+
+    def tearDown(self):
+        self.mon.close()
+        self.outbox_dir.cleanup()
 
     def test_get_external_temp(self):
         battery_c_temp = 30
@@ -25,7 +35,8 @@ class TestRun(unittest.TestCase):
         expected_external_c_temp = get_external_temp_c(battery_c_temp)
         expected_f_temp = c_to_f(expected_external_c_temp)
         Setup.calc_external_temp = True
-        self.mon.device.batteryGetTemperature = Mock(return_value=(1, battery_c_temp * 10, None))
+        self.mon.device.readBatteryData = Mock(return_value=(
+            1, {"temperature": battery_c_temp * 10, "level": 77, "status": BatteryStatus.unknown}, None))
 
         battery_status, battery_level, temp_in_f = self.mon.get_battery_info()
         self.assertEquals(expected_f_temp, temp_in_f)
@@ -76,7 +87,8 @@ class TestRun(unittest.TestCase):
     def test_process_input(self):
         last_msg_time = datetime.now()
         self.mon.device.smsGetMessages = Mock(return_value=(
-            0, [{"date": str(int(last_msg_time.timestamp() / 1000)), "address": "123456789", "body": "hi"}], None))
+            0, [{"_id": 1, "date": str(int(last_msg_time.timestamp() / 1000)), "address": "123456789", "body": "hi"}],
+            None))
         self.mon.process_input(1)
 
     def test_execute_command(self):
@@ -88,12 +100,11 @@ class TestRun(unittest.TestCase):
         self.mon.execute_command("No_Setup.temp_max = 78.33")
         self.assertNotEquals(78.33, Setup.temp_max)
         self.mon.log_error.assert_called_once_with(
-            'Error execution command No_Setup.temp_max = 78.33. error ("name \'No_Setup\' is not defined",)')
+            "Error execution command No_Setup.temp_max = 78.33. error ('Unknown command',)")
 
     def test_execute_command_failed2(self):
         text = "Regular text message"
         self.mon.execute_command(text)
         self.assertNotEquals(78.33, Setup.temp_max)
         self.mon.log_error.assert_called_once_with(
-            "Error execution command Regular text message. "
-            "error ('invalid syntax', ('<string>', 1, 12, 'Regular text message\\n'))")
+            "Error execution command Regular text message. error ('Unknown command',)")
@@ -0,0 +1,45 @@
+from collections import Counter
+from unittest import TestCase
+
+from monitor_setup import Setup
+from schedule import AdaptiveSchedule
+from trend import RollingTrend
+
+
+class TestSchedule(TestCase):
+
+    def setUp(self):
+        Setup.temp_min = 50.0
+        Setup.temp_max = 90.0
+        self.counters = Counter()
+        self.schedule = self.make_schedule()
+
+    def make_schedule(self):
+        return AdaptiveSchedule(self.counters, RollingTrend(12))
+
+    @staticmethod
+    def sample(schedule, temp_f, now):
+        schedule.trend.add(now, temp_f)
+        return schedule.next_interval(temp_f, now)
+
+    def test_stable_and_far_samples_rarely(self):
+        self.assertEqual(Setup.adaptive_sleep_max, self.sample(self.schedule, 70.0, 0))
+        self.assertEqual(Setup.adaptive_sleep_max, self.sample(self.schedule, 70.0, 900))
+        self.assertEqual(2, self.counters["adaptive_slow"])
+        self.assertGreater(self.counters["fixed_samples"], self.counters["adaptive_samples"])
+
+    def test_near_threshold_samples_often(self):
+        far = self.sample(self.schedule, 70.0, 0)
+        near = self.sample(self.make_schedule(), 55.0, 0)
+        self.assertLess(near, far)
+        self.assertEqual(Setup.adaptive_sleep_min, self.sample(self.make_schedule(), 45.0, 0))
+
+    def test_trend_towards_threshold(self):
+        self.sample(self.schedule, 70.0, 0)
+        # cooling 1F a minute, 19 minutes from temp_min
+        interval = self.sample(self.schedule, 69.0, 60)
+        self.assertAlmostEqual(19 * 60 * Setup.adaptive_crossing_fraction, interval)
+
+    def test_slow_trend_ignored(self):
+        self.sample(self.schedule, 70.0, 0)
+        self.assertEqual(Setup.adaptive_sleep_max, self.sample(self.schedule, 70.1, 60))
@@ -0,0 +1,142 @@
+import tempfile
+from time import perf_counter
+from unittest import TestCase
+from unittest.mock import Mock
+
+from benchmark import run_benchmark
+from monitor import TempMonitor, c_to_f, get_external_temp_c
+from monitor_setup import Setup
+from connection import DeviceConnection
+from rpc import pipeline
+from simulator import SimulatedPhone, Sl4aServer, Sl4aClient, LocalDevice
+
+
+class TestSimulator(TestCase):
+
+    def setUp(self):
+        self.phone = SimulatedPhone([20.0, 30.0])
+        self.server = Sl4aServer(self.phone).start()
+        self.client = Sl4aClient(self.server.address)
+        self.dir = tempfile.TemporaryDirectory()
+        self.saved = {name: getattr(Setup, name) for name in ("readings_dir", "outbox_dir", "checkpoint_dir")}
+        for name in self.saved:
+            setattr(Setup, name, self.dir.name)
+
+    def tearDown(self):
+        self.client.conn.close()
+        self.server.stop()
+        for name, value in self.saved.items():
+            setattr(Setup, name, value)
+        self.dir.cleanup()
+
+    def test_battery_trace(self):
+        self.assertEqual(None, self.client.readBatteryData().result)
+        self.client.batteryStartMonitoring()
+        self.assertEqual(200, self.client.readBatteryData().result["temperature"])
+        self.client.batteryStartMonitoring()
+        self.client.batteryStartMonitoring()
+        # the last temperature of the trace repeats
+        self.assertEqual(300, self.client.batteryGetTemperature().result)
+
+    def test_errors(self):
+        self.assertEqual("Unknown RPC.", self.client.noSuchCall().error)
+        self.phone.fail("checkWifiState")
+        self.assertTrue(self.client.checkWifiState().error.startswith("Injected failure"))
+        self.assertEqual(True, self.client.checkWifiState().result)
+        self.assertEqual(3, self.phone.rpc_count())
+
+    def test_sms(self):
+        self.phone.add_sms("temp_max = 80")
+        self.phone.add_sms("stop")
+        self.assertEqual([1, 2], self.client.smsGetMessageIds(False, "inbox").result)
+        self.assertEqual({"_id": 2, "body": "stop"}, self.client.smsGetMessageById(2, ["_id", "body"]).result)
+        self.client.smsSend("5550100", "hello")
+        self.assertEqual("hello", self.phone.sent_sms[0][2])
+
+    def test_events_stay_buffered(self):
+        started = perf_counter()
+        self.assertIsNone(self.client.eventWaitFor("sms_received", 100).result)
+        self.assertTrue(perf_counter() - started >= 0.1)
+        self.phone.add_sms("stop")
+        self.assertEqual({"_id": 1}, self.client.eventWaitFor("sms_received", 1000).result["data"])
+        self.assertEqual({"_id": 1}, self.client.eventWaitFor("sms_received", 1000).result["data"])
+        self.client.eventClearBuffer()
+        self.assertIsNone(self.client.eventWaitFor("sms_received", 10).result)
+
+    def test_monitor_waits_for_sms_event(self):
+        mon = TempMonitor(self.server.address)
+        mon.connection.factory = Sl4aClient
+        mon.log = Mock()
+        Setup.sms_event, sms_event = "sms_received", Setup.sms_event
+        try:
+            self.phone.add_sms("stop")
+            started = perf_counter()
+            mon.wait_input(5)
+            self.assertTrue(perf_counter() - started < 1)
+            # the handled event is gone, the next wait runs to its timeout
+            started = perf_counter()
+            mon.wait_input(0.2)
+            self.assertTrue(perf_counter() - started >= 0.2)
+        finally:
+            Setup.sms_event = sms_event
+            mon.close_device()
+        self.assertEqual(1, self.phone.calls["eventClearBuffer"])
+
+    def test_latency_per_round_trip(self):
+        server = Sl4aServer(self.phone, latency=0.2).start()
+        client = Sl4aClient(server.address)
+        try:
+            started = perf_counter()
+            results = pipeline(client, [("batteryGetLevel",), ("batteryGetStatus",), ("checkWifiState",)])
+            elapsed = perf_counter() - started
+        finally:
+            client.conn.close()
+            server.stop()
+        self.assertEqual([None, None, None], [result.error for result in results])
+        self.assertTrue(0.2 <= elapsed < 0.4)
+
+    def test_local_device_closes_both_ends(self):
+        connection = DeviceConnection(factory=lambda addr: LocalDevice(self.phone))
+        device = connection.get()
+        self.assertEqual(True, device.checkWifiState().result)
+        conn = device.conn
+        connection.close()
+        self.assertEqual((-1, -1), (conn.sock.fileno(), conn.peer.fileno()))
+
+    def test_wake_lock(self):
+        self.client.wakeLockAcquirePartial()
+        self.assertTrue(self.phone.wake_lock_since is not None)
+        self.client.wakeLockRelease()
+        self.assertTrue(self.phone.wake_lock_since is None)
+        self.assertTrue(self.phone.wake_lock_seconds >= 0)
+
+    def test_monitor_against_simulator(self):
+        mon = TempMonitor(self.server.address)
+        mon.connection.factory = Sl4aClient
+        mon.log = Mock()
+        mon.readings = Mock()
+        try:
+            mon.acquire_device()
+            battery_status, battery_level, temp_f = mon.get_battery_info()
+            mon.release_device()
+        finally:
+            mon.close()
+        expected = c_to_f(get_external_temp_c(20.0)) if Setup.calc_external_temp else c_to_f(20.0)
+        self.assertAlmostEqual(expected, temp_f)
+        self.assertEqual(80, battery_level)
+        self.assertEqual(1, self.phone.calls["wakeLockAcquirePartial"])
+        self.assertEqual(1, self.phone.calls["wakeLockRelease"])
+
+
+class TestBenchmark(TestCase):
+
+    def test_fleet_benchmark(self):
+        temp_max = Setup.temp_max
+        report = run_benchmark(devices=2, cycles=4, latency=0)
+        self.assertEqual(temp_max, Setup.temp_max)
+        self.assertEqual(8, report["cycles"])
+        self.assertEqual(0, report["errors"])
+        self.assertEqual(2, report["alerts"])
+        self.assertEqual(2, report["emails_delivered"])
+        self.assertTrue(report["rpcs_per_cycle"] >= 4)
+        self.assertTrue(report["email_delivery_ms"] >= 0)
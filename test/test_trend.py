@@ -0,0 +1,82 @@
+from unittest import TestCase
+from unittest.mock import MagicMock, Mock
+
+from clock import VirtualClock
+from monitor import TempMonitor, BatteryStatus
+from monitor_setup import Setup
+from trend import RollingTrend
+
+
+class TestTrend(TestCase):
+
+    def test_slope_and_prediction(self):
+        trend = RollingTrend(4)
+        self.assertIsNone(trend.slope())
+        for t in range(10):
+            trend.add(1e9 + t * 60, 70.0 - t)
+        self.assertEqual(4, len(trend))
+        self.assertAlmostEqual(-1 / 60.0, trend.slope())
+        self.assertAlmostEqual(61.0, trend.predict(1e9 + 540))
+        self.assertAlmostEqual(11 * 60, trend.time_to_reach(50.0, 1e9 + 540))
+        self.assertIsNone(trend.time_to_reach(90.0, 1e9 + 540))
+
+    def test_window_drops_old_samples(self):
+        trend = RollingTrend(3)
+        for t, y in [(0, 100.0), (1, 0.0), (2, 1.0), (3, 2.0)]:
+            trend.add(t, y)
+        self.assertAlmostEqual(1.0, trend.slope())
+
+    def test_flat(self):
+        trend = RollingTrend(3)
+        trend.add(0, 70.0)
+        trend.add(60, 70.0)
+        self.assertIsNone(trend.time_to_reach(50.0, 60))
+
+
+class TestPredictiveAlerts(TestCase):
+
+    def setUp(self):
+        Setup.temp_min = 50.0
+        Setup.temp_max = 90.0
+        Setup.predict_horizon = 1800
+        self.clock = VirtualClock(1000)
+        self.mon = TempMonitor(clock=self.clock)
+        self.mon.log = Mock()
+
+    def feed(self, temps, step=60):
+        for i, temp in enumerate(temps):
+            self.clock.advance_to(1000 + i * step)
+            self.mon.trend.add(self.clock.time(), temp)
+
+    def test_freezing_soon(self):
+        self.feed([60.0, 59.0, 58.0, 57.0, 56.0])
+        alerts = self.mon.make_alerts(BatteryStatus.charging, 90, 56.0)
+        self.assertEqual(["Freezing soon"], [alert.title for alert in alerts])
+        self.assertEqual("Freezing soon below 50F in ~6 min: 90+, 56F", alerts[0].msg)
+
+    def test_frying_beyond_horizon(self):
+        self.feed([80.0, 81.0, 82.0, 83.0, 84.0], step=600)
+        self.assertEqual([], self.mon.make_alerts(BatteryStatus.charging, 90, 84.0))
+
+    def test_frying_soon(self):
+        self.feed([80.0, 81.0, 82.0, 83.0, 84.0])
+        alerts = self.mon.make_alerts(BatteryStatus.charging, 90, 84.0)
+        self.assertEqual(["Frying soon"], [alert.title for alert in alerts])
+
+    def test_prediction_keeps_sampling(self):
+        self.addCleanup(setattr, Setup, "adaptive_sampling", Setup.adaptive_sampling)
+        Setup.adaptive_sampling = False
+        self.feed([60.0, 59.0, 58.0, 57.0])
+        self.mon.dispatcher = None
+        self.mon.wake_lock = MagicMock()
+        for name in ("account_wake_lock", "acquire_device", "save_checkpoint"):
+            setattr(self.mon, name, Mock())
+        self.mon.try_get_battery_info = Mock(return_value=(BatteryStatus.charging, 90, 56.0))
+        self.mon.push_readings = Mock(return_value=False)
+        self.mon.open_outbox = Mock(return_value=None)
+        email = Mock(return_value=True)
+        self.mon.notification_channels = Mock(return_value=[("email", email)])
+
+        self.clock.advance(60)
+        self.assertEqual(Setup.sleep_between_get_temp, self.mon.sample_and_alert())
+        self.assertEqual("Freezing soon", email.call_args[0][0].title)
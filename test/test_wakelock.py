@@ -0,0 +1,108 @@
+from datetime import datetime
+from unittest import TestCase
+from unittest.mock import Mock
+
+from clock import VirtualClock
+from monitor import TempMonitor
+from monitor_setup import Setup
+from wakelock import WakeLock
+
+
+class TestWakeLock(TestCase):
+
+    def setUp(self):
+        self.device = Mock()
+        self.wake_lock = WakeLock(lambda: self.device)
+
+    def test_reference_counted(self):
+        self.wake_lock.acquire()
+        with self.wake_lock.held():
+            pass
+        self.assertEqual(1, self.device.wakeLockAcquirePartial.call_count)
+        self.assertEqual(0, self.device.wakeLockRelease.call_count)
+        self.wake_lock.release()
+        self.assertEqual(1, self.device.wakeLockRelease.call_count)
+        self.wake_lock.release()
+        self.assertEqual(1, self.device.wakeLockRelease.call_count)
+
+    def test_reacquired_on_new_device(self):
+        self.wake_lock.acquire()
+        old = self.device
+        self.device = Mock()
+        self.wake_lock.acquire()
+        self.assertEqual(1, old.wakeLockAcquirePartial.call_count)
+        self.assertEqual(1, self.device.wakeLockAcquirePartial.call_count)
+
+    def test_accounting(self):
+        clock = VirtualClock(100.0)
+        self.wake_lock.clock = clock
+        self.wake_lock.acquire()
+        clock.advance_to(110.0)
+        self.wake_lock.release()
+        clock.advance_to(200.0)
+        self.wake_lock.acquire()
+        clock.advance_to(205.0)
+        self.assertEqual(15.0, self.wake_lock.end_cycle())
+        clock.advance_to(207.0)
+        self.wake_lock.release()
+        self.assertEqual(2.0, self.wake_lock.end_cycle())
+        self.assertEqual(17.0, self.wake_lock.total_seconds)
+        self.assertEqual(17.0, self.wake_lock.held_on(datetime.fromtimestamp(100).date()))
+
+    def test_split_across_midnight(self):
+        midnight = datetime(2026, 3, 2).timestamp()
+        self.wake_lock.account(midnight - 30, midnight + 10)
+        self.assertEqual(30, self.wake_lock.held_on(datetime(2026, 3, 1).date()))
+        self.assertEqual(10, self.wake_lock.held_on(datetime(2026, 3, 2).date()))
+
+
+class TestMonitorWakeLock(TestCase):
+
+    def setUp(self):
+        self.mon = TempMonitor()
+        self.mon.device = Mock()
+        self.mon.log = Mock()
+        self.mon.outbox = None
+        self.saved = {name: getattr(Setup, name) for name in ("outbox_dir", "checkpoint_dir")}
+        Setup.outbox_dir = Setup.checkpoint_dir = None
+
+    def tearDown(self):
+        for name, value in self.saved.items():
+            setattr(Setup, name, value)
+
+    def run_idle(self, idle_release):
+        held_while_idle = []
+
+        def cycle():
+            self.mon.acquire_device()
+            self.mon.stop = len(held_while_idle) > 0
+            return 0
+        self.mon.run_cycle = cycle
+        self.mon.process_input = lambda period: held_while_idle.append(self.mon.wake_lock.count)
+        Setup.process_input = True
+        Setup.wakelock_idle_release, saved = idle_release, Setup.wakelock_idle_release
+        try:
+            self.mon.run()
+        finally:
+            Setup.process_input = False
+            Setup.wakelock_idle_release = saved
+        return held_while_idle
+
+    def test_held_while_idle_by_default(self):
+        self.assertFalse(Setup.wakelock_idle_release)
+        self.assertEqual([1], self.run_idle(False))
+        self.assertEqual(0, self.mon.wake_lock.count)
+
+    def test_released_before_idle(self):
+        device = self.mon.device
+        self.assertEqual([0], self.run_idle(True))
+        self.assertEqual(2, device.wakeLockAcquirePartial.call_count)
+        self.assertEqual(2, device.wakeLockRelease.call_count)
+        self.assertEqual(0, self.mon.wake_lock.count)
+
+    def test_delivery_holds_wake_lock(self):
+        counts = []
+        self.mon.dispatcher = None
+        self.mon.deliver("job", lambda: counts.append(self.mon.wake_lock.count))
+        self.assertEqual([1], counts)
+        self.assertEqual(0, self.mon.wake_lock.count)
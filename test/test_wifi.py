@@ -2,7 +2,9 @@ from unittest.mock import Mock
 
 from unittest import TestCase
 
+from connectivity import WifiTracker, WifiState
 from monitor import TempMonitor
+from monitor_setup import Setup
 from wifi import Wifi
 
 
@@ -51,3 +53,44 @@ class TestWifi(TestCase):
         self.assertEqual(3, self.mon.device.checkWifiState.call_count)
         self.assertEqual(3, self.mon.device.toggleWifiState.call_count)
         self.mon.log.assert_called_with("Cannot connect to WiFi")
+
+    def test_ensure_wifi_cached(self):
+        self.mon.device.checkWifiState.return_value = (1, True, None)
+        self.mon.device.wifiGetConnectionInfo.return_value =\
+            (2, {Wifi.state: Wifi.state_completed, Wifi.ip: 101}, None)
+        self.assertTrue(self.mon.ensure_wifi())
+        self.assertTrue(self.mon.ensure_wifi())
+        self.assertTrue(self.mon.ensure_wifi())
+        self.assertEqual(1, self.mon.device.checkWifiState.call_count)
+        self.assertEqual(1, self.mon.device.wifiGetConnectionInfo.call_count)
+        self.assertEqual(2, self.mon.counters["wifi_cached"])
+        self.assertEqual(WifiState.connected, self.mon.wifi.state)
+
+    def test_ensure_wifi_cache_expires(self):
+        self.mon.device.checkWifiState.return_value = (1, True, None)
+        self.mon.device.wifiGetConnectionInfo.return_value =\
+            (2, {Wifi.state: Wifi.state_completed, Wifi.ip: 101}, None)
+        self.mon.ensure_wifi()
+        self.mon.wifi.invalidate()
+        self.mon.ensure_wifi()
+        self.assertEqual(2, self.mon.device.checkWifiState.call_count)
+
+    def test_ensure_wifi_backoff_after_failure(self):
+        self.mon.device.checkWifiState.return_value = (1, False, None)
+        self.mon.device.toggleWifiState.return_value = (1, False, None)
+        self.assertFalse(self.mon.ensure_wifi())
+        self.assertEqual(WifiState.down, self.mon.wifi.state)
+        self.assertFalse(self.mon.ensure_wifi())
+        self.assertEqual(3, self.mon.device.toggleWifiState.call_count)
+        self.assertEqual(1, self.mon.counters["wifi_backoff"])
+
+    def test_tracker_states(self):
+        tracker = WifiTracker()
+        self.assertEqual(WifiState.scanning, tracker.update({Wifi.state: Wifi.state_scanning, Wifi.ip: 0}, 0))
+        self.assertEqual(WifiState.reconnecting, tracker.update({Wifi.state: "associating", Wifi.ip: 0}, 0))
+        self.assertEqual(WifiState.connected, tracker.update({Wifi.state: Wifi.state_completed, Wifi.ip: 5}, 0))
+        self.assertEqual(3, tracker.changes)
+        tracker.toggle_failed(100)
+        tracker.toggle_failed(100)
+        self.assertFalse(tracker.may_toggle(100 + Setup.wifi_backoff_base))
+        self.assertTrue(tracker.may_toggle(100 + 2 * Setup.wifi_backoff_base))